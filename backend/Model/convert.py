@@ -1,19 +1,88 @@
-import tensorflow as tf
+import argparse
 import os
+import sys
+
+import numpy as np
+import tensorflow as tf
+
+parser = argparse.ArgumentParser(description="Convert the trained model into the formats the backend can serve")
+parser.add_argument("--source", default="exported_model", help="Trained model folder or .h5 file")
+parser.add_argument("--output-dir", default=".", help="Where to write the converted artifacts")
+parser.add_argument(
+    "--quantize",
+    choices=["none", "dynamic", "int8"],
+    default="dynamic",
+    help="TFLite quantization: none (float32), dynamic (int8 weights) or int8 (full integer)"
+)
+parser.add_argument(
+    "--representative-dir",
+    help="Folder of sample scans used to calibrate full int8 quantization"
+)
+parser.add_argument("--representative-count", type=int, default=200)
+args = parser.parse_args()
 
 # Check if the exported model exists
-model_path = "exported_model"
+model_path = args.source
 if not os.path.exists(model_path):
     raise FileNotFoundError(f"❌ Model folder '{model_path}' not found. Ensure training was successful.")
 
 # Load the trained MediaPipe model
-model = tf.keras.models.load_model(model_path)
+model = tf.keras.models.load_model(model_path, compile=False)
+
+os.makedirs(args.output_dir, exist_ok=True)
 
 # Convert and save in multiple formats
-keras_model_path = "model.keras"
-h5_model_path = "model.h5"
+keras_model_path = os.path.join(args.output_dir, "model.keras")
+h5_model_path = os.path.join(args.output_dir, "model.h5")
 
 model.save(keras_model_path)  # Save in Keras 3 format
 model.save(h5_model_path)      # Save in legacy H5 format
 
+
+def representative_dataset():
+    """Yield preprocessed sample scans for int8 calibration, decoded exactly as the backend serves them"""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from preprocessing import INPUT_SHAPE, decode_and_preprocess
+
+    extensions = {".jpg", ".jpeg", ".png", ".bmp"}
+    files = sorted(
+        os.path.join(args.representative_dir, name)
+        for name in os.listdir(args.representative_dir)
+        if os.path.splitext(name)[1].lower() in extensions
+    )[:args.representative_count]
+    if not files:
+        raise FileNotFoundError(f"❌ No sample images found in '{args.representative_dir}'")
+
+    for path in files:
+        with open(path, "rb") as f:
+            data = f.read()
+        yield [decode_and_preprocess(data, np.empty((1, *INPUT_SHAPE), dtype=np.float32))]
+
+
+def convert_tflite(quantize):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize in ("dynamic", "int8"):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantize == "int8":
+        if not args.representative_dir:
+            raise ValueError("❌ --representative-dir is required for int8 quantization")
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    return converter.convert()
+
+
+# Always produce a float32 TFLite baseline, plus the requested quantized variant
+tflite_paths = {"none": os.path.join(args.output_dir, "model.tflite")}
+if args.quantize != "none":
+    tflite_paths[args.quantize] = os.path.join(args.output_dir, f"model_{args.quantize}.tflite")
+
+for quantize, path in tflite_paths.items():
+    with open(path, "wb") as f:
+        f.write(convert_tflite(quantize))
+
 print(f"✅ Model successfully converted!\n- Keras 3 Format: {keras_model_path}\n- H5 Format: {h5_model_path}")
+for quantize, path in tflite_paths.items():
+    print(f"- TFLite ({quantize}): {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+print("Serve a TFLite artifact with INFERENCE_ENGINE=tflite and TFLITE_MODEL_PATH=<path>")
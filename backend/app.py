@@ -1,50 +1,87 @@
-from flask import Flask, request, jsonify, session
+import time
+BOOT_STARTED = time.perf_counter()  # the startup breakdown includes module imports
+
+from flask import Flask, Response, request, jsonify, send_file, session
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'  # Suppress TF logging
 
-try:
-    import tensorflow as tf
-    print(f"TensorFlow version: {tf.__version__}")
-except ImportError as e:
-    print(f"Error importing TensorFlow: {e}")
-    exit(1)
+# TensorFlow is imported lazily by init_model (via engines), off the import path
 
 import numpy as np
-from PIL import Image
-import io
 from datetime import datetime, timedelta
 from pymongo import MongoClient
 import logging
-from dotenv import load_dotenv
 import json
-import cv2
-import bcrypt
 from functools import wraps
 import uuid
 import jwt
+import hashlib
 from datetime import datetime, timedelta
-from tensorflow.keras.optimizers import Adam
-from tensorflow.keras.optimizers.legacy import Adam as LegacyAdam
-import time
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
+from cache import PredictionCache
+from config import (
+    ACCESS_LOG, ALLOW_START_WITHOUT_DB, BATCH_DECODE_WORKERS, BATCH_PREDICT_MAX_ARCHIVE_BYTES,
+    BATCH_PREDICT_MAX_FILES, BCRYPT_ROUNDS, COMPRESS_MIN_BYTES, DISABLE_AUTH, DOCTOR_CACHE_ENABLED,
+    DOCTOR_CACHE_SIZE, DOCTOR_CACHE_TTL_SECONDS, ENSURE_INDEXES, EXPORT_DEFAULT_BATCH_SIZE, EXPORT_MAX_BATCH_SIZE,
+    HISTORY_MAX_LIMIT, IMAGE_MAX_AGE_SECONDS, IMAGE_STORE_DIR, IMAGE_STORE_FSYNC, IMAGE_STORE_SHARD_DEPTH,
+    IMAGE_X_SENDFILE, INFERENCE_BATCHING, INFERENCE_ENGINE, INFERENCE_ENGINE_FACTORY, INFERENCE_MAX_BATCH_SIZE,
+    INFERENCE_MAX_WAIT_MS, INFERENCE_POOL_ADDRESS, INFERENCE_POOL_AUTHKEY, INFERENCE_POOL_TIMEOUT,
+    INFERENCE_QUEUE_DEPTH, JWT_EXPIRATION_HOURS, LOG_FORMAT, LOG_LEVEL, LOG_SAMPLE_RATE, MAX_RETRIES,
+    MODEL_DRAIN_TIMEOUT_SECONDS, MODEL_PATH, MODEL_RELOAD_INTERVAL_SECONDS, MONGODB_URI, PASSWORD_HASH_MAX_PENDING,
+    PASSWORD_HASH_QUEUE_TIMEOUT, PASSWORD_HASH_WORKERS, PREDICTION_CACHE_ENABLED, PREDICTION_CACHE_SHARED,
+    PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL_SECONDS, RETRY_DELAY, SCAN_STAGING_MAX_BYTES,
+    SCAN_STAGING_TTL_SECONDS, SECRET_KEY, SHADOW_ENGINE_FACTORY, SHADOW_MAX_BATCH_SIZE, SHADOW_MAX_WAIT_MS,
+    SHADOW_MODEL_PATH, SHADOW_QUEUE_DEPTH, SHADOW_SAMPLE_RATE, STARTUP_MODE, TFLITE_MODEL_PATH, TFLITE_NUM_THREADS,
+    THUMBNAIL_CACHE_MAX_BYTES, THUMBNAIL_DIR, THUMBNAIL_SIZES, TIMING_HEADER, TOKEN_CACHE_ENABLED, UPLOAD_FOLDER
+)
+from database import MongoTimingListener
+from doctor_cache import DoctorCache
+from image_store import BLOBS_COLLECTION, ImageStore, blob_ref_update, image_mimetype
+from records import archive_images, build_scan_record, check_upload_name
+from rollups import compute_stats, record_scan
+from staging import ScanStagingStore
+from export import EXPORT_FORMATS, export_stream
+from http_cache import DataVersions, compress_response, etag_matches, make_etag
+from indexes import ensure_indexes
+from inference import (
+    INPUT_SHAPE, InferenceBatcher, QueueFullError, configured_model_files, engine_from_factory, format_prediction,
+    load_configured_engine, measure_latency, warm_up
+)
+from inference_pool import connect_client
+from logs import annotate, configure_logging, end_request, start_request, verbose
+from metrics import Registry, RequestMetrics
+from model_registry import ModelRegistry, ShadowEvaluator, candidate_loader
+from passwords import HasherBusyError, PasswordHasher
+from queries import (
+    InvalidQueryError, format_patient, format_scan, history_pipeline, list_patients_with_summaries, paginate,
+    parse_limit, parse_record_id, parse_skip, scan_filter_from_args
+)
+from preprocessing import decode_and_preprocess, decode_image, preprocess_image
+from startup import DISABLED, FAILED, READY, StartupTracker
+from thumbnails import ThumbnailCache
 
-load_dotenv()
 
-logging.basicConfig(level=logging.INFO)
+configure_logging(LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATE)
 logger = logging.getLogger(__name__)
+access_logger = logging.getLogger('access')
+if ACCESS_LOG:
+    # The structured access record replaces the server's own per-request line
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
 
 app = Flask(__name__)
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-for-jwt')
-app.config['JWT_EXPIRATION_HOURS'] = 24  # Token valid for 24 hours
-CORS(app, supports_credentials=True)
+app.config['SECRET_KEY'] = SECRET_KEY
+app.config['JWT_EXPIRATION_HOURS'] = JWT_EXPIRATION_HOURS
+# Without it, send_file hands the open file to the WSGI server's file_wrapper (sendfile(2) under gunicorn)
+app.config['USE_X_SENDFILE'] = IMAGE_X_SENDFILE
+CORS(app, supports_credentials=True, expose_headers=['X-Next-Cursor', 'Server-Timing', 'X-Request-ID'])
 
-ALLOW_START_WITHOUT_DB = os.getenv('ALLOW_START_WITHOUT_DB', 'false').lower() == 'true'
-DISABLE_AUTH = os.getenv('DISABLE_AUTH', 'false').lower() == 'true'
-MONGODB_URI = os.getenv('MONGODB_URI')
-MAX_RETRIES = 3
-RETRY_DELAY = 2
+# Everything GET /metrics exposes; components add themselves with metrics_registry.register
+metrics_registry = Registry(prefix='lungvision_')
+request_metrics = RequestMetrics(metrics_registry)
 
 def connect_to_mongodb():
     for attempt in range(MAX_RETRIES):
@@ -54,7 +91,8 @@ def connect_to_mongodb():
                 serverSelectionTimeoutMS=5000,
                 connectTimeoutMS=5000,
                 retryWrites=True,
-                retryReads=True
+                retryReads=True,
+                event_listeners=[MongoTimingListener(request_metrics)]
             )
             # Test the connection
             client.server_info()
@@ -67,32 +105,55 @@ def connect_to_mongodb():
             else:
                 raise
 
-try:
-    client = connect_to_mongodb()
-except Exception as e:
-    logger.error(f"Failed to connect to MongoDB after {MAX_RETRIES} attempts")
-    if ALLOW_START_WITHOUT_DB:
-        logger.warning("Starting without MongoDB. Some endpoints will be limited.")
-        client = None
-    else:
-        raise
+# Filled in by init_database; None until it finishes (or for good without a database)
+client = None
+db = None
+records_collection = None
+scans_collection = None
+patients_collection = None
+doctors_collection = None
+data_versions = None
 
-if client is not None:
-    db = client['lung_cancer_db']
-    records_collection = db['patient_records']
-    scans_collection = db['scans']
-    patients_collection = db['patients']
-    doctors_collection = db['doctors']
-else:
-    db = None
-    records_collection = None
-    scans_collection = None
-    patients_collection = None
-    doctors_collection = None
+startup = StartupTracker(('database', 'model', 'warmup'), started_at=BOOT_STARTED)
+startup.record('imports', time.perf_counter() - BOOT_STARTED)
+
+def init_database():
+    """Connect to MongoDB and ensure indexes; raises unless ALLOW_START_WITHOUT_DB is set"""
+    global client, db, records_collection, scans_collection, patients_collection, doctors_collection, data_versions
+    
+    with startup.step('database'):
+        try:
+            connected = connect_to_mongodb()
+        except Exception as e:
+            logger.error(f"Failed to connect to MongoDB after {MAX_RETRIES} attempts")
+            if not ALLOW_START_WITHOUT_DB:
+                startup.mark('database', FAILED, str(e))
+                raise
+            logger.warning("Starting without MongoDB. Some endpoints will be limited.")
+            startup.mark('database', DISABLED, str(e))
+            return
+        
+        database = connected['lung_cancer_db']
+        if ENSURE_INDEXES:
+            try:
+                ensure_indexes(database)
+            except Exception as e:
+                logger.error(f"Failed to ensure indexes: {str(e)}")
+    
+    records_collection = database['patient_records']
+    scans_collection = database['scans']
+    patients_collection = database['patients']
+    data_versions = DataVersions(database['data_versions'])
+    client, db = connected, database
+    # Last, since token_required answers 503 while the doctors collection is missing
+    doctors_collection = database['doctors']
+    startup.mark('database', READY)
 
-UPLOAD_FOLDER = 'uploads'
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
+image_store = ImageStore(IMAGE_STORE_DIR, shard_depth=IMAGE_STORE_SHARD_DEPTH, fsync=IMAGE_STORE_FSYNC)
+thumbnail_cache = ThumbnailCache(THUMBNAIL_DIR, max_bytes=THUMBNAIL_CACHE_MAX_BYTES)
+metrics_registry.register(thumbnail_cache)
 
 def generate_jwt_token(doctor_id):
     """Generate a JWT token for the doctor"""
@@ -103,12 +164,39 @@ def generate_jwt_token(doctor_id):
     token = jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
     return token
 
+def load_doctor(doctor_id):
+    """Fetch the doctor for an authenticated request (without the password hash)"""
+    return doctors_collection.find_one({'_id': doctor_id}, {'password': 0})
+
+# Call doctor_cache.invalidate(doctor_id) whenever a doctor document is updated or deleted
+doctor_cache = DoctorCache(
+    load_doctor,
+    max_entries=DOCTOR_CACHE_SIZE,
+    ttl_seconds=DOCTOR_CACHE_TTL_SECONDS,
+    cache_tokens=TOKEN_CACHE_ENABLED
+) if DOCTOR_CACHE_ENABLED else None
+metrics_registry.register(doctor_cache)
+
+password_hasher = PasswordHasher(
+    rounds=BCRYPT_ROUNDS,
+    max_workers=PASSWORD_HASH_WORKERS,
+    max_pending=PASSWORD_HASH_MAX_PENDING,
+    queue_timeout=PASSWORD_HASH_QUEUE_TIMEOUT
+)
+metrics_registry.register(password_hasher)
+
+def busy_response():
+    response = jsonify({'success': False, 'message': 'Server is busy, please try again shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '2'
+    return response
+
 def token_required(f):
     """Decorator to protect routes that require authentication"""
     @wraps(f)
     def decorated(*args, **kwargs):
-        # Allow bypassing auth in development if configured
-        if DISABLE_AUTH or doctors_collection is None:
+        # Allow bypassing auth in development if configured, or when deliberately running without MongoDB
+        if DISABLE_AUTH or startup.status('database') == DISABLED:
             request.current_doctor = {
                 '_id': 'dev-doctor',
                 'name': 'Developer',
@@ -116,6 +204,10 @@ def token_required(f):
             }
             return f(*args, **kwargs)
 
+        if doctors_collection is None:
+            # Still connecting, or the connection failed: never treat that as "auth disabled"
+            return jsonify({'message': 'Authentication is unavailable, please try again shortly'}), 503
+
         token = None
         
         # Get token from Authorization header or cookie
@@ -127,9 +219,19 @@ def token_required(f):
             return jsonify({'message': 'Authentication token is missing!'}), 401
         
         try:
-            # Decode the token
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            current_doctor = doctors_collection.find_one({'_id': data['doctor_id']})
+            with request_metrics.stage('auth'):
+                if doctor_cache is not None:
+                    # Skip signature verification for tokens seen before, and Mongo for known doctors
+                    doctor_id = doctor_cache.cached_token(token)
+                    if doctor_id is None:
+                        data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+                        doctor_id = data['doctor_id']
+                        doctor_cache.remember_token(token, doctor_id, data['exp'])
+                    current_doctor = doctor_cache.get_doctor(doctor_id)
+                else:
+                    # Decode the token
+                    data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+                    current_doctor = load_doctor(data['doctor_id'])
             if not current_doctor:
                 return jsonify({'message': 'Invalid authentication token!'}), 401
         except jwt.ExpiredSignatureError:
@@ -144,63 +246,255 @@ def token_required(f):
     
     return decorated
 
-# Load the model with custom objects and error handling
-model = None
-try:
-    # Prefer original model unless overridden
-    model_path = os.getenv('MODEL_PATH', 'Lung_Model.h5')
+def conditional_get(f):
+    """Tag responses with a per-doctor data-version ETag and answer If-None-Match with 304.
+
+    Must be applied after token_required. The 304 path costs one small read of
+    the doctor's version counter and never calls the wrapped endpoint.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if data_versions is None:
+            return f(*args, **kwargs)
+        
+        doctor_id = request.current_doctor['_id']
+        etag = make_etag(request.path, request.query_string.decode('utf-8'), doctor_id, data_versions.get(doctor_id))
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            response = app.response_class(status=304)
+            response.headers['ETag'] = etag
+            response.vary.add('Accept-Encoding')
+            return response
+        
+        response = app.make_response(f(*args, **kwargs))
+        if response.status_code == 200:
+            response.headers['ETag'] = etag
+            # Let browsers keep the body but always revalidate it
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    
+    return decorated
+
+@app.before_request
+def start_request_timing():
+    request.request_id = start_request(request.headers.get('X-Request-ID'))
+    request.timings = request_metrics.start(request.endpoint)
+
+@app.after_request
+def finish_request_timing(response):
+    """Runs after compress; for streamed responses this measures time to the first byte"""
+    timings = getattr(request, 'timings', None)
+    if timings is None:
+        return response
+    if TIMING_HEADER:
+        response.headers['Server-Timing'] = timings.server_timing()
+    response.headers['X-Request-ID'] = request.request_id
+    request_metrics.finish(timings, response.status_code)
+    fields = end_request()
+    if ACCESS_LOG:
+        # One structured record per request instead of free-text lines along the way
+        duration_ms = timings.elapsed_ms()
+        doctor = getattr(request, 'current_doctor', None)
+        access_logger.info(f"{request.method} {request.path} {response.status_code} {duration_ms:.1f}ms", extra={
+            'request_id': request.request_id,
+            'fields': {
+                'endpoint': timings.endpoint,
+                'status': response.status_code,
+                'duration_ms': round(duration_ms, 2),
+                'doctor_id': doctor['_id'] if doctor else None,
+                'stages': {stage: round(ms, 2) for stage, ms in timings.stages.items()},
+                **fields
+            }
+        })
+    return response
+
+@app.after_request
+def compress(response):
+    return compress_response(response, request.accept_encodings, min_bytes=COMPRESS_MIN_BYTES)
+
+# Probes and metrics answer while a background startup is still running
+STARTUP_EXEMPT_ENDPOINTS = {
+    'health_check', 'readiness_check', 'prometheus_metrics', 'inference_metrics', 'auth_metrics'
+}
+MODEL_ENDPOINTS = {'predict', 'predict_batch'}
+
+@app.before_request
+def wait_for_startup():
+    """Answer 503 instead of running without a database or model that is still loading or failed to load"""
+    if request.method == 'OPTIONS' or request.endpoint in STARTUP_EXEMPT_ENDPOINTS:
+        return None
+    model_endpoint = request.endpoint in MODEL_ENDPOINTS
+    if startup.status('database') == FAILED or (
+            model_endpoint and FAILED in (startup.status('model'), startup.status('warmup'))):
+        response = jsonify({'success': False, 'message': 'Service unavailable, see /ready for details'})
+        response.status_code = 503
+        return response
+    if startup.pending('database') or (
+            model_endpoint and (startup.pending('model') or startup.pending('warmup'))):
+        response = jsonify({'success': False, 'message': 'Server is starting, please try again shortly'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    return None
+
+def make_batcher(engine):
+    """Micro-batcher for a newly loaded engine; pool workers already batch across every HTTP worker"""
+    if not INFERENCE_BATCHING or INFERENCE_POOL_ADDRESS:
+        return None
+    batcher = InferenceBatcher(
+        engine.predict,
+        max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+        max_wait_ms=INFERENCE_MAX_WAIT_MS,
+        max_queue_depth=INFERENCE_QUEUE_DEPTH
+    )
+    batcher.start()
+    return batcher
+
+# The served model; replaced in place when the model file changes (MODEL_RELOAD_INTERVAL_SECONDS)
+model_registry = ModelRegistry(make_batcher=make_batcher, drain_timeout=MODEL_DRAIN_TIMEOUT_SECONDS)
+metrics_registry.register(model_registry)
+shadow_evaluator = None
+prediction_cache = None
+
+def model_required(f):
+    """Hold the served model for the whole request, so a hot swap never changes it midway"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        with model_registry.acquire() as served:
+            if served is None:
+                return jsonify({'error': 'AI model not available. Please ensure Lung_Model.h5 is in the backend directory.'}), 503
+            request.served_model = served
+            return f(*args, **kwargs)
+    return decorated
+
+def init_model():
+    """Load the model behind the configured inference engine and run its first inference.
+
+    Failures are logged and leave no model published, disabling the prediction endpoints.
+    """
     
-    # Check if converted model exists
-    if not os.path.exists(model_path):
-        logger.warning(f"Model file not found at {os.path.abspath(model_path)}")
+    try:
+        if INFERENCE_POOL_ADDRESS:
+            # The model lives in the shared inference pool; this process only preprocesses
+            with startup.step('model_load'):
+                engine = connect_client(
+                    INFERENCE_POOL_ADDRESS,
+                    INFERENCE_POOL_AUTHKEY,
+                    timeout=INFERENCE_POOL_TIMEOUT,
+                    retries=MAX_RETRIES,
+                    retry_delay=RETRY_DELAY
+                )
+        elif INFERENCE_ENGINE_FACTORY:
+            with startup.step('model_load'):
+                engine = engine_from_factory(INFERENCE_ENGINE_FACTORY)
+        else:
+            with startup.step('tensorflow_import'):
+                from engines import load_engine, tf
+            logger.info(f"TensorFlow version: {tf.__version__}")
+            with startup.step('model_load'):
+                engine = load_engine(
+                    INFERENCE_ENGINE,
+                    MODEL_PATH,
+                    tflite_path=TFLITE_MODEL_PATH,
+                    num_threads=TFLITE_NUM_THREADS
+                )
+    except Exception as e:
+        logger.warning(f"Failed to load model: {str(e)}")
         logger.warning("Running without AI model - prediction endpoints will be disabled")
-    else:
-        custom_objects = {
-            'Adam': Adam
-        }
-        
-        model = tf.keras.models.load_model(
-            model_path,
-            custom_objects=custom_objects,
-            compile=False
-        )
-        
-        # Recompile the model with legacy optimizer
-        model.compile(
-            optimizer=Adam(learning_rate=0.001),
-            loss='categorical_crossentropy',
-            metrics=['accuracy']
-        )
-        
-        logger.info("Successfully loaded and compiled model")
-except Exception as e:
-    logger.warning(f"Failed to load model: {str(e)}")
-    logger.warning("Running without AI model - prediction endpoints will be disabled")
-    model = None
+        startup.mark('model', FAILED, str(e))
+        startup.mark('warmup', DISABLED)
+        return
+    
+    if engine is None:
+        logger.warning("Running without AI model - prediction endpoints will be disabled")
+        startup.mark('model', DISABLED)
+        startup.mark('warmup', DISABLED)
+        return
+    startup.mark('model', READY)
+    
+    try:
+        startup.record('first_inference', warm_up(engine))
+        latency_ms = measure_latency(engine)
+        logger.info(f"Inference engine '{engine.name}' ready: {latency_ms:.2f} ms per image")
+    except Exception as e:
+        logger.warning(f"Model warmup failed: {str(e)}")
+        logger.warning("Running without AI model - prediction endpoints will be disabled")
+        startup.mark('warmup', FAILED, str(e))
+        return
+    
+    # Only published once warm, so no request pays for the first inference
+    model_registry.publish(engine)
+    if INFERENCE_POOL_ADDRESS:
+        # The pool restarts its own workers to change models
+        metrics_registry.register(engine)
+    elif MODEL_RELOAD_INTERVAL_SECONDS and not INFERENCE_ENGINE_FACTORY:
+        model_registry.watch(configured_model_files(), load_configured_engine, MODEL_RELOAD_INTERVAL_SECONDS)
+    startup.mark('warmup', READY)
+    init_shadow()
+
+def init_shadow():
+    """Start scoring sampled inputs with the candidate model, if one is configured"""
+    global shadow_evaluator
+
+    if not (SHADOW_MODEL_PATH or SHADOW_ENGINE_FACTORY):
+        return
+    shadow = ShadowEvaluator(
+        candidate_loader(SHADOW_MODEL_PATH, SHADOW_ENGINE_FACTORY, INFERENCE_ENGINE, TFLITE_NUM_THREADS),
+        sample_rate=SHADOW_SAMPLE_RATE,
+        max_batch_size=SHADOW_MAX_BATCH_SIZE,
+        max_wait_ms=SHADOW_MAX_WAIT_MS,
+        max_queue_depth=SHADOW_QUEUE_DEPTH
+    )
+    # Loads and warms up the candidate on its own thread; inputs are only sampled once it is ready
+    shadow.start()
+    metrics_registry.register(shadow)
+    shadow_evaluator = shadow
+
+def offer_shadow(tensor, probabilities, inference_ms):
+    """Hand a sampled input to the shadow model; copying it is the only cost to the request"""
+    if shadow_evaluator is not None:
+        shadow_evaluator.offer(tensor, probabilities, inference_ms)
+
+def init_prediction_cache():
+    """Needs both the model version and, for a shared cache, the database"""
+    global prediction_cache
+    
+    served = model_registry.current
+    if served is None or not PREDICTION_CACHE_ENABLED:
+        return
+    cache = PredictionCache(
+        served.version,
+        max_entries=PREDICTION_CACHE_SIZE,
+        ttl_seconds=PREDICTION_CACHE_TTL_SECONDS,
+        collection=db['prediction_cache'] if PREDICTION_CACHE_SHARED and db is not None else None
+    )
+    if INFERENCE_POOL_ADDRESS:
+        served.engine.on_version_change = cache.set_model_version
+    model_registry.listeners.append(cache.set_model_version)
+    metrics_registry.register(cache)
+    prediction_cache = cache
 
-def preprocess_image(image):
-    """Preprocess the image for model input exactly as done during training"""
+def initialize():
+    """Connect to MongoDB while the model loads, then log the startup time breakdown"""
     try:
-        # Convert PIL Image to numpy array
-        img_array = np.array(image)
-        
-        # Resize to 224x224 as done in training
-        img_array = cv2.resize(img_array, (224, 224))
-        
-        # Convert to float32 and normalize to [0, 1]
-        img_array = img_array.astype('float32') / 255.0
-        
-        # Add batch dimension
-        img_array = np.expand_dims(img_array, axis=0)
-        
-        logger.info(f"Preprocessed image shape: {img_array.shape}")
-        logger.info(f"Value range: min={np.min(img_array)}, max={np.max(img_array)}")
-        
-        return img_array
-        
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='startup-db') as executor:
+            database_ready = executor.submit(init_database)
+            init_model()
+            database_ready.result()
+        init_prediction_cache()
+    finally:
+        startup.log_breakdown()
+
+def initialize_in_background():
+    try:
+        initialize()
     except Exception as e:
-        logger.error(f"Error preprocessing image: {str(e)}")
-        raise
+        # Not fatal here: the process stays up and /ready keeps reporting the failure
+        logger.error(f"Startup failed: {str(e)}")
+
+if STARTUP_MODE == 'background':
+    threading.Thread(target=initialize_in_background, name='startup', daemon=True).start()
+else:
+    initialize()
 
 def predict_image(image):
     """Make prediction using the model"""
@@ -209,129 +503,267 @@ def predict_image(image):
         if image.mode != 'RGB':
             image = image.convert('RGB')
         
-        # Preprocess the image
-        processed_image = preprocess_image(image)
-        
-        # Make prediction
-        predictions = model.predict(processed_image)
-        
-        # Get probabilities for each class
-        probabilities = predictions[0]
-        logger.info(f"Raw probabilities: {probabilities}")
-        
-        # Get predicted class - the new model has classes in order: benign, malignant, normal
-        predicted_class_idx = np.argmax(probabilities)
-        class_names = ['benign', 'malignant', 'normal']
-        predicted_class = class_names[predicted_class_idx].capitalize()
-        
-        # Create probabilities dictionary
-        prob_dict = {
-            'benign': float(probabilities[0]),
-            'malignant': float(probabilities[1]),
-            'normal': float(probabilities[2])
-        }
+        served = request.served_model
+        if INFERENCE_POOL_ADDRESS:
+            # Preprocess straight into a shared-memory slot of the inference pool
+            with served.engine.slot() as slot:
+                with request_metrics.stage('preprocess'):
+                    preprocess_image(image, out=slot.input)
+                with request_metrics.stage('inference'):
+                    started = time.perf_counter()
+                    probabilities = slot.run()
+                offer_shadow(slot.input, probabilities, (time.perf_counter() - started) * 1000)
+        else:
+            # Preprocess into this thread's reusable input buffer
+            with request_metrics.stage('preprocess'):
+                processed_image = preprocess_image(image)
+            
+            # Make prediction, sharing a forward pass with concurrent requests when batching is on
+            with request_metrics.stage('inference'):
+                started = time.perf_counter()
+                probabilities = served.predict_one(processed_image)
+            offer_shadow(processed_image, probabilities, (time.perf_counter() - started) * 1000)
+        result = format_prediction(probabilities)
+        if verbose(logger):
+            logger.info(f"Raw probabilities: {probabilities}")
         
-        logger.info(f"Prediction result: {predicted_class} with probabilities {prob_dict}")
-        
-        return {
-            'predicted_class': predicted_class,
-            'confidence': float(probabilities[predicted_class_idx]),
-            'probabilities': prob_dict
-        }
+        return result
         
     except Exception as e:
         logger.error(f"Error making prediction: {str(e)}")
         raise
 
+scan_staging = ScanStagingStore(ttl_seconds=SCAN_STAGING_TTL_SECONDS, max_bytes=SCAN_STAGING_MAX_BYTES)
+
+def prediction_response(prediction, cached, file_bytes, filename):
+    """Build the /predict body and stage the upload for a later /save-record"""
+    version = request.served_model.version
+    response = {**prediction, 'cached': cached, 'modelVersion': version}
+    handle = scan_staging.stage(file_bytes, filename, prediction, request.current_doctor['_id'], version)
+    if handle is not None:
+        response['scanHandle'] = handle
+        response['scanHandleExpiresIn'] = SCAN_STAGING_TTL_SECONDS
+    return jsonify(response)
+
 @app.route('/predict', methods=['POST'])
 @token_required
+@model_required
 def predict():
     try:
-        if model is None:
-            return jsonify({'error': 'AI model not available. Please ensure Lung_Model.h5 is in the backend directory.'}), 503
-            
-        if 'file' not in request.files:
+        # Multipart parsing happens on first access to request.files
+        with request_metrics.stage('parse'):
+            file = request.files.get('file')
+            file_bytes = file.read() if file is not None and file.filename != '' else None
+        if file is None:
             return jsonify({'error': 'No file uploaded'}), 400
-        
-        file = request.files['file']
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
 
         # Read the image file
         try:
-            # Read the file into memory
-            file_bytes = file.read()
-            logger.info(f"File received. Size: {len(file_bytes)} bytes, Filename: {file.filename}")
-            logger.info(f"File content type: {file.content_type}")
-            logger.info(f"File headers: {file.headers}")
-            logger.info(f"File stream position: {file.tell()}")
+            if verbose(logger):
+                logger.info(
+                    f"File received. Size: {len(file_bytes)} bytes, Filename: {file.filename}, "
+                    f"Content type: {file.content_type}"
+                )
             
             if len(file_bytes) == 0:
-                logger.error("Empty file received - no bytes read")
-                logger.error(f"Request files: {list(request.files.keys())}")
-                logger.error(f"Request form: {list(request.form.keys())}")
+                logger.warning(f"Empty file received: {file.filename}")
                 return jsonify({'error': 'Empty file received'}), 400
             
-            file_stream = io.BytesIO(file_bytes)
-            
-            # Open and verify the image
-            image = Image.open(file_stream)
-            image.verify()  # Verify it's a valid image
+            # Serve repeat submissions of the same bytes without decoding or inference
+            cache_key = None
+            if prediction_cache is not None:
+                cache_key = prediction_cache.key_for(file_bytes, request.served_model.version)
+                cached_prediction = prediction_cache.get(cache_key)
+                if cached_prediction is not None:
+                    annotate(diagnosis=cached_prediction['predicted_class'], cached=True)
+                    return prediction_response(cached_prediction, True, file_bytes, file.filename)
             
-            # Reopen because verify() closes the file
-            file_stream.seek(0)
-            image = Image.open(file_stream)
-            
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-                
-            logger.info(f"Image opened successfully. Size: {image.size}, Mode: {image.mode}")
+            # Decode once (this also validates it), downscaling large JPEGs while decoding
+            with request_metrics.stage('decode'):
+                image = decode_image(file_bytes)
+            if verbose(logger):
+                logger.info(f"Image opened successfully. Size: {image.size}, Mode: {image.mode}")
             
         except Exception as e:
             logger.error(f"Failed to open image: {str(e)}")
-            logger.error(f"File details - Size: {len(file_bytes) if 'file_bytes' in locals() else 'unknown'}, Filename: {file.filename}")
+            logger.error(f"File details - Size: {len(file_bytes)}, Filename: {file.filename}")
             return jsonify({'error': f'Invalid image file: {str(e)}'}), 400
 
         # Get prediction
         try:
             prediction = predict_image(image)
-            logger.info(f"Prediction successful: {prediction}")
-            return jsonify(prediction)
+            annotate(diagnosis=prediction['predicted_class'], cached=False)
+            if verbose(logger):
+                logger.info(f"Prediction successful: {prediction}")
+            if cache_key is not None:
+                prediction_cache.set(cache_key, prediction)
+            return prediction_response(prediction, False, file_bytes, file.filename)
+        except QueueFullError as e:
+            logger.warning(f"Prediction rejected: {str(e)}")
+            return jsonify({'error': 'Server is busy, please retry shortly'}), 503
         except Exception as e:
             logger.error(f"Prediction failed: {str(e)}")
             return jsonify({'error': f'Failed to process image: {str(e)}'}), 500
 
     except Exception as e:
-        app.logger.error(f"Error during prediction: {str(e)}")
+        logger.error(f"Error during prediction: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# Shared pool for decoding the files of a /predict/batch request in parallel
+decode_executor = ThreadPoolExecutor(max_workers=BATCH_DECODE_WORKERS, thread_name_prefix='decode')
+
+def collect_batch_uploads():
+    """Gather (filename, bytes) pairs from multipart 'files' fields or a zip 'archive'"""
+    uploads = []
+    for file in request.files.getlist('files') + request.files.getlist('file'):
+        if file.filename:
+            uploads.append((file.filename, file.read()))
+
+    archive = request.files.get('archive')
+    if archive is not None and archive.filename:
+        uploads.extend(archive_images(archive.read(), BATCH_PREDICT_MAX_ARCHIVE_BYTES))
+    return uploads
+
+@app.route('/predict/batch', methods=['POST'])
+@token_required
+@model_required
+def predict_batch():
+    """Predict many images from one multipart request or zip archive"""
+    try:
+        served = request.served_model
+        try:
+            with request_metrics.stage('parse'):
+                uploads = collect_batch_uploads()
+        except (zipfile.BadZipFile, ValueError) as e:
+            return jsonify({'error': f'Invalid archive: {str(e)}'}), 400
+
+        if not uploads:
+            return jsonify({'error': 'No files uploaded'}), 400
+        if len(uploads) > BATCH_PREDICT_MAX_FILES:
+            return jsonify({'error': f'Too many files, maximum is {BATCH_PREDICT_MAX_FILES}'}), 413
+
+        # Answer repeat images from the cache and decode the rest in parallel,
+        # each straight into its own row of one preallocated input array
+        inputs = np.empty((len(uploads), *INPUT_SHAPE), dtype=np.float32)
+        results = []
+        cache_keys = {}
+        decode_futures = {}
+        for index, (filename, data) in enumerate(uploads):
+            result = {'filename': filename, 'success': True, 'cached': False}
+            if prediction_cache is not None:
+                cache_keys[index] = prediction_cache.key_for(data, served.version)
+                cached_prediction = prediction_cache.get(cache_keys[index])
+                if cached_prediction is not None:
+                    result.update({'prediction': cached_prediction, 'cached': True})
+            if 'prediction' not in result:
+                decode_futures[index] = decode_executor.submit(decode_and_preprocess, data, inputs[index])
+            results.append(result)
+
+        # Decode failures are reported per file
+        decoded = []
+        with request_metrics.stage('decode'):
+            for index, future in decode_futures.items():
+                try:
+                    future.result()
+                    decoded.append(index)
+                except Exception as e:
+                    logger.warning(f"Batch decode failed for {results[index]['filename']}: {str(e)}")
+                    results[index].update({'success': False, 'error': f'Invalid image file: {str(e)}'})
+
+        # Run the decoded images through the model as stacked batches
+        for start in range(0, len(decoded), INFERENCE_MAX_BATCH_SIZE):
+            chunk = decoded[start:start + INFERENCE_MAX_BATCH_SIZE]
+            try:
+                with request_metrics.stage('inference'):
+                    started = time.perf_counter()
+                    outputs = served.engine.predict(inputs[chunk])
+                per_image_ms = (time.perf_counter() - started) * 1000 / len(chunk)
+                for index, probabilities in zip(chunk, outputs):
+                    offer_shadow(inputs[index], probabilities, per_image_ms)
+                    results[index]['prediction'] = format_prediction(probabilities)
+                    if index in cache_keys:
+                        prediction_cache.set(cache_keys[index], results[index]['prediction'])
+            except Exception as e:
+                logger.error(f"Batch inference failed for {len(chunk)} images: {str(e)}")
+                for index in chunk:
+                    results[index].update({'success': False, 'error': f'Failed to process image: {str(e)}'})
+
+        succeeded = sum(1 for result in results if result['success'])
+        annotate(images=len(results), succeeded=succeeded)
+        return jsonify({
+            'success': True,
+            'count': len(results),
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'results': results
+        })
+
+    except Exception as e:
+        logger.error(f"Error during batch prediction: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Request, per-stage and component metrics in the Prometheus text format"""
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/inference', methods=['GET'])
+def inference_metrics():
+    """Batcher histograms, prediction cache hit/miss counts, the served model and the shadow comparison"""
+    served = model_registry.current
+    stats = {'batching': served is not None and served.batcher is not None}
+    if stats['batching']:
+        stats.update(served.batcher.stats())
+    stats['cache'] = prediction_cache.stats() if prediction_cache is not None else None
+    stats['model'] = model_registry.stats()
+    stats['shadow'] = shadow_evaluator.stats() if shadow_evaluator is not None else None
+    if INFERENCE_POOL_ADDRESS and served is not None:
+        stats['pool'] = served.engine.stats()
+    return jsonify(stats)
+
+def history_response(records, next_cursor):
+    """JSON list of records, with the next-page cursor in the X-Next-Cursor header"""
+    response = jsonify([format_scan(record) for record in records])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+@app.route('/metrics/auth', methods=['GET'])
+def auth_metrics():
+    """Doctor cache hit rate and the Mongo lookup time it saved"""
+    stats = {'doctor_cache': doctor_cache is not None, 'password_hashing': password_hasher.stats()}
+    if doctor_cache is not None:
+        stats.update(doctor_cache.stats())
+    return jsonify(stats)
+
 @app.route('/history', methods=['GET'])
 @token_required
+@conditional_get
 def get_history():
-    """Get all records across all patients for the authenticated doctor"""
+    """Get records across all patients for the authenticated doctor.
+
+    Optional query params: limit, cursor (from X-Next-Cursor), from/to (ISO dates),
+    diagnosis and patientId.
+    """
     try:
         # Get doctor ID from authenticated user
         doctor_id = request.current_doctor['_id']
         
-        # Get all records for this doctor from MongoDB
-        records = list(scans_collection.find({'doctorId': doctor_id}, {'_id': 0}))
-        
-        # Ensure proper formatting of timestamps and add patient names
-        for record in records:
-            # Format timestamp if it exists
-            if 'timestamp' in record:
-                record['timestamp'] = record['timestamp'].isoformat() if isinstance(record['timestamp'], datetime) else record['timestamp']
-            
-            # Try to get patient name
-            if 'patientId' in record:
-                patient = patients_collection.find_one({'_id': record['patientId']})
-                if patient:
-                    record['patientName'] = patient.get('name', 'Unknown')
-                else:
-                    record['patientName'] = 'Unknown'
-        
-        logger.info(f"Retrieved {len(records)} records for doctor {doctor_id}")
-        return jsonify(records)
+        try:
+            limit = parse_limit(request.args.get('limit'), maximum=HISTORY_MAX_LIMIT)
+            match = scan_filter_from_args(doctor_id, request.args)
+            pipeline = history_pipeline(match, limit=limit, cursor=request.args.get('cursor'))
+        except InvalidQueryError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # One aggregation joins each scan to its patient's name
+        records = list(scans_collection.aggregate(pipeline))
+        records, next_cursor = paginate(records, limit)
+        
+        annotate(records=len(records))
+        return history_response(records, next_cursor)
     
     except Exception as e:
         logger.error(f"Error in history endpoint: {str(e)}")
@@ -339,201 +771,219 @@ def get_history():
 
 @app.route('/history/<patient_id>', methods=['GET'])
 @token_required
+@conditional_get
 def get_patient_history(patient_id):
-    """Get records for a specific patient"""
+    """Get records for a specific patient (same query params as /history)"""
     try:
         # Get doctor ID from authenticated user
         doctor_id = request.current_doctor['_id']
         
         # First check if this patient exists and belongs to this doctor
-        patient = patients_collection.find_one({'_id': patient_id})
+        patient = patients_collection.find_one({'_id': patient_id}, {'name': 1})
         if not patient:
             # If patient doesn't exist in patients collection, check if there are scans with this patient ID
-            scan_exists = scans_collection.find_one({'patientId': patient_id, 'doctorId': doctor_id})
+            scan_exists = scans_collection.find_one({'patientId': patient_id, 'doctorId': doctor_id}, {'_id': 1})
             if not scan_exists:
                 return jsonify({'error': 'Patient not found'}), 404
         
+        try:
+            limit = parse_limit(request.args.get('limit'), maximum=HISTORY_MAX_LIMIT)
+            match = scan_filter_from_args(doctor_id, request.args, patient_id=patient_id)
+            pipeline = history_pipeline(match, limit=limit, cursor=request.args.get('cursor'), with_patient_names=False)
+        except InvalidQueryError as e:
+            return jsonify({'error': str(e)}), 400
+        
         # Get records for specific patient belonging to this doctor
-        records = list(scans_collection.find(
-            {'patientId': patient_id, 'doctorId': doctor_id},
-            {'_id': 0}
-        ))
+        records = list(scans_collection.aggregate(pipeline))
+        records, next_cursor = paginate(records, limit)
         
-        # Ensure proper formatting of timestamps
-        for record in records:
-            if 'timestamp' in record:
-                record['timestamp'] = record['timestamp'].isoformat() if isinstance(record['timestamp'], datetime) else record['timestamp']
-            
-            # Add patient name if available
-            if patient:
+        # The patient is already known, so the name is filled in without a join
+        if patient:
+            for record in records:
                 record['patientName'] = patient.get('name', 'Unknown')
         
-        logger.info(f"Retrieved {len(records)} records for patient {patient_id}")
-        return jsonify(records)
+        annotate(records=len(records))
+        return history_response(records, next_cursor)
     
     except Exception as e:
         logger.error(f"Error in patient history endpoint: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/scans/<scan_id>/image', methods=['GET'])
+@token_required
+def get_scan_image(scan_id):
+    """Serve a scan's image, or with ?size=<name> a downscaled JPEG from the thumbnail cache.
+
+    send_file answers If-None-Match/If-Modified-Since with 304 and Range with 206.
+    """
+    try:
+        size_name = request.args.get('size')
+        if size_name is not None and size_name not in THUMBNAIL_SIZES:
+            return jsonify({'error': f"Unknown size '{size_name}', expected one of: {', '.join(THUMBNAIL_SIZES)}"}), 400
+        if db is None:
+            return jsonify({'error': 'Database not available'}), 500
+
+        scan = db.scans.find_one(
+            {'_id': parse_record_id(scan_id), 'doctorId': request.current_doctor['_id']},
+            {'imagePath': 1, 'imageHash': 1}
+        )
+        image_path = scan.get('imagePath') if scan else None
+        if not image_path or not os.path.isfile(image_path):
+            return jsonify({'error': 'Image not found'}), 404
+        # Stored paths are relative to the working directory; send_file would resolve them against the app root
+        image_path = os.path.abspath(image_path)
+
+        # Records saved before the image store have no digest until `image_store.py migrate` runs
+        digest = scan.get('imageHash')
+        if size_name is None:
+            response = send_file(image_path, mimetype=image_mimetype(image_path), etag=digest or True,
+                                 max_age=IMAGE_MAX_AGE_SECONDS, conditional=True)
+        else:
+            key = digest or hashlib.sha256(image_path.encode()).hexdigest()
+            with request_metrics.stage('thumbnail'):
+                path = thumbnail_cache.get(image_path, key, size_name, THUMBNAIL_SIZES[size_name])
+            response = send_file(path, mimetype='image/jpeg', etag=f"{key}-{size_name}",
+                                 max_age=IMAGE_MAX_AGE_SECONDS, conditional=True)
+        # The URL is tied to one immutable image, but only its doctor may see it
+        response.headers['Cache-Control'] = f"private, max-age={IMAGE_MAX_AGE_SECONDS}, immutable"
+        return response
+
+    except Exception as e:
+        logger.error(f"Error serving scan image: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/export', methods=['GET'])
+@token_required
+def export_records():
+    """Stream the doctor's scans as NDJSON or CSV without building them in memory.
+
+    Query params: format (ndjson or csv), patientId, from/to (ISO dates),
+    diagnosis, batchSize (Mongo cursor batch) and compress=gzip.
+    """
+    try:
+        doctor_id = request.current_doctor['_id']
+        
+        export_format = request.args.get('format', 'ndjson').lower()
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+        compress = request.args.get('compress', '').lower() == 'gzip'
+        
+        try:
+            batch_size = parse_limit(request.args.get('batchSize'), default=EXPORT_DEFAULT_BATCH_SIZE, maximum=EXPORT_MAX_BATCH_SIZE)
+            match = scan_filter_from_args(doctor_id, request.args)
+        except InvalidQueryError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # A server-side cursor fetched batch by batch keeps memory flat
+        cursor = scans_collection.find(match).sort([('timestamp', 1), ('_id', 1)]).batch_size(batch_size)
+        
+        filename = f"scans_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+        mimetype = EXPORT_FORMATS[export_format]
+        if compress:
+            filename += '.gz'
+            mimetype = 'application/gzip'
+        
+        logger.info(f"Starting {export_format} export for doctor {doctor_id}")
+        response = Response(export_stream(cursor, export_format, compress=compress), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    
+    except Exception as e:
+        logger.error(f"Error in export endpoint: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/stats', methods=['GET'])
 @token_required
+@conditional_get
 def get_stats():
+    """Dashboard statistics, read from the per-doctor daily rollups"""
     try:
         # Get doctor ID from authenticated user
         doctor_id = request.current_doctor['_id']
         
-        # Get total number of scans for this doctor
-        total_scans = records_collection.count_documents({'doctorId': doctor_id})
-        
-        # Get number of detected cases (malignant) for this doctor
-        detected_cases = records_collection.count_documents({
-            "doctorId": doctor_id,
-            "diagnosis": "Malignant"
-        })
-        
-        # Get number of active patients (patients with scans in the last 30 days)
-        thirty_days_ago = datetime.now().isoformat()[:10]  # Get date part only
-        active_patients = len(records_collection.distinct("patientId", {
-            "doctorId": doctor_id,
-            "timestamp": {"$gte": thirty_days_ago}
-        }))
-        
-        # Calculate success rate (based on model confidence > 90%)
-        high_confidence_scans = records_collection.count_documents({
-            "doctorId": doctor_id,
-            "confidence": {"$gt": 0.9}
-        })
-        success_rate = (high_confidence_scans / total_scans * 100) if total_scans > 0 else 0
-        
-        # Calculate trends
-        prev_thirty_days = (datetime.now() - timedelta(days=30)).isoformat()[:10]
-        prev_scans = records_collection.count_documents({
-            "doctorId": doctor_id,
-            "timestamp": {"$gte": prev_thirty_days, "$lt": thirty_days_ago}
-        })
-        current_scans = records_collection.count_documents({
-            "doctorId": doctor_id,
-            "timestamp": {"$gte": thirty_days_ago}
-        })
-        
-        scan_trend = calculate_trend(prev_scans, current_scans)
-        
-        prev_cases = records_collection.count_documents({
-            "doctorId": doctor_id,
-            "timestamp": {"$gte": prev_thirty_days, "$lt": thirty_days_ago},
-            "diagnosis": "Malignant"
-        })
-        current_cases = records_collection.count_documents({
-            "doctorId": doctor_id,
-            "timestamp": {"$gte": thirty_days_ago},
-            "diagnosis": "Malignant"
-        })
+        stats = compute_stats(db, doctor_id)
         
-        cases_trend = calculate_trend(prev_cases, current_cases)
-        
-        prev_active = len(records_collection.distinct("patientId", {
-            "doctorId": doctor_id,
-            "timestamp": {"$gte": prev_thirty_days, "$lt": thirty_days_ago}
-        }))
-        current_active = len(records_collection.distinct("patientId", {
-            "doctorId": doctor_id,
-            "timestamp": {"$gte": thirty_days_ago}
-        }))
-        
-        patients_trend = calculate_trend(prev_active, current_active)
-        
-        stats = {
-            "total_scans": {
-                "value": total_scans,
-                "trend": scan_trend
-            },
-            "detected_cases": {
-                "value": detected_cases,
-                "trend": cases_trend
-            },
-            "success_rate": {
-                "value": round(success_rate, 1)
-            },
-            "active_patients": {
-                "value": current_active,
-                "trend": patients_trend
-            }
-        }
-        
-        logger.info(f"Stats calculated: {json.dumps(stats)}")
+        if verbose(logger):
+            logger.info(f"Stats calculated: {json.dumps(stats)}")
         return jsonify(stats)
         
     except Exception as e:
         logger.error(f"Error calculating stats: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-def calculate_trend(prev_value, current_value):
-    """Calculate percentage change between two values"""
-    if prev_value == 0:
-        return {
-            "value": 0,
-            "isPositive": True
-        }
-    
-    change = ((current_value - prev_value) / prev_value) * 100
-    return {
-        "value": round(abs(change), 1),
-        "isPositive": change >= 0
-    }
-
 @app.route('/save-record', methods=['POST'])
 @token_required
 def save_record():
     try:
-        logger.info("Received save record request")
-        logger.info(f"Files in request: {list(request.files.keys())}")
-        logger.info(f"Form data in request: {list(request.form.keys())}")
+        # Multipart parsing happens on first access to request.files/form
+        with request_metrics.stage('parse'):
+            files, form = request.files, request.form
+        if verbose(logger):
+            logger.info(f"Save record request. Files: {list(files.keys())}, Form fields: {list(form.keys())}")
         
-        # Check for required data
-        if 'file' not in request.files:
-            logger.error("No file in save request")
-            return jsonify({'success': False, 'error': 'No file provided'}), 400
+        doctor_id = request.current_doctor['_id']
         
-        file = request.files['file']
-        if file.filename == '':
-            logger.error("Empty filename")
-            return jsonify({'success': False, 'error': 'No file selected'}), 400
-            
         patient_id = request.form.get('patientId')
         if not patient_id:
             logger.error("No patient ID provided")
             return jsonify({'success': False, 'error': 'No patient ID provided'}), 400
-            
+        
+        # Optional client-supplied context (notes); for uploads it also carries the prediction
         prediction_data = request.form.get('prediction')
-        if not prediction_data:
-            logger.error("No prediction data provided")
-            return jsonify({'success': False, 'error': 'No prediction data provided'}), 400
-            
         try:
-            prediction = json.loads(prediction_data)
-            logger.info(f"Parsed prediction data: {prediction}")
+            client_data = json.loads(prediction_data) if prediction_data else None
         except json.JSONDecodeError as e:
             logger.error(f"Invalid prediction data format: {e}")
             return jsonify({'success': False, 'error': 'Invalid prediction data format'}), 400
-
-        # Save the image file with security validation
-        try:
-            if not os.path.exists('uploads'):
-                os.makedirs('uploads')
+        
+        # Prefer the scan staged by /predict: no re-upload, and the prediction is the server's own
+        scan_handle = request.form.get('scanHandle')
+        staged = scan_staging.get(scan_handle, doctor_id) if scan_handle else None
+        
+        if staged is not None:
+            upload_name = staged.filename
+            prediction = dict(staged.prediction)
+            if client_data:
+                prediction['medicalHistory'] = client_data.get('medicalHistory')
+                prediction['doctorNotes'] = client_data.get('doctorNotes')
+        else:
+            if 'file' not in request.files:
+                if scan_handle:
+                    logger.info("Scan handle expired or unknown and no file provided")
+                    return jsonify({'success': False, 'error': 'Scan handle expired, please upload the file again', 'handleExpired': True}), 410
+                logger.error("No file in save request")
+                return jsonify({'success': False, 'error': 'No file provided'}), 400
             
-            # Validate file type
-            allowed_extensions = {'.jpg', '.jpeg', '.png', '.bmp'}
-            file_ext = os.path.splitext(file.filename)[1].lower()
-            if file_ext not in allowed_extensions:
-                return jsonify({'success': False, 'error': 'Invalid file type. Only JPG, PNG, BMP allowed.'}), 400
+            file = request.files['file']
+            if file.filename == '':
+                logger.error("Empty filename")
+                return jsonify({'success': False, 'error': 'No file selected'}), 400
+            upload_name = file.filename
             
-            # Sanitize filename
-            safe_patient_id = secure_filename(str(patient_id))
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{safe_patient_id}_{timestamp}{file_ext}"
-            filepath = os.path.join('uploads', filename)
-            file.save(filepath)
-            logger.info(f"Image saved to: {filepath}")
+            if not client_data:
+                logger.error("No prediction data provided")
+                return jsonify({'success': False, 'error': 'No prediction data provided'}), 400
+            prediction = client_data
+            if verbose(logger):
+                logger.info(f"Parsed prediction data: {prediction}")
+
+        try:
+            check_upload_name(upload_name)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        if db is None:
+            return jsonify({'success': False, 'error': 'Database not available'}), 500
+
+        # Store the image by content hash; identical scans share one blob
+        try:
+            with request_metrics.stage('file_save'):
+                if staged is not None:
+                    stored = image_store.put_bytes(staged.file_bytes)
+                else:
+                    stored = image_store.put_stream(file.stream)
+            db[BLOBS_COLLECTION].update_one(*blob_ref_update(stored), upsert=True)
+            if verbose(logger):
+                logger.info(f"Image stored at {stored.path} ({'new' if stored.created else 'deduplicated'})")
             
         except Exception as e:
             logger.error(f"Failed to save image file: {e}")
@@ -541,27 +991,20 @@ def save_record():
         
         # Create database record
         try:
-            # Get doctor ID from authenticated user
-            doctor_id = request.current_doctor['_id']
-            
-            record = {
-                'patientId': patient_id,
-                'doctorId': doctor_id,  # Associate with the logged-in doctor
-                'timestamp': datetime.now(),
-                'imagePath': filepath,
-                'diagnosis': prediction['predicted_class'],
-                'confidence': prediction['confidence'],
-                'probabilities': prediction['probabilities'],
-                # Optional contextual fields captured at scan-time
-                'medicalHistory': prediction.get('medicalHistory'),
-                'doctorNotes': prediction.get('doctorNotes')
-            }
-            
-            # Save to MongoDB
-            if db is None:
-                return jsonify({'success': False, 'error': 'Database not available'}), 500
+            record = build_scan_record(
+                patient_id, doctor_id, stored, prediction, model_version=staged.model_version if staged else None
+            )
             result = db.scans.insert_one(record)
-            logger.info(f"Record saved to MongoDB with ID: {result.inserted_id}")
+            annotate(record_id=str(result.inserted_id), patient_id=patient_id, staged=staged is not None)
+            if staged is not None:
+                scan_staging.discard(scan_handle)
+            data_versions.bump(doctor_id)
+            
+            # Keep the /stats rollups current; a failure here must not fail the save
+            try:
+                record_scan(db, doctor_id, patient_id, record['timestamp'], record['diagnosis'], record['confidence'])
+            except Exception as e:
+                logger.error(f"Failed to update stats rollups (run 'python rollups.py backfill' to repair): {e}")
             
             return jsonify({
                 'success': True,
@@ -571,12 +1014,11 @@ def save_record():
             
         except Exception as e:
             logger.error(f"Failed to save to MongoDB: {e}")
-            # Try to delete the saved image if database save fails
-            if os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                except:
-                    pass
+            # Drop the reference taken above; the blob itself is left for `image_store.py gc`
+            try:
+                db[BLOBS_COLLECTION].update_one(*blob_ref_update(stored, -1))
+            except Exception:
+                pass
             return jsonify({'success': False, 'error': 'Failed to save record to database'}), 500
 
     except Exception as e:
@@ -607,13 +1049,17 @@ def signup():
             
         # Hash password securely
         password = data['password']
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        try:
+            hashed_password = password_hasher.hash(password)
+        except HasherBusyError:
+            logger.warning("Signup rejected: password hashing pool saturated")
+            return busy_response()
         
         # Create new doctor document
         new_doctor = {
             '_id': str(uuid.uuid4()),
             'email': data['email'],
-            'password': hashed_password.decode('utf-8'),
+            'password': hashed_password,
             'name': data['name'],
             'created_at': datetime.now()
         }
@@ -675,7 +1121,18 @@ def login():
         
         try:
             # Use bcrypt verification for encrypted passwords
-            if bcrypt.checkpw(input_password.encode('utf-8'), stored_password.encode('utf-8')):
+            if password_hasher.verify(input_password, stored_password):
+                # Upgrade hashes made with a different cost factor, off the request path
+                if password_hasher.needs_rehash(stored_password):
+                    doctor_id = doctor['_id']
+                    password_hasher.rehash_in_background(
+                        input_password,
+                        lambda new_hash: doctors_collection.update_one(
+                            {'_id': doctor_id, 'password': stored_password},
+                            {'$set': {'password': new_hash}}
+                        )
+                    )
+                
                 # Generate JWT token
                 token = generate_jwt_token(doctor['_id'])
                 
@@ -692,6 +1149,9 @@ def login():
             else:
                 logger.warning(f"Invalid password for email: {data['email']}")
                 return jsonify({'success': False, 'message': 'Invalid email or password'}), 401
+        except HasherBusyError:
+            logger.warning("Login rejected: password hashing pool saturated")
+            return busy_response()
         except Exception as e:
             logger.error(f"Password verification failed: {str(e)}")
             return jsonify({'success': False, 'message': 'Invalid email or password'}), 401
@@ -720,52 +1180,42 @@ def get_doctor_profile():
 
 @app.route('/patients', methods=['GET'])
 @token_required
+@conditional_get
 def get_patients():
-    """Get all patients for the logged-in doctor"""
+    """Get patients for the logged-in doctor with per-patient scan summaries.
+
+    Optional query params: sort (lastScan, name or created), limit and skip.
+    """
     try:
         # Get doctor ID from authenticated user
         doctor_id = request.current_doctor['_id']
         
-        # Get all patients associated with this doctor
-        patients_list = list(patients_collection.find(
-            {'doctorId': doctor_id}, 
-            {'password': 0}  # Exclude password field if it exists
-        ))
+        # One patients query plus one aggregation grouping their scans, instead of 2 queries per patient
+        try:
+            limit = parse_limit(request.args.get('limit'), maximum=HISTORY_MAX_LIMIT)
+            skip = parse_skip(request.args.get('skip'))
+            patients_list, has_more = list_patients_with_summaries(
+                patients_collection,
+                scans_collection,
+                doctor_id,
+                sort=request.args.get('sort'),
+                skip=skip,
+                limit=limit
+            )
+        except InvalidQueryError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         
         # Format patient data for frontend
-        formatted_patients = []
-        for patient in patients_list:
-            # Get scan count for this patient
-            scan_count = scans_collection.count_documents({
-                'patientId': patient['_id'], 
-                'doctorId': doctor_id
-            })
-            
-            # Get latest scan date
-            latest_scan = scans_collection.find_one(
-                {'patientId': patient['_id'], 'doctorId': doctor_id},
-                sort=[('timestamp', -1)]
-            )
-            
-            # Format patient data
-            patient_data = {
-                'id': patient['_id'],
-                'name': patient.get('name', 'Unknown'),
-                'age': patient.get('age'),
-                'gender': patient.get('gender'),
-                'bloodGroup': patient.get('bloodGroup'),
-                'medicalHistory': patient.get('medicalHistory', ''),
-                'doctorNotes': patient.get('doctorNotes', ''),
-                'scanCount': scan_count,
-                'lastScan': latest_scan['timestamp'].isoformat() if latest_scan and 'timestamp' in latest_scan else None
-            }
-            formatted_patients.append(patient_data)
+        formatted_patients = [format_patient(patient) for patient in patients_list]
         
-        logger.info(f"Found {len(formatted_patients)} patients for doctor {doctor_id}")
-        return jsonify({
+        annotate(patients=len(formatted_patients))
+        response = {
             'success': True,
             'patients': formatted_patients
-        })
+        }
+        if limit is not None:
+            response['pagination'] = {'skip': skip, 'limit': limit, 'hasMore': has_more}
+        return jsonify(response)
         
     except Exception as e:
         logger.error(f"Error retrieving patients: {str(e)}")
@@ -810,6 +1260,7 @@ def add_patient():
         result = patients_collection.insert_one(new_patient)
         
         if result.acknowledged:
+            data_versions.bump(doctor_id)
             return jsonify({
                 'success': True,
                 'message': 'Patient added successfully',
@@ -894,6 +1345,12 @@ def health_check():
             'timestamp': datetime.now().isoformat()
         }), 500
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 200 once the database, model and warmup are done, 503 until then"""
+    state = startup.snapshot()
+    return jsonify(state), 200 if state['ready'] else 503
+
 if __name__ == '__main__':
     debug_mode = os.getenv('FLASK_DEBUG', 'false').lower() == 'true'
     app.run(host='0.0.0.0', port=5000, debug=debug_mode)
\ No newline at end of file
@@ -0,0 +1,1355 @@
+"""Asynchronous entry point serving the same API as app.py on an event loop.
+
+Requests are handled as coroutines, so thousands of idle or slow
+connections cost a few kilobytes each instead of a worker thread. MongoDB
+is accessed through motor, and the CPU-bound work (image decode,
+preprocessing and inference) runs on a bounded thread pool; concurrent
+single-image predictions still share forward passes through the
+InferenceBatcher. Run it with::
+
+    pip install -r requirements-async.txt
+    hypercorn async_app:app --bind 0.0.0.0:5000
+
+Routes, request formats and response payloads match app.py. Differences:
+the prediction cache is in-process only (PREDICTION_CACHE_SHARED is ignored)
+and scan handles from /predict are only redeemable on the same process.
+
+For tests, call ``init_services(database=..., model=...)`` before using
+``app.test_client()``; ``database`` can be a motor database on a local
+mongod or an in-memory stand-in such as ``mongomock_motor``, and ``model``
+any object with ``predict(batch)`` and ``version``.
+"""
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'  # Suppress TF logging
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import wraps
+
+import jwt
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorClient
+from quart import Quart, Response, jsonify, request, send_file
+from quart.wrappers.response import DataBody
+from quart_cors import cors
+from werkzeug.datastructures import ContentRange
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+
+from cache import PredictionCache
+from config import (
+    ACCESS_LOG, ALLOW_START_WITHOUT_DB, ASYNC_CPU_WORKERS, ASYNC_MAX_PENDING_CPU, BATCH_PREDICT_MAX_ARCHIVE_BYTES,
+    BATCH_PREDICT_MAX_FILES, BCRYPT_ROUNDS, COMPRESS_MIN_BYTES, DISABLE_AUTH, DOCTOR_CACHE_ENABLED,
+    DOCTOR_CACHE_SIZE, DOCTOR_CACHE_TTL_SECONDS, ENSURE_INDEXES, EXPORT_DEFAULT_BATCH_SIZE, EXPORT_MAX_BATCH_SIZE,
+    HISTORY_MAX_LIMIT, IMAGE_MAX_AGE_SECONDS, IMAGE_STORE_DIR, IMAGE_STORE_FSYNC, IMAGE_STORE_SHARD_DEPTH,
+    INFERENCE_BATCHING, INFERENCE_ENGINE, INFERENCE_ENGINE_FACTORY, INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_MS,
+    INFERENCE_POOL_ADDRESS, INFERENCE_POOL_AUTHKEY, INFERENCE_POOL_TIMEOUT, INFERENCE_QUEUE_DEPTH,
+    JWT_EXPIRATION_HOURS, LOG_FORMAT, LOG_LEVEL, LOG_SAMPLE_RATE, MAX_RETRIES, MODEL_DRAIN_TIMEOUT_SECONDS,
+    MODEL_PATH, MODEL_RELOAD_INTERVAL_SECONDS, MONGODB_URI, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_QUEUE_TIMEOUT,
+    PASSWORD_HASH_WORKERS, PREDICTION_CACHE_ENABLED, PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL_SECONDS,
+    RETRY_DELAY, SCAN_STAGING_MAX_BYTES, SCAN_STAGING_TTL_SECONDS, SECRET_KEY, SHADOW_ENGINE_FACTORY,
+    SHADOW_MAX_BATCH_SIZE, SHADOW_MAX_WAIT_MS, SHADOW_MODEL_PATH, SHADOW_QUEUE_DEPTH, SHADOW_SAMPLE_RATE,
+    TFLITE_MODEL_PATH, TFLITE_NUM_THREADS, THUMBNAIL_CACHE_MAX_BYTES, THUMBNAIL_DIR, THUMBNAIL_SIZES, TIMING_HEADER,
+    TOKEN_CACHE_ENABLED, UPLOAD_FOLDER
+)
+from database import DB_NAME
+from doctor_cache import DoctorCache
+from image_store import BLOBS_COLLECTION, ImageStore, blob_ref_update, image_mimetype
+from export import EXPORT_FORMATS, csv_chunks, gzip_compressor, ndjson_chunks
+from http_cache import (
+    COMPRESSIBLE_MIMETYPES, ENCODING_ETAG_SUFFIXES, AsyncDataVersions, choose_encoding, compress_body,
+    etag_matches, make_etag
+)
+from indexes import INDEXES
+from inference import (
+    INPUT_SHAPE, InferenceBatcher, QueueFullError, configured_model_files, engine_from_factory, format_prediction,
+    load_configured_engine, measure_latency, warm_up
+)
+from inference_pool import connect_client
+from logs import annotate, configure_logging, end_request, start_request
+from metrics import Registry, RequestMetrics
+from model_registry import ModelRegistry, ShadowEvaluator, candidate_loader
+from passwords import HasherBusyError, PasswordHasher
+from preprocessing import decode_and_preprocess
+from queries import (
+    InvalidQueryError, format_patient, format_scan, history_pipeline, merge_scan_summaries, paginate,
+    parse_limit, parse_record_id, parse_skip, patients_cursor, scan_filter_from_args, scan_summary_pipeline, summary_patient_ids
+)
+from records import archive_images, build_scan_record, check_upload_name
+from rollups import DAILY_COLLECTION, DAILY_PROJECTION, TOTALS_COLLECTION, build_stats, daily_filter, rollup_updates
+from staging import ScanStagingStore
+from startup import DISABLED, FAILED, READY, StartupTracker
+from thumbnails import ThumbnailCache
+
+configure_logging(LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATE)
+logger = logging.getLogger(__name__)
+access_logger = logging.getLogger('access')
+if ACCESS_LOG:
+    # The structured access record replaces the server's own per-request line
+    logging.getLogger('hypercorn.access').setLevel(logging.WARNING)
+
+app = Quart(__name__)
+app.config['SECRET_KEY'] = SECRET_KEY
+app.config['JWT_EXPIRATION_HOURS'] = JWT_EXPIRATION_HOURS
+# Match Flask: request size is bounded by the batch limits, not a global cap
+app.config['MAX_CONTENT_LENGTH'] = None
+app = cors(app, allow_origin='*', expose_headers=['X-Next-Cursor', 'Server-Timing', 'X-Request-ID'])
+
+# Same metrics as app.py, except that Mongo time is not broken out per endpoint:
+# motor runs commands on its own threads, outside the request's context
+metrics_registry = Registry(prefix='lungvision_')
+request_metrics = RequestMetrics(metrics_registry)
+cpu_jobs_pending = metrics_registry.gauge('cpu_jobs_pending', 'Decode/inference jobs running or queued on the CPU pool')
+
+
+class Services:
+    """Process-wide state shared by the routes, built once by ``init_services``"""
+    ready = False
+    client = None
+    db = None
+    records_collection = None
+    scans_collection = None
+    patients_collection = None
+    doctors_collection = None
+    data_versions = None
+    model_registry = None
+    shadow_evaluator = None
+    prediction_cache = None
+    cpu_executor = None
+    cpu_slots = None
+    doctor_cache = None
+    password_hasher = None
+    scan_staging = None
+    image_store = None
+    thumbnail_cache = None
+    startup = StartupTracker(('database', 'model', 'warmup'))
+
+
+services = Services()
+
+
+async def connect_to_mongodb():
+    for attempt in range(MAX_RETRIES):
+        try:
+            client = AsyncIOMotorClient(
+                MONGODB_URI,
+                serverSelectionTimeoutMS=5000,
+                connectTimeoutMS=5000,
+                retryWrites=True,
+                retryReads=True
+            )
+            # Test the connection
+            await client.server_info()
+            logger.info("Successfully connected to MongoDB")
+            return client
+        except Exception as e:
+            logger.error(f"Attempt {attempt + 1} failed to connect to MongoDB: {str(e)}")
+            if attempt < MAX_RETRIES - 1:
+                await asyncio.sleep(RETRY_DELAY)
+            else:
+                raise
+
+
+async def ensure_indexes(db):
+    """Async counterpart of indexes.ensure_indexes; failures are logged, not raised"""
+    for collection_name, models in INDEXES.items():
+        for model in models:
+            try:
+                await db[collection_name].create_indexes([model])
+            except Exception as e:
+                logger.error(f"Could not create index {collection_name}.{model.document['name']}: {e}")
+
+
+def load_model():
+    """Connect to the inference pool or load the configured engine, then warm it up; None if unavailable.
+
+    TensorFlow is only imported here, and not at all when serving from the pool.
+    """
+    startup = services.startup
+    try:
+        if INFERENCE_POOL_ADDRESS:
+            with startup.step('model_load'):
+                model = connect_client(
+                    INFERENCE_POOL_ADDRESS,
+                    INFERENCE_POOL_AUTHKEY,
+                    timeout=INFERENCE_POOL_TIMEOUT,
+                    retries=MAX_RETRIES,
+                    retry_delay=RETRY_DELAY
+                )
+        elif INFERENCE_ENGINE_FACTORY:
+            with startup.step('model_load'):
+                model = engine_from_factory(INFERENCE_ENGINE_FACTORY)
+        else:
+            with startup.step('tensorflow_import'):
+                from engines import load_engine
+            with startup.step('model_load'):
+                model = load_engine(INFERENCE_ENGINE, MODEL_PATH, tflite_path=TFLITE_MODEL_PATH, num_threads=TFLITE_NUM_THREADS)
+        if model is None:
+            logger.warning("Running without AI model - prediction endpoints will be disabled")
+            startup.mark('model', DISABLED)
+            startup.mark('warmup', DISABLED)
+            return None
+        startup.mark('model', READY)
+    except Exception as e:
+        logger.warning(f"Failed to load model: {str(e)}")
+        logger.warning("Running without AI model - prediction endpoints will be disabled")
+        startup.mark('model', FAILED, str(e))
+        startup.mark('warmup', DISABLED)
+        return None
+
+    try:
+        startup.record('first_inference', warm_up(model))
+        latency_ms = measure_latency(model)
+        logger.info(f"Inference engine '{model.name}' ready: {latency_ms:.2f} ms per image")
+    except Exception as e:
+        logger.warning(f"Model warmup failed: {str(e)}")
+        logger.warning("Running without AI model - prediction endpoints will be disabled")
+        startup.mark('warmup', FAILED, str(e))
+        return None
+    startup.mark('warmup', READY)
+    return model
+
+
+def make_batcher(engine):
+    """Micro-batcher for a newly loaded engine; pool workers already batch across every HTTP worker"""
+    if not INFERENCE_BATCHING or INFERENCE_POOL_ADDRESS:
+        return None
+    batcher = InferenceBatcher(
+        engine.predict,
+        max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+        max_wait_ms=INFERENCE_MAX_WAIT_MS,
+        max_queue_depth=INFERENCE_QUEUE_DEPTH
+    )
+    batcher.start()
+    return batcher
+
+
+def start_shadow():
+    """Shadow evaluator for the configured candidate model, loading on its own thread; None if not configured"""
+    if not (SHADOW_MODEL_PATH or SHADOW_ENGINE_FACTORY):
+        return None
+    shadow = ShadowEvaluator(
+        candidate_loader(SHADOW_MODEL_PATH, SHADOW_ENGINE_FACTORY, INFERENCE_ENGINE, TFLITE_NUM_THREADS),
+        sample_rate=SHADOW_SAMPLE_RATE,
+        max_batch_size=SHADOW_MAX_BATCH_SIZE,
+        max_wait_ms=SHADOW_MAX_WAIT_MS,
+        max_queue_depth=SHADOW_QUEUE_DEPTH
+    )
+    shadow.start()
+    metrics_registry.register(shadow)
+    return shadow
+
+
+async def connect_database():
+    """The configured motor database, or None when running without one is allowed"""
+    startup = services.startup
+    with startup.step('database'):
+        try:
+            services.client = await connect_to_mongodb()
+            return services.client[DB_NAME]
+        except Exception as e:
+            logger.error(f"Failed to connect to MongoDB after {MAX_RETRIES} attempts")
+            if not ALLOW_START_WITHOUT_DB:
+                startup.mark('database', FAILED, str(e))
+                raise
+            logger.warning("Starting without MongoDB. Some endpoints will be limited.")
+            startup.mark('database', DISABLED, str(e))
+            return None
+
+
+async def init_services(database=None, model=None):
+    """Connect to MongoDB, load the model and start the inference pool.
+
+    ``database`` and ``model`` override the configured ones, e.g. with an
+    in-memory database and a stub model in tests.
+    """
+    if services.ready:
+        return
+    loop = asyncio.get_running_loop()
+
+    startup = services.startup
+
+    # Decode, preprocessing and inference never run on the event loop
+    services.cpu_executor = ThreadPoolExecutor(max_workers=ASYNC_CPU_WORKERS, thread_name_prefix='cpu')
+    services.cpu_slots = asyncio.Semaphore(ASYNC_MAX_PENDING_CPU)
+    services.model_registry = ModelRegistry(make_batcher=make_batcher, drain_timeout=MODEL_DRAIN_TIMEOUT_SECONDS)
+    metrics_registry.register(services.model_registry)
+    configured_model = model is None
+
+    # Load the model on the CPU pool while MongoDB connects
+    if model is None:
+        model_ready = loop.run_in_executor(services.cpu_executor, load_model)
+    else:
+        for component in ('model', 'warmup'):
+            startup.mark(component, READY)
+    if database is None:
+        try:
+            database = await connect_database()
+        except Exception:
+            if model is None:
+                await model_ready
+            startup.log_breakdown()
+            raise
+    if configured_model:
+        model = await model_ready
+
+    if database is not None:
+        services.db = database
+        services.records_collection = database['patient_records']
+        services.scans_collection = database['scans']
+        services.patients_collection = database['patients']
+        services.doctors_collection = database['doctors']
+        services.data_versions = AsyncDataVersions(database['data_versions'])
+        if ENSURE_INDEXES:
+            await ensure_indexes(database)
+        startup.mark('database', READY)
+
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    services.image_store = ImageStore(IMAGE_STORE_DIR, shard_depth=IMAGE_STORE_SHARD_DEPTH, fsync=IMAGE_STORE_FSYNC)
+    services.thumbnail_cache = ThumbnailCache(THUMBNAIL_DIR, max_bytes=THUMBNAIL_CACHE_MAX_BYTES)
+    metrics_registry.register(services.thumbnail_cache)
+
+    if model is not None:
+        services.model_registry.publish(model)
+        if INFERENCE_POOL_ADDRESS:
+            # The pool restarts its own workers to change models
+            metrics_registry.register(model)
+        elif configured_model and MODEL_RELOAD_INTERVAL_SECONDS and not INFERENCE_ENGINE_FACTORY:
+            services.model_registry.watch(
+                configured_model_files(), load_configured_engine, MODEL_RELOAD_INTERVAL_SECONDS
+            )
+        services.shadow_evaluator = start_shadow()
+    if model is not None and PREDICTION_CACHE_ENABLED:
+        services.prediction_cache = PredictionCache(
+            model.version,
+            max_entries=PREDICTION_CACHE_SIZE,
+            ttl_seconds=PREDICTION_CACHE_TTL_SECONDS
+        )
+        if INFERENCE_POOL_ADDRESS:
+            model.on_version_change = services.prediction_cache.set_model_version
+        services.model_registry.listeners.append(services.prediction_cache.set_model_version)
+        metrics_registry.register(services.prediction_cache)
+
+    services.doctor_cache = DoctorCache(
+        max_entries=DOCTOR_CACHE_SIZE,
+        ttl_seconds=DOCTOR_CACHE_TTL_SECONDS,
+        cache_tokens=TOKEN_CACHE_ENABLED
+    ) if DOCTOR_CACHE_ENABLED else None
+    services.password_hasher = PasswordHasher(
+        rounds=BCRYPT_ROUNDS,
+        max_workers=PASSWORD_HASH_WORKERS,
+        max_pending=PASSWORD_HASH_MAX_PENDING,
+        queue_timeout=PASSWORD_HASH_QUEUE_TIMEOUT
+    )
+    metrics_registry.register(services.doctor_cache)
+    metrics_registry.register(services.password_hasher)
+    services.scan_staging = ScanStagingStore(ttl_seconds=SCAN_STAGING_TTL_SECONDS, max_bytes=SCAN_STAGING_MAX_BYTES)
+    services.ready = True
+    startup.log_breakdown()
+
+
+@app.before_serving
+async def startup():
+    await init_services()
+
+
+@app.after_serving
+async def shutdown():
+    served = services.model_registry.current if services.model_registry is not None else None
+    if served is not None:
+        served.close()
+    if services.shadow_evaluator is not None:
+        services.shadow_evaluator.stop()
+    if services.cpu_executor is not None:
+        services.cpu_executor.shutdown(wait=False)
+    if services.client is not None:
+        services.client.close()
+
+
+async def run_cpu(fn, *args):
+    """Run CPU-bound work on the bounded pool, answering 503 rather than queueing without limit"""
+    if services.cpu_slots.locked():
+        raise QueueFullError(f"CPU pool is saturated ({ASYNC_MAX_PENDING_CPU} pending jobs)")
+    async with services.cpu_slots:
+        cpu_jobs_pending.inc()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(services.cpu_executor, fn, *args)
+        finally:
+            cpu_jobs_pending.dec()
+
+
+async def run_inference(served, tensor):
+    """Probabilities for one preprocessed image, sharing a forward pass when batching is on"""
+    if served.batcher is not None:
+        # Await the batcher's future directly; no thread waits on it
+        return await asyncio.wrap_future(served.batcher.enqueue(tensor))
+    outputs = await run_cpu(served.engine.predict, tensor)
+    return outputs[0]
+
+
+def offer_shadow(tensor, probabilities, inference_ms):
+    """Hand a sampled input to the shadow model; copying it is the only cost to the request"""
+    if services.shadow_evaluator is not None:
+        services.shadow_evaluator.offer(tensor, probabilities, inference_ms)
+
+
+def generate_jwt_token(doctor_id):
+    """Generate a JWT token for the doctor"""
+    payload = {
+        'doctor_id': str(doctor_id),
+        'exp': datetime.utcnow() + timedelta(hours=app.config['JWT_EXPIRATION_HOURS'])
+    }
+    return jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
+
+
+async def load_doctor(doctor_id):
+    """Fetch the doctor for an authenticated request, through the doctor cache when enabled"""
+    doctor_cache = services.doctor_cache
+    if doctor_cache is not None:
+        doctor = doctor_cache.cached_doctor(doctor_id)
+        if doctor is not None:
+            return doctor
+
+    started = time.perf_counter()
+    doctor = await services.doctors_collection.find_one({'_id': doctor_id}, {'password': 0})
+    if doctor_cache is not None:
+        return doctor_cache.store_doctor(doctor_id, doctor, (time.perf_counter() - started) * 1000)
+    return doctor
+
+
+def busy_response():
+    response = jsonify({'success': False, 'message': 'Server is busy, please try again shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '2'
+    return response
+
+
+def token_required(f):
+    """Decorator to protect routes that require authentication"""
+    @wraps(f)
+    async def decorated(*args, **kwargs):
+        # Allow bypassing auth in development if configured
+        if DISABLE_AUTH or services.doctors_collection is None:
+            request.current_doctor = {
+                '_id': 'dev-doctor',
+                'name': 'Developer',
+                'email': 'dev@example.com'
+            }
+            return await f(*args, **kwargs)
+
+        token = None
+        auth_header = request.headers.get('Authorization')
+        if auth_header and auth_header.startswith('Bearer '):
+            token = auth_header.split(' ')[1]
+
+        if not token:
+            return jsonify({'message': 'Authentication token is missing!'}), 401
+
+        doctor_cache = services.doctor_cache
+        try:
+            with request_metrics.stage('auth'):
+                doctor_id = doctor_cache.cached_token(token) if doctor_cache is not None else None
+                if doctor_id is None:
+                    data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+                    doctor_id = data['doctor_id']
+                    if doctor_cache is not None:
+                        doctor_cache.remember_token(token, doctor_id, data['exp'])
+                current_doctor = await load_doctor(doctor_id)
+            if not current_doctor:
+                return jsonify({'message': 'Invalid authentication token!'}), 401
+        except jwt.ExpiredSignatureError:
+            return jsonify({'message': 'Authentication token has expired!'}), 401
+        except (jwt.InvalidTokenError, Exception) as e:
+            logger.error(f"Token validation error: {str(e)}")
+            return jsonify({'message': 'Invalid authentication token!'}), 401
+
+        request.current_doctor = current_doctor
+        return await f(*args, **kwargs)
+
+    return decorated
+
+
+def conditional_get(f):
+    """Async counterpart of app.conditional_get; must be applied after token_required"""
+    @wraps(f)
+    async def decorated(*args, **kwargs):
+        if services.data_versions is None:
+            return await f(*args, **kwargs)
+
+        doctor_id = request.current_doctor['_id']
+        version = await services.data_versions.get(doctor_id)
+        etag = make_etag(request.path, request.query_string.decode('utf-8'), doctor_id, version)
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            response = app.response_class('', status=304)
+            response.headers['ETag'] = etag
+            response.vary.add('Accept-Encoding')
+            return response
+
+        response = await app.make_response(await f(*args, **kwargs))
+        if response.status_code == 200:
+            response.headers['ETag'] = etag
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    return decorated
+
+
+@app.before_request
+async def start_request_timing():
+    request.request_id = start_request(request.headers.get('X-Request-ID'))
+    request.timings = request_metrics.start(request.endpoint)
+
+
+@app.after_request
+async def finish_request_timing(response):
+    """Runs after compress; for streamed responses this measures time to the first byte"""
+    timings = getattr(request, 'timings', None)
+    if timings is None:
+        return response
+    if TIMING_HEADER:
+        response.headers['Server-Timing'] = timings.server_timing()
+    response.headers['X-Request-ID'] = request.request_id
+    request_metrics.finish(timings, response.status_code)
+    fields = end_request()
+    if ACCESS_LOG:
+        duration_ms = timings.elapsed_ms()
+        doctor = getattr(request, 'current_doctor', None)
+        access_logger.info(f"{request.method} {request.path} {response.status_code} {duration_ms:.1f}ms", extra={
+            'request_id': request.request_id,
+            'fields': {
+                'endpoint': timings.endpoint,
+                'status': response.status_code,
+                'duration_ms': round(duration_ms, 2),
+                'doctor_id': doctor['_id'] if doctor else None,
+                'stages': {stage: round(ms, 2) for stage, ms in timings.stages.items()},
+                **fields
+            }
+        })
+    return response
+
+
+@app.after_request
+async def compress(response):
+    """Async counterpart of http_cache.compress_response; streamed bodies are left alone"""
+    if (response.status_code != 200
+            or not isinstance(response.response, DataBody)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    body = await response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    response.set_data(compress_body(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag + ENCODING_ETAG_SUFFIXES[encoding])
+    return response
+
+
+def model_unavailable():
+    return jsonify({'error': 'AI model not available. Please ensure Lung_Model.h5 is in the backend directory.'}), 503
+
+
+def model_required(f):
+    """Hold the served model for the whole request, so a hot swap never changes it midway"""
+    @wraps(f)
+    async def decorated(*args, **kwargs):
+        with services.model_registry.acquire() as served:
+            if served is None:
+                return model_unavailable()
+            request.served_model = served
+            return await f(*args, **kwargs)
+    return decorated
+
+
+def prediction_response(prediction, cached, file_bytes, filename):
+    """Build the /predict body and stage the upload for a later /save-record"""
+    version = request.served_model.version
+    response = {**prediction, 'cached': cached, 'modelVersion': version}
+    handle = services.scan_staging.stage(file_bytes, filename, prediction, request.current_doctor['_id'], version)
+    if handle is not None:
+        response['scanHandle'] = handle
+        response['scanHandleExpiresIn'] = SCAN_STAGING_TTL_SECONDS
+    return jsonify(response)
+
+
+@app.route('/predict', methods=['POST'])
+@token_required
+@model_required
+async def predict():
+    try:
+        with request_metrics.stage('parse'):
+            files = await request.files
+            file = files.get('file')
+            file_bytes = file.read() if file is not None and file.filename != '' else None
+        if file is None:
+            return jsonify({'error': 'No file uploaded'}), 400
+        if file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+
+        if len(file_bytes) == 0:
+            return jsonify({'error': 'Empty file received'}), 400
+
+        # Serve repeat submissions of the same bytes without decoding or inference
+        cache_key = None
+        prediction_cache = services.prediction_cache
+        if prediction_cache is not None:
+            cache_key = prediction_cache.key_for(file_bytes, request.served_model.version)
+            cached_prediction = prediction_cache.get(cache_key)
+            if cached_prediction is not None:
+                annotate(diagnosis=cached_prediction['predicted_class'], cached=True)
+                return prediction_response(cached_prediction, True, file_bytes, file.filename)
+
+        try:
+            # A fresh array per request: the batcher reads it after this coroutine yields
+            with request_metrics.stage('decode'):
+                tensor = await run_cpu(decode_and_preprocess, file_bytes, np.empty((1, *INPUT_SHAPE), dtype=np.float32))
+        except QueueFullError as e:
+            logger.warning(f"Prediction rejected: {str(e)}")
+            return jsonify({'error': 'Server is busy, please retry shortly'}), 503
+        except Exception as e:
+            logger.error(f"Failed to open image: {str(e)}")
+            return jsonify({'error': f'Invalid image file: {str(e)}'}), 400
+
+        try:
+            with request_metrics.stage('inference'):
+                started = time.perf_counter()
+                probabilities = await run_inference(request.served_model, tensor)
+            offer_shadow(tensor, probabilities, (time.perf_counter() - started) * 1000)
+            prediction = format_prediction(probabilities)
+            annotate(diagnosis=prediction['predicted_class'], cached=False)
+            if cache_key is not None:
+                prediction_cache.set(cache_key, prediction)
+            return prediction_response(prediction, False, file_bytes, file.filename)
+        except QueueFullError as e:
+            logger.warning(f"Prediction rejected: {str(e)}")
+            return jsonify({'error': 'Server is busy, please retry shortly'}), 503
+        except Exception as e:
+            logger.error(f"Prediction failed: {str(e)}")
+            return jsonify({'error': f'Failed to process image: {str(e)}'}), 500
+
+    except Exception as e:
+        logger.error(f"Error during prediction: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+async def collect_batch_uploads():
+    """Gather (filename, bytes) pairs from multipart 'files' fields or a zip 'archive'"""
+    files = await request.files
+    uploads = [(file.filename, file.read()) for file in files.getlist('files') + files.getlist('file') if file.filename]
+
+    archive = files.get('archive')
+    if archive is not None and archive.filename:
+        uploads.extend(await run_cpu(archive_images, archive.read(), BATCH_PREDICT_MAX_ARCHIVE_BYTES))
+    return uploads
+
+
+@app.route('/predict/batch', methods=['POST'])
+@token_required
+@model_required
+async def predict_batch():
+    """Predict many images from one multipart request or zip archive"""
+    try:
+        served = request.served_model
+        try:
+            with request_metrics.stage('parse'):
+                uploads = await collect_batch_uploads()
+        except (zipfile.BadZipFile, ValueError) as e:
+            return jsonify({'error': f'Invalid archive: {str(e)}'}), 400
+
+        if not uploads:
+            return jsonify({'error': 'No files uploaded'}), 400
+        if len(uploads) > BATCH_PREDICT_MAX_FILES:
+            return jsonify({'error': f'Too many files, maximum is {BATCH_PREDICT_MAX_FILES}'}), 413
+
+        prediction_cache = services.prediction_cache
+        inputs = np.empty((len(uploads), *INPUT_SHAPE), dtype=np.float32)
+        results = []
+        cache_keys = {}
+        pending = []
+        for index, (filename, data) in enumerate(uploads):
+            result = {'filename': filename, 'success': True, 'cached': False}
+            if prediction_cache is not None:
+                cache_keys[index] = prediction_cache.key_for(data, served.version)
+                cached_prediction = prediction_cache.get(cache_keys[index])
+                if cached_prediction is not None:
+                    result.update({'prediction': cached_prediction, 'cached': True})
+            if 'prediction' not in result:
+                pending.append(index)
+            results.append(result)
+
+        # Decode concurrently on the CPU pool, each file into its own row
+        with request_metrics.stage('decode'):
+            outcomes = await asyncio.gather(
+                *(run_cpu(decode_and_preprocess, uploads[index][1], inputs[index]) for index in pending),
+                return_exceptions=True
+            )
+        decoded = []
+        for index, outcome in zip(pending, outcomes):
+            if isinstance(outcome, QueueFullError):
+                results[index].update({'success': False, 'error': 'Server is busy, please retry shortly'})
+            elif isinstance(outcome, Exception):
+                results[index].update({'success': False, 'error': f'Invalid image file: {str(outcome)}'})
+            else:
+                decoded.append(index)
+
+        for start in range(0, len(decoded), INFERENCE_MAX_BATCH_SIZE):
+            chunk = decoded[start:start + INFERENCE_MAX_BATCH_SIZE]
+            try:
+                with request_metrics.stage('inference'):
+                    started = time.perf_counter()
+                    outputs = await run_cpu(served.engine.predict, inputs[chunk])
+                per_image_ms = (time.perf_counter() - started) * 1000 / len(chunk)
+                for index, probabilities in zip(chunk, outputs):
+                    offer_shadow(inputs[index], probabilities, per_image_ms)
+                    results[index]['prediction'] = format_prediction(probabilities)
+                    if index in cache_keys:
+                        prediction_cache.set(cache_keys[index], results[index]['prediction'])
+            except Exception as e:
+                logger.error(f"Batch inference failed for {len(chunk)} images: {str(e)}")
+                for index in chunk:
+                    results[index].update({'success': False, 'error': f'Failed to process image: {str(e)}'})
+
+        succeeded = sum(1 for result in results if result['success'])
+        annotate(images=len(results), succeeded=succeeded)
+        return jsonify({
+            'success': True,
+            'count': len(results),
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'results': results
+        })
+
+    except Exception as e:
+        logger.error(f"Error during batch prediction: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/metrics', methods=['GET'])
+async def prometheus_metrics():
+    """Request, per-stage and component metrics in the Prometheus text format"""
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/metrics/inference', methods=['GET'])
+async def inference_metrics():
+    """Batcher histograms, prediction cache hit/miss counts, the served model and the shadow comparison"""
+    served = services.model_registry.current
+    stats = {'batching': served is not None and served.batcher is not None}
+    if stats['batching']:
+        stats.update(served.batcher.stats())
+    stats['cache'] = services.prediction_cache.stats() if services.prediction_cache is not None else None
+    stats['model'] = services.model_registry.stats()
+    stats['shadow'] = services.shadow_evaluator.stats() if services.shadow_evaluator is not None else None
+    if INFERENCE_POOL_ADDRESS and served is not None:
+        stats['pool'] = await asyncio.to_thread(served.engine.stats)
+    return jsonify(stats)
+
+
+@app.route('/metrics/auth', methods=['GET'])
+async def auth_metrics():
+    """Doctor cache hit rate and the Mongo lookup time it saved"""
+    stats = {'doctor_cache': services.doctor_cache is not None, 'password_hashing': services.password_hasher.stats()}
+    if services.doctor_cache is not None:
+        stats.update(services.doctor_cache.stats())
+    return jsonify(stats)
+
+
+def history_response(records, next_cursor):
+    """JSON list of records, with the next-page cursor in the X-Next-Cursor header"""
+    response = jsonify([format_scan(record) for record in records])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+
+@app.route('/history', methods=['GET'])
+@token_required
+@conditional_get
+async def get_history():
+    """Get records across all patients for the authenticated doctor (same query params as app.py)"""
+    try:
+        doctor_id = request.current_doctor['_id']
+        try:
+            limit = parse_limit(request.args.get('limit'), maximum=HISTORY_MAX_LIMIT)
+            match = scan_filter_from_args(doctor_id, request.args)
+            pipeline = history_pipeline(match, limit=limit, cursor=request.args.get('cursor'))
+        except InvalidQueryError as e:
+            return jsonify({'error': str(e)}), 400
+
+        records = await services.scans_collection.aggregate(pipeline).to_list(None)
+        records, next_cursor = paginate(records, limit)
+        annotate(records=len(records))
+        return history_response(records, next_cursor)
+
+    except Exception as e:
+        logger.error(f"Error in history endpoint: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/history/<patient_id>', methods=['GET'])
+@token_required
+@conditional_get
+async def get_patient_history(patient_id):
+    """Get records for a specific patient (same query params as /history)"""
+    try:
+        doctor_id = request.current_doctor['_id']
+
+        patient = await services.patients_collection.find_one({'_id': patient_id}, {'name': 1})
+        if not patient:
+            scan_exists = await services.scans_collection.find_one({'patientId': patient_id, 'doctorId': doctor_id}, {'_id': 1})
+            if not scan_exists:
+                return jsonify({'error': 'Patient not found'}), 404
+
+        try:
+            limit = parse_limit(request.args.get('limit'), maximum=HISTORY_MAX_LIMIT)
+            match = scan_filter_from_args(doctor_id, request.args, patient_id=patient_id)
+            pipeline = history_pipeline(match, limit=limit, cursor=request.args.get('cursor'), with_patient_names=False)
+        except InvalidQueryError as e:
+            return jsonify({'error': str(e)}), 400
+
+        records = await services.scans_collection.aggregate(pipeline).to_list(None)
+        records, next_cursor = paginate(records, limit)
+        annotate(records=len(records))
+        if patient:
+            for record in records:
+                record['patientName'] = patient.get('name', 'Unknown')
+        return history_response(records, next_cursor)
+
+    except Exception as e:
+        logger.error(f"Error in patient history endpoint: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/scans/<scan_id>/image', methods=['GET'])
+@token_required
+async def get_scan_image(scan_id):
+    """Async counterpart of app.get_scan_image.
+
+    Quart's send_file handles Range but not the validators, so If-None-Match
+    and If-Range are checked here. Files are streamed in chunks; hypercorn has
+    no sendfile path.
+    """
+    try:
+        size_name = request.args.get('size')
+        if size_name is not None and size_name not in THUMBNAIL_SIZES:
+            return jsonify({'error': f"Unknown size '{size_name}', expected one of: {', '.join(THUMBNAIL_SIZES)}"}), 400
+        if services.db is None:
+            return jsonify({'error': 'Database not available'}), 500
+
+        scan = await services.scans_collection.find_one(
+            {'_id': parse_record_id(scan_id), 'doctorId': request.current_doctor['_id']},
+            {'imagePath': 1, 'imageHash': 1}
+        )
+        image_path = scan.get('imagePath') if scan else None
+        if not image_path:
+            return jsonify({'error': 'Image not found'}), 404
+
+        # A missing file surfaces as FileNotFoundError from the first read below, off the event loop
+        digest = scan.get('imageHash')
+        if size_name is None:
+            path, mimetype, etag = image_path, await asyncio.to_thread(image_mimetype, image_path), digest
+        else:
+            key = digest or hashlib.sha256(image_path.encode()).hexdigest()
+            with request_metrics.stage('thumbnail'):
+                path = await run_cpu(
+                    services.thumbnail_cache.get, image_path, key, size_name, THUMBNAIL_SIZES[size_name]
+                )
+            mimetype, etag = 'image/jpeg', f"{key}-{size_name}"
+
+        # Legacy files without a digest keep Quart's mtime/size ETag
+        response = await send_file(path, mimetype=mimetype, add_etags=etag is None)
+        if etag is not None:
+            response.set_etag(etag)
+        etag = response.get_etag()[0]
+        response.headers['Cache-Control'] = f"private, max-age={IMAGE_MAX_AGE_SECONDS}, immutable"
+        response.expires = None
+
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            not_modified = Response('', status=304)
+            not_modified.set_etag(etag)
+            not_modified.headers['Cache-Control'] = response.headers['Cache-Control']
+            return not_modified
+        # A stale If-Range means the client's partial copy is of another file: send it whole
+        if_range = request.headers.get('If-Range')
+        if if_range is None or if_range.strip('"') == etag:
+            await response.make_conditional(request.range)
+            if response.status_code == 206:
+                # Quart 0.17 hands werkzeug's end-exclusive ContentRange an inclusive end, so rebuild it
+                body = response.response
+                response.content_range = ContentRange('bytes', body.begin, body.end, body.size)
+        return response
+
+    except (FileNotFoundError, IsADirectoryError):
+        return jsonify({'error': 'Image not found'}), 404
+    except RequestedRangeNotSatisfiable:
+        return jsonify({'error': 'Requested range not satisfiable'}), 416
+    except QueueFullError as e:
+        logger.warning(f"Thumbnail rejected: {str(e)}")
+        return jsonify({'error': 'Server is busy, please retry shortly'}), 503
+    except Exception as e:
+        logger.error(f"Error serving scan image: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+async def export_chunks(cursor, export_format, compress, batch_size):
+    """Encode the cursor one fetched batch at a time, gzipping on the fly if requested"""
+    compressor = gzip_compressor() if compress else None
+    encode = ndjson_chunks if export_format == 'ndjson' else lambda docs: csv_chunks(docs, header=False)
+    try:
+        if export_format == 'csv':
+            header = b''.join(csv_chunks([]))
+            yield compressor.compress(header) if compressor else header
+        while True:
+            docs = await cursor.to_list(length=batch_size)
+            if not docs:
+                break
+            for chunk in encode(docs):
+                chunk = compressor.compress(chunk) if compressor else chunk
+                if chunk:
+                    yield chunk
+        if compressor:
+            yield compressor.flush()
+    finally:
+        await cursor.close()
+
+
+@app.route('/export', methods=['GET'])
+@token_required
+async def export_records():
+    """Stream the doctor's scans as NDJSON or CSV (same query params as app.py)"""
+    try:
+        doctor_id = request.current_doctor['_id']
+
+        export_format = request.args.get('format', 'ndjson').lower()
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+        compress = request.args.get('compress', '').lower() == 'gzip'
+
+        try:
+            batch_size = parse_limit(request.args.get('batchSize'), default=EXPORT_DEFAULT_BATCH_SIZE, maximum=EXPORT_MAX_BATCH_SIZE)
+            match = scan_filter_from_args(doctor_id, request.args)
+        except InvalidQueryError as e:
+            return jsonify({'error': str(e)}), 400
+
+        cursor = services.scans_collection.find(match).sort([('timestamp', 1), ('_id', 1)]).batch_size(batch_size)
+
+        filename = f"scans_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+        mimetype = EXPORT_FORMATS[export_format]
+        if compress:
+            filename += '.gz'
+            mimetype = 'application/gzip'
+
+        response = Response(export_chunks(cursor, export_format, compress, batch_size), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    except Exception as e:
+        logger.error(f"Error in export endpoint: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/stats', methods=['GET'])
+@token_required
+@conditional_get
+async def get_stats():
+    """Dashboard statistics, read from the per-doctor daily rollups"""
+    try:
+        doctor_id = request.current_doctor['_id']
+        now = datetime.now()
+        totals = await services.db[TOTALS_COLLECTION].find_one({'_id': doctor_id})
+        days = await services.db[DAILY_COLLECTION].find(daily_filter(doctor_id, now), dict(DAILY_PROJECTION)).to_list(None)
+        return jsonify(build_stats(totals, days, now))
+
+    except Exception as e:
+        logger.error(f"Error calculating stats: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/save-record', methods=['POST'])
+@token_required
+async def save_record():
+    try:
+        doctor_id = request.current_doctor['_id']
+        with request_metrics.stage('parse'):
+            form = await request.form
+            files = await request.files
+
+        patient_id = form.get('patientId')
+        if not patient_id:
+            return jsonify({'success': False, 'error': 'No patient ID provided'}), 400
+
+        prediction_data = form.get('prediction')
+        try:
+            client_data = json.loads(prediction_data) if prediction_data else None
+        except json.JSONDecodeError as e:
+            logger.error(f"Invalid prediction data format: {e}")
+            return jsonify({'success': False, 'error': 'Invalid prediction data format'}), 400
+
+        scan_handle = form.get('scanHandle')
+        staged = services.scan_staging.get(scan_handle, doctor_id) if scan_handle else None
+
+        if staged is not None:
+            upload_name = staged.filename
+            prediction = dict(staged.prediction)
+            if client_data:
+                prediction['medicalHistory'] = client_data.get('medicalHistory')
+                prediction['doctorNotes'] = client_data.get('doctorNotes')
+        else:
+            if 'file' not in files:
+                if scan_handle:
+                    return jsonify({'success': False, 'error': 'Scan handle expired, please upload the file again', 'handleExpired': True}), 410
+                return jsonify({'success': False, 'error': 'No file provided'}), 400
+
+            file = files['file']
+            if file.filename == '':
+                return jsonify({'success': False, 'error': 'No file selected'}), 400
+            upload_name = file.filename
+
+            if not client_data:
+                return jsonify({'success': False, 'error': 'No prediction data provided'}), 400
+            prediction = client_data
+
+        try:
+            check_upload_name(upload_name)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        if services.db is None:
+            return jsonify({'success': False, 'error': 'Database not available'}), 500
+
+        try:
+            with request_metrics.stage('file_save'):
+                if staged is not None:
+                    stored = await asyncio.to_thread(services.image_store.put_bytes, staged.file_bytes)
+                else:
+                    stored = await asyncio.to_thread(services.image_store.put_stream, file.stream)
+            await services.db[BLOBS_COLLECTION].update_one(*blob_ref_update(stored), upsert=True)
+        except Exception as e:
+            logger.error(f"Failed to save image file: {e}")
+            return jsonify({'success': False, 'error': 'Failed to save image file'}), 500
+
+        try:
+            record = build_scan_record(
+                patient_id, doctor_id, stored, prediction, model_version=staged.model_version if staged else None
+            )
+            result = await services.scans_collection.insert_one(record)
+            annotate(record_id=str(result.inserted_id), patient_id=patient_id, staged=staged is not None)
+            if staged is not None:
+                services.scan_staging.discard(scan_handle)
+            await services.data_versions.bump(doctor_id)
+
+            # Keep the /stats rollups current; a failure here must not fail the save
+            try:
+                for collection, query, update in rollup_updates(doctor_id, patient_id, record['timestamp'], record['diagnosis'], record['confidence']):
+                    await services.db[collection].update_one(query, update, upsert=True)
+            except Exception as e:
+                logger.error(f"Failed to update stats rollups (run 'python rollups.py backfill' to repair): {e}")
+
+            return jsonify({
+                'success': True,
+                'message': 'Record saved successfully',
+                'recordId': str(result.inserted_id)
+            })
+
+        except Exception as e:
+            logger.error(f"Failed to save to MongoDB: {e}")
+            # Drop the reference taken above; the blob itself is left for `image_store.py gc`
+            try:
+                await services.db[BLOBS_COLLECTION].update_one(*blob_ref_update(stored, -1))
+            except Exception:
+                pass
+            return jsonify({'success': False, 'error': 'Failed to save record to database'}), 500
+
+    except Exception as e:
+        logger.error(f"Unexpected error in save_record endpoint: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/signup', methods=['POST'])
+async def signup():
+    try:
+        doctors_collection = services.doctors_collection
+        if doctors_collection is None:
+            return jsonify({'success': False, 'message': 'Database not available'}), 500
+
+        data = await request.get_json()
+        if not data:
+            return jsonify({'success': False, 'message': 'No data provided'}), 400
+
+        for field in ['email', 'password', 'name']:
+            if field not in data:
+                return jsonify({'success': False, 'message': f'Missing required field: {field}'}), 400
+
+        if await doctors_collection.find_one({'email': data['email']}):
+            return jsonify({'success': False, 'message': 'Email already registered'}), 409
+
+        try:
+            hashed_password = await asyncio.to_thread(services.password_hasher.hash, data['password'])
+        except HasherBusyError:
+            logger.warning("Signup rejected: password hashing pool saturated")
+            return busy_response()
+
+        new_doctor = {
+            '_id': str(uuid.uuid4()),
+            'email': data['email'],
+            'password': hashed_password,
+            'name': data['name'],
+            'created_at': datetime.now()
+        }
+        result = await doctors_collection.insert_one(new_doctor)
+
+        if result.acknowledged:
+            return jsonify({
+                'success': True,
+                'message': 'Doctor registered successfully',
+                'token': generate_jwt_token(new_doctor['_id']),
+                'doctor': {
+                    'id': new_doctor['_id'],
+                    'name': new_doctor['name'],
+                    'email': new_doctor['email']
+                }
+            })
+        return jsonify({'success': False, 'message': 'Failed to register doctor'}), 500
+
+    except Exception as e:
+        logger.error(f"Error in signup: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/login', methods=['POST'])
+async def login():
+    try:
+        data = await request.get_json()
+        if not data:
+            return jsonify({'success': False, 'message': 'No data provided'}), 400
+
+        if 'email' not in data or 'password' not in data:
+            return jsonify({'success': False, 'message': 'Email and password are required'}), 400
+
+        doctors_collection = services.doctors_collection
+        if doctors_collection is None:
+            return jsonify({'success': False, 'message': 'Database not available'}), 500
+
+        doctor = await doctors_collection.find_one({'email': data['email']})
+        if not doctor:
+            logger.warning(f"Login attempt with non-existent email: {data['email']}")
+            return jsonify({'success': False, 'message': 'Invalid email or password'}), 401
+
+        if 'password' not in doctor:
+            logger.error("Doctor record is missing password field")
+            return jsonify({'success': False, 'message': 'Invalid account data'}), 500
+
+        input_password = data['password']
+        stored_password = doctor['password']
+        password_hasher = services.password_hasher
+        try:
+            if await asyncio.to_thread(password_hasher.verify, input_password, stored_password):
+                # Upgrade hashes made with a different cost factor, off the request path
+                if password_hasher.needs_rehash(stored_password):
+                    loop = asyncio.get_running_loop()
+                    doctor_id = doctor['_id']
+                    password_hasher.rehash_in_background(
+                        input_password,
+                        # Called on the hashing thread; the update itself runs on the event loop
+                        lambda new_hash: asyncio.run_coroutine_threadsafe(
+                            doctors_collection.update_one(
+                                {'_id': doctor_id, 'password': stored_password},
+                                {'$set': {'password': new_hash}}
+                            ),
+                            loop
+                        )
+                    )
+
+                return jsonify({
+                    'success': True,
+                    'message': 'Login successful',
+                    'token': generate_jwt_token(doctor['_id']),
+                    'doctor': {
+                        'id': doctor['_id'],
+                        'name': doctor['name'],
+                        'email': doctor['email']
+                    }
+                })
+            logger.warning(f"Invalid password for email: {data['email']}")
+            return jsonify({'success': False, 'message': 'Invalid email or password'}), 401
+        except HasherBusyError:
+            logger.warning("Login rejected: password hashing pool saturated")
+            return busy_response()
+        except Exception as e:
+            logger.error(f"Password verification failed: {str(e)}")
+            return jsonify({'success': False, 'message': 'Invalid email or password'}), 401
+
+    except Exception as e:
+        logger.error(f"Error in login: {str(e)}")
+        return jsonify({'success': False, 'message': 'Login failed'}), 500
+
+
+@app.route('/doctor/profile', methods=['GET'])
+@token_required
+async def get_doctor_profile():
+    """Get the profile of the currently authenticated doctor"""
+    doctor = request.current_doctor
+    return jsonify({
+        'success': True,
+        'doctor': {
+            'id': doctor['_id'],
+            'name': doctor['name'],
+            'email': doctor['email']
+        }
+    })
+
+
+@app.route('/patients', methods=['GET'])
+@token_required
+@conditional_get
+async def get_patients():
+    """Get patients for the logged-in doctor with per-patient scan summaries (sort, limit, skip)"""
+    try:
+        doctor_id = request.current_doctor['_id']
+        sort = request.args.get('sort')
+        try:
+            limit = parse_limit(request.args.get('limit'), maximum=HISTORY_MAX_LIMIT)
+            skip = parse_skip(request.args.get('skip'))
+            cursor = patients_cursor(services.patients_collection, doctor_id, sort=sort, skip=skip, limit=limit)
+        except InvalidQueryError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        patients = await cursor.to_list(None)
+        pipeline = scan_summary_pipeline(doctor_id, summary_patient_ids(patients, sort))
+        summaries = await services.scans_collection.aggregate(pipeline).to_list(None)
+        patients, has_more = merge_scan_summaries(patients, summaries, sort=sort, skip=skip, limit=limit)
+        annotate(patients=len(patients))
+
+        response = {
+            'success': True,
+            'patients': [format_patient(patient) for patient in patients]
+        }
+        if limit is not None:
+            response['pagination'] = {'skip': skip, 'limit': limit, 'hasMore': has_more}
+        return jsonify(response)
+
+    except Exception as e:
+        logger.error(f"Error retrieving patients: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/patients', methods=['POST'])
+@token_required
+async def add_patient():
+    """Add a new patient for the logged-in doctor"""
+    try:
+        doctor_id = request.current_doctor['_id']
+
+        data = await request.get_json()
+        if not data:
+            return jsonify({'success': False, 'message': 'No data provided'}), 400
+
+        for field in ['name', 'age', 'gender']:
+            if field not in data:
+                return jsonify({'success': False, 'message': f'Missing required field: {field}'}), 400
+
+        new_patient = {
+            '_id': data.get('patientId') or str(uuid.uuid4()),
+            'name': data['name'],
+            'age': data.get('age'),
+            'gender': data.get('gender'),
+            'bloodGroup': data.get('bloodGroup'),
+            'medicalHistory': data.get('medicalHistory', ''),
+            'doctorNotes': data.get('doctorNotes', ''),
+            'doctorId': doctor_id,
+            'created_at': datetime.now()
+        }
+        result = await services.patients_collection.insert_one(new_patient)
+
+        if result.acknowledged:
+            await services.data_versions.bump(doctor_id)
+            return jsonify({
+                'success': True,
+                'message': 'Patient added successfully',
+                'patient': {
+                    'id': new_patient['_id'],
+                    'name': new_patient['name']
+                }
+            })
+        return jsonify({'success': False, 'message': 'Failed to add patient'}), 500
+
+    except Exception as e:
+        logger.error(f"Error adding patient: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/patients/<patient_id>', methods=['GET'])
+@token_required
+async def get_patient(patient_id):
+    """Get a specific patient's details"""
+    try:
+        doctor_id = request.current_doctor['_id']
+        records_collection = services.records_collection
+        owner = {'patientId': patient_id, 'doctorId': doctor_id}
+
+        if not await records_collection.find_one(owner):
+            return jsonify({'success': False, 'message': 'Patient not found'}), 404
+
+        patient = await services.patients_collection.find_one({'_id': patient_id})
+        if not patient:
+            return jsonify({'success': False, 'message': 'Patient not found'}), 404
+
+        scan_count, latest_scan, scans = await asyncio.gather(
+            records_collection.count_documents(owner),
+            records_collection.find_one(owner, sort=[('timestamp', -1)]),
+            records_collection.find(owner, {'_id': 0, 'diagnosis': 1, 'confidence': 1, 'timestamp': 1}).sort('timestamp', -1).to_list(None)
+        )
+
+        return jsonify({
+            'success': True,
+            'patient': {
+                'id': patient['_id'],
+                'name': patient.get('name', 'Unknown'),
+                'age': patient.get('age'),
+                'gender': patient.get('gender'),
+                'medical_history': patient.get('medical_history', ''),
+                'scanCount': scan_count,
+                'lastScan': latest_scan['timestamp'] if latest_scan else None,
+                'scans': scans
+            }
+        })
+
+    except Exception as e:
+        logger.error(f"Error retrieving patient: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/health', methods=['GET'])
+async def health_check():
+    """Health check endpoint to verify API is running"""
+    return jsonify({
+        'status': 'healthy',
+        'message': 'API is running',
+        'timestamp': datetime.now().isoformat()
+    })
+
+
+
+@app.route('/ready', methods=['GET'])
+async def readiness_check():
+    """Readiness probe: 200 once the database, model and warmup are done, 503 until then"""
+    state = services.startup.snapshot()
+    return jsonify(state), 200 if state['ready'] else 503
+
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,381 @@
+"""Load test: throughput and latency percentiles of the main endpoints at fixed concurrency.
+
+Run from the backend directory:
+
+    python benchmarks/load_bench.py --scans 10000 --concurrency 16
+    python benchmarks/load_bench.py --save-baseline benchmarks/baseline.json
+    python benchmarks/load_bench.py --baseline benchmarks/baseline.json   # exits 1 on regression
+
+The Flask app is started in-process on a free port with a stub model
+(benchmarks/stub_model.py; ``--real-model`` serves the configured one) and
+an in-memory MongoDB stand-in (mongomock) seeded with synthetic doctors,
+patients and scans. mongomock is fine for CI-sized runs; for representative
+numbers, or beyond ~100k scans, point ``--mongodb-uri`` at a disposable local
+mongod. The app's database there is dropped first with ``--reset``.
+
+Load is generated by a separate process, so client work does not compete
+with the server for the GIL. Each endpoint gets ``--warmup`` unmeasured
+requests, then ``--requests`` measured ones from ``--concurrency``
+keep-alive connections. A baseline comparison flags an endpoint when its p95
+grows, or its throughput drops, by more than ``--tolerance``.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import multiprocessing as mp
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+ENDPOINTS = ('predict', 'history', 'patients', 'stats')
+DIAGNOSES = ('Benign', 'Malignant', 'Normal')
+SEED_BATCH_SIZE = 10000
+
+
+def configure_environment(args):
+    """Settings the app reads at import time"""
+    os.environ['STARTUP_MODE'] = 'eager'
+    os.environ['PREDICTION_CACHE'] = 'true' if args.prediction_cache else 'false'
+    if not args.real_model:
+        os.environ['INFERENCE_ENGINE_FACTORY'] = 'stub_model:make'
+    if args.mongodb_uri:
+        os.environ['MONGODB_URI'] = args.mongodb_uri
+    else:
+        import mongomock
+        import pymongo
+
+        # app.py does `from pymongo import MongoClient` when imported below
+        pymongo.MongoClient = mongomock.MongoClient
+        os.environ['MONGODB_URI'] = 'mongodb://benchmark'
+
+
+def seed(db, scans, doctors, patients_per_doctor, days, rng):
+    """Insert synthetic doctors, patients and scans; returns the doctor ids"""
+    from image_store import StoredImage
+    from records import build_scan_record
+    from rollups import backfill
+
+    now = datetime.now()
+    doctor_ids = [str(uuid.uuid4()) for _ in range(doctors)]
+    db['doctors'].insert_many([
+        {
+            '_id': doctor_id,
+            'email': f"doctor{index}@benchmark.local",
+            'password': '!',  # not a bcrypt hash, so nobody can log in as a benchmark doctor
+            'name': f"Benchmark Doctor {index}",
+            'created_at': now
+        }
+        for index, doctor_id in enumerate(doctor_ids)
+    ])
+
+    patients = []
+    for doctor_id in doctor_ids:
+        for index in range(patients_per_doctor):
+            patients.append({
+                '_id': str(uuid.uuid4()),
+                'name': f"Patient {index}",
+                'age': int(rng.integers(20, 90)),
+                'gender': random.choice(('Male', 'Female')),
+                'bloodGroup': None,
+                'medicalHistory': '',
+                'doctorNotes': '',
+                'doctorId': doctor_id,
+                'created_at': now - timedelta(days=days)
+            })
+    db['patients'].insert_many(patients)
+
+    started = time.perf_counter()
+    for start in range(0, scans, SEED_BATCH_SIZE):
+        count = min(SEED_BATCH_SIZE, scans - start)
+        owners = rng.integers(0, len(patients), count)
+        ages = rng.uniform(0, days * 86400, count)
+        confidences = rng.uniform(0.34, 1.0, count)
+        records = []
+        for owner, age, confidence in zip(owners, ages, confidences):
+            patient = patients[owner]
+            diagnosis = DIAGNOSES[int(owner + age) % len(DIAGNOSES)]
+            prediction = {
+                'predicted_class': diagnosis,
+                'confidence': float(confidence),
+                'probabilities': {name.lower(): float(confidence) if name == diagnosis else float(1 - confidence) / 2
+                                  for name in DIAGNOSES}
+            }
+            # Only the record shape matters here; no blob is written for seeded scans
+            digest = uuid.uuid4().hex * 2
+            image = StoredImage(digest, f"uploads/benchmark/{digest}", 0, False)
+            records.append(build_scan_record(
+                patient['_id'], patient['doctorId'], image, prediction, timestamp=now - timedelta(seconds=float(age))
+            ))
+        db['scans'].insert_many(records, ordered=False)
+        print(f"  seeded {start + count}/{scans} scans", end='\r', flush=True)
+    print(f"  seeded {scans} scans in {time.perf_counter() - started:.1f}s")
+
+    backfill(db)
+    return doctor_ids
+
+
+def scan_uploads(count, size):
+    """Distinct PNG-encoded synthetic scans, so the prediction cache cannot short-circuit /predict"""
+    from preprocess_bench import encode, synthetic_scan
+
+    return [encode(synthetic_scan(size, size, seed=index), 'PNG') for index in range(count)]
+
+
+def multipart(filename, data, boundary):
+    return b''.join([
+        f"--{boundary}\r\n".encode(),
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'.encode(),
+        b'Content-Type: image/png\r\n\r\n',
+        data,
+        f"\r\n--{boundary}--\r\n".encode()
+    ])
+
+
+def build_requests(endpoint, tokens, uploads):
+    """(method, path, headers, body) variants cycled through by the load generator"""
+    requests = []
+    for index, token in enumerate(tokens):
+        headers = {'Authorization': f"Bearer {token}", 'Accept-Encoding': 'gzip'}
+        if endpoint == 'predict':
+            for number, data in enumerate(uploads[index::len(tokens)] or uploads):
+                boundary = uuid.uuid4().hex
+                requests.append(('POST', '/predict', {
+                    **headers,
+                    'Content-Type': f"multipart/form-data; boundary={boundary}"
+                }, multipart(f"scan{number}.png", data, boundary)))
+        elif endpoint == 'history':
+            requests.append(('GET', '/history?limit=50', headers, None))
+        elif endpoint == 'patients':
+            requests.append(('GET', '/patients?limit=20&sort=lastScan', headers, None))
+        elif endpoint == 'stats':
+            requests.append(('GET', '/stats', headers, None))
+    return requests
+
+
+def drive(port, requests, concurrency, warmup, total, results):
+    """Load generator process: warm up, then send ``total`` requests from ``concurrency`` threads"""
+
+    def run(count, samples):
+        counter = itertools.count()
+
+        def worker():
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+            while True:
+                index = next(counter)
+                if index >= count:
+                    break
+                method, path, headers, body = requests[index % len(requests)]
+                started = time.perf_counter()
+                try:
+                    conn.request(method, path, body=body, headers=headers)
+                    response = conn.getresponse()
+                    response.read()
+                    status = response.status
+                except Exception:
+                    conn.close()
+                    status = 0
+                samples.append(((time.perf_counter() - started) * 1000, status))
+            conn.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+    run(warmup, [])
+    samples = []
+    elapsed = run(total, samples)
+    results.send((samples, elapsed))
+    results.close()
+
+
+def summarize(samples, elapsed):
+    ok = np.array([latency for latency, status in samples if 200 <= status < 400])
+    statuses = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    summary = {
+        'requests': len(samples),
+        'errors': len(samples) - len(ok),
+        'statuses': statuses,
+        'throughput_rps': round(len(ok) / elapsed, 2) if elapsed else 0.0
+    }
+    for name, q in (('p50_ms', 50), ('p95_ms', 95), ('p99_ms', 99)):
+        summary[name] = round(float(np.percentile(ok, q)), 2) if len(ok) else None
+    summary['mean_ms'] = round(float(ok.mean()), 2) if len(ok) else None
+    return summary
+
+
+def compare(results, baseline, tolerance):
+    """Per-endpoint changes against the baseline; returns the names of regressed endpoints"""
+    regressions = []
+    for endpoint, current in results['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(endpoint)
+        if not previous or not previous.get('p95_ms') or not current.get('p95_ms'):
+            continue
+        p95_change = current['p95_ms'] / previous['p95_ms'] - 1
+        rps_change = current['throughput_rps'] / previous['throughput_rps'] - 1 if previous['throughput_rps'] else 0
+        regressed = p95_change > tolerance or rps_change < -tolerance or current['errors'] > previous['errors']
+        current['vs_baseline'] = {
+            'p95_change': round(p95_change, 4),
+            'throughput_change': round(rps_change, 4),
+            'regressed': regressed
+        }
+        if regressed:
+            regressions.append(endpoint)
+    return regressions
+
+
+def print_table(results):
+    print(f"\n{'endpoint':<10} {'requests':>8} {'errors':>6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  baseline")
+    for endpoint, summary in results['endpoints'].items():
+        versus = summary.get('vs_baseline')
+        note = ''
+        if versus:
+            note = (f"p95 {versus['p95_change']:+.1%}, req/s {versus['throughput_change']:+.1%}"
+                    f"{'  REGRESSED' if versus['regressed'] else ''}")
+        cells = [f"{summary[key]:>9.2f}" if summary[key] is not None else f"{'-':>9}"
+                 for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms')]
+        print(f"{endpoint:<10} {summary['requests']:>8} {summary['errors']:>6} {' '.join(cells)}  {note}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scans', type=int, default=10000, help='Synthetic scans to seed (1k-1M)')
+    parser.add_argument('--doctors', type=int, default=10)
+    parser.add_argument('--patients-per-doctor', type=int, default=100)
+    parser.add_argument('--days', type=int, default=180, help='Spread scan timestamps over this many days')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help=f"Comma-separated subset of {ENDPOINTS}")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='Measured requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=50, help='Unmeasured requests per endpoint')
+    parser.add_argument('--image-size', type=int, default=512, help='Edge length of the uploaded synthetic scans')
+    parser.add_argument('--mongodb-uri', default=None, help='Use a real (disposable) mongod instead of mongomock')
+    parser.add_argument('--reset', action='store_true', help="Drop the app's database on --mongodb-uri first")
+    parser.add_argument('--real-model', action='store_true', help='Serve the configured model instead of the stub')
+    parser.add_argument('--prediction-cache', action='store_true', help='Leave the prediction cache on')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Write the results as JSON')
+    parser.add_argument('--save-baseline', default=None, help='Write the results as the new baseline')
+    parser.add_argument('--baseline', default=None, help='Compare against this baseline; exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Allowed relative p95/throughput change')
+    args = parser.parse_args()
+
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+
+    configure_environment(args)
+    os.chdir(BACKEND_DIR)
+    started = time.perf_counter()
+    import app as backend
+    from werkzeug.serving import make_server
+
+    # Per-request INFO logs would dominate the profile and flood the terminal
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    served = backend.model_registry.current
+    model_name = f"{served.engine.name} {served.version}" if served else None
+    print(f"App imported in {time.perf_counter() - started:.1f}s (model: {model_name})")
+    if served is None and 'predict' in endpoints:
+        print('No model is being served; skipping /predict')
+        endpoints.remove('predict')
+        if not endpoints:
+            sys.exit('Nothing left to benchmark')
+
+    db = backend.db
+    if db is None:
+        sys.exit('No database connection')
+    if db['scans'].estimated_document_count():
+        if not args.reset:
+            sys.exit(f"Database '{db.name}' already has scans; pass --reset to drop it (all of its data) first")
+        db.client.drop_database(db.name)
+        backend.ensure_indexes(db)
+
+    rng = np.random.default_rng(args.seed)
+    random.seed(args.seed)
+    print(f"Seeding {args.doctors} doctors, {args.doctors * args.patients_per_doctor} patients, {args.scans} scans")
+    doctor_ids = seed(db, args.scans, args.doctors, args.patients_per_doctor, args.days, rng)
+    tokens = [backend.generate_jwt_token(doctor_id) for doctor_id in doctor_ids]
+    uploads = scan_uploads(max(32, args.doctors), args.image_size) if 'predict' in endpoints else []
+
+    server = make_server('127.0.0.1', 0, backend.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving on port {server.server_port}; {args.concurrency} concurrent connections")
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'scans': args.scans,
+            'doctors': args.doctors,
+            'patients_per_doctor': args.patients_per_doctor,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'database': 'mongodb' if args.mongodb_uri else 'mongomock',
+            'model': model_name,
+            'prediction_cache': args.prediction_cache,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count()
+        },
+        'endpoints': {}
+    }
+    ctx = mp.get_context('spawn')
+    try:
+        for endpoint in endpoints:
+            receiver, sender = ctx.Pipe(duplex=False)
+            process = ctx.Process(target=drive, args=(
+                server.server_port, build_requests(endpoint, tokens, uploads),
+                args.concurrency, args.warmup, args.requests, sender
+            ))
+            process.start()
+            sender.close()
+            samples, elapsed = receiver.recv()
+            process.join()
+            results['endpoints'][endpoint] = summarize(samples, elapsed)
+            print(f"  {endpoint}: done in {elapsed:.1f}s")
+    finally:
+        server.shutdown()
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        mismatched = [key for key in ('scans', 'concurrency', 'database', 'model')
+                      if baseline.get('meta', {}).get(key) != results['meta'][key]]
+        if mismatched:
+            print(f"Warning: baseline was recorded with different {', '.join(mismatched)}")
+        regressions = compare(results, baseline, args.tolerance)
+
+    print_table(results)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {path}")
+
+    if regressions:
+        print(f"\nRegressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
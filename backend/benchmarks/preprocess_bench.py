@@ -0,0 +1,130 @@
+"""Micro-benchmark: legacy vs fast preprocessing of a /predict upload.
+
+Run from the backend directory:
+
+    python benchmarks/preprocess_bench.py [--repeat 20]
+
+For each input it reports per-stage wall time (decode, preprocess) and the
+peak memory of the stage, plus the difference between the two outputs.
+Peak memory combines tracemalloc (NumPy/OpenCV buffers) with the size of the
+decoded PIL image, which lives outside the Python allocator.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocessing import DRAFT_TOLERANCE, decode_image, preprocess_image  # noqa: E402
+
+SIZES = {'512x512': (512, 512), '4K': (3840, 2160)}
+
+
+def synthetic_scan(width, height, seed=0):
+    """Grey CT-like slice: dark background, bright body ellipse, noisy nodules"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    cx, cy = width / 2, height / 2
+    body = ((x - cx) / (width * 0.42)) ** 2 + ((y - cy) / (height * 0.38)) ** 2 < 1
+    image = np.where(body, 170.0, 15.0)
+    for _ in range(12):
+        nx, ny = rng.uniform(0.2, 0.8) * width, rng.uniform(0.2, 0.8) * height
+        radius = rng.uniform(0.01, 0.05) * min(width, height)
+        image[(x - nx) ** 2 + (y - ny) ** 2 < radius ** 2] = rng.uniform(60, 250)
+    image += rng.normal(0, 8, size=image.shape)
+    grey = np.clip(image, 0, 255).astype(np.uint8)
+    return Image.fromarray(np.stack([grey] * 3, axis=-1))
+
+
+def encode(image, fmt):
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, quality=90) if fmt == 'JPEG' else image.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def legacy_decode(file_bytes):
+    file_stream = io.BytesIO(file_bytes)
+    image = Image.open(file_stream)
+    image.verify()
+    file_stream.seek(0)
+    image = Image.open(file_stream)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    # PIL decodes lazily; force it here so the cost lands in the decode stage
+    image.load()
+    return image
+
+
+def legacy_preprocess(image):
+    img_array = np.array(image)
+    img_array = cv2.resize(img_array, (224, 224))
+    img_array = img_array.astype('float32') / 255.0
+    img_array = np.expand_dims(img_array, axis=0)
+    # The old code logged this on every request
+    _ = f"min={np.min(img_array)}, max={np.max(img_array)}"
+    return img_array
+
+
+def fast_preprocess(image):
+    return preprocess_image(image).copy()
+
+
+def measure(fn, arg, repeat):
+    """Return (median ms, peak bytes, result) for ``fn(arg)``"""
+    result = fn(arg)  # warm up
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(arg)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    result = fn(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if isinstance(result, Image.Image):
+        # The pixel buffer of a PIL image is not visible to tracemalloc
+        peak += result.width * result.height * len(result.getbands())
+    return float(np.median(timings)), peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    header = f"{'input':<16}{'path':<8}{'decode ms':>11}{'decode MB':>11}{'prep ms':>10}{'prep MB':>10}{'total ms':>10}"
+    print(header)
+    print('-' * len(header))
+    for label, (width, height) in SIZES.items():
+        scan = synthetic_scan(width, height)
+        for fmt in ('JPEG', 'PNG'):
+            data = encode(scan, fmt)
+            outputs = {}
+            for path, decode, preprocess in (
+                ('legacy', legacy_decode, legacy_preprocess),
+                ('fast', decode_image, fast_preprocess),
+            ):
+                decode_ms, decode_peak, image = measure(decode, data, args.repeat)
+                prep_ms, prep_peak, tensor = measure(preprocess, image, args.repeat)
+                outputs[path] = tensor
+                print(
+                    f"{label + ' ' + fmt:<16}{path:<8}{decode_ms:>11.2f}{decode_peak / 1e6:>11.1f}"
+                    f"{prep_ms:>10.2f}{prep_peak / 1e6:>10.1f}{decode_ms + prep_ms:>10.2f}"
+                )
+
+            diff = np.abs(outputs['legacy'] - outputs['fast'])
+            status = 'ok' if diff.mean() <= DRAFT_TOLERANCE else 'OUT OF TOLERANCE'
+            print(f"{'':<16}{'diff':<8}max={diff.max():.4f} mean={diff.mean():.5f} "
+                  f"(tolerance mean<={DRAFT_TOLERANCE}) {status}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""Stand-in for the lung model with the same input/output shapes, for benchmarks and CI.
+
+Serve it with ``INFERENCE_ENGINE_FACTORY=stub_model:make`` (this directory on
+``PYTHONPATH``) or ``python inference_pool.py --engine-factory stub_model:make``.
+Each forward pass sleeps ``STUB_MODEL_BATCH_MS + STUB_MODEL_IMAGE_MS * N``
+milliseconds, releasing the GIL like a TensorFlow call does, and returns
+probabilities derived from the input so different scans get different answers.
+"""
+import os
+import time
+
+import numpy as np
+
+from inference import INPUT_SHAPE
+
+
+class StubEngine:
+    name = 'stub'
+    version = 'stub-v1'
+
+    def __init__(self, batch_ms=None, image_ms=None):
+        self.batch_ms = float(os.getenv('STUB_MODEL_BATCH_MS', '2')) if batch_ms is None else batch_ms
+        self.image_ms = float(os.getenv('STUB_MODEL_IMAGE_MS', '1')) if image_ms is None else image_ms
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        if batch.shape[1:] != INPUT_SHAPE:
+            raise ValueError(f"Expected a (N, {', '.join(map(str, INPUT_SHAPE))}) batch, got {batch.shape}")
+        time.sleep((self.batch_ms + self.image_ms * len(batch)) / 1000)
+
+        # Per-channel means as logits, softmaxed into three class probabilities
+        logits = batch.reshape(len(batch), -1, 3).mean(axis=1) * 4
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return (exp / exp.sum(axis=1, keepdims=True)).astype(np.float32)
+
+
+def make():
+    return StubEngine()
@@ -0,0 +1,155 @@
+"""In-process caches: a generic TTL-bounded LRU and the /predict result cache"""
+import copy
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Thread-safe LRU cache with an entry limit and a per-entry TTL"""
+
+    def __init__(self, max_entries=1024, ttl_seconds=None):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl_seconds=None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class PredictionCache:
+    """Cache of /predict results keyed on upload content hash plus model version.
+
+    Lookups go through the in-process LRU first, then the optional Mongo
+    collection shared by all workers. Changing the model version clears the
+    local tier and drops stale shared entries, so a new model never serves
+    results produced by the old one.
+    """
+
+    def __init__(self, model_version, max_entries=1024, ttl_seconds=3600, collection=None):
+        self.model_version = model_version
+        self.ttl_seconds = ttl_seconds
+        self.local = LRUCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.collection = collection
+
+        self.hits = Counter('prediction_cache_hits_total', 'Lookups served from the in-process cache')
+        self.shared_hits = Counter('prediction_cache_shared_hits_total', 'Lookups served from the Mongo cache')
+        self.misses = Counter('prediction_cache_misses_total', 'Lookups that required inference')
+        self.entries = Gauge('prediction_cache_entries', 'Predictions in the in-process cache', fn=lambda: len(self.local))
+
+        if self.collection is not None:
+            try:
+                self.collection.create_index('createdAt', expireAfterSeconds=int(ttl_seconds))
+            except Exception as e:
+                logger.warning(f"Could not create prediction cache TTL index: {str(e)}")
+
+    def key_for(self, file_bytes, model_version=None):
+        """Cache key for ``file_bytes`` as scored by ``model_version`` (the current model by default)"""
+        return f"{model_version or self.model_version}:{content_hash(file_bytes)}"
+
+    def get(self, key):
+        """Return a copy of the cached prediction for ``key`` or None"""
+        prediction = self.local.get(key)
+        if prediction is not None:
+            self.hits.inc()
+            return copy.deepcopy(prediction)
+
+        if self.collection is not None:
+            try:
+                doc = self.collection.find_one({'_id': key})
+            except Exception as e:
+                logger.warning(f"Shared prediction cache lookup failed: {str(e)}")
+                doc = None
+            if doc is not None and (datetime.utcnow() - doc['createdAt']).total_seconds() < self.ttl_seconds:
+                self.shared_hits.inc()
+                self.local.set(key, doc['prediction'])
+                return copy.deepcopy(doc['prediction'])
+
+        self.misses.inc()
+        return None
+
+    def set(self, key, prediction):
+        self.local.set(key, copy.deepcopy(prediction))
+        if self.collection is not None:
+            try:
+                self.collection.replace_one(
+                    {'_id': key},
+                    {
+                        '_id': key,
+                        'modelVersion': self.model_version,
+                        'prediction': prediction,
+                        'createdAt': datetime.utcnow()
+                    },
+                    upsert=True
+                )
+            except Exception as e:
+                logger.warning(f"Shared prediction cache write failed: {str(e)}")
+
+    def set_model_version(self, model_version):
+        """Invalidate everything produced by a different model"""
+        if model_version == self.model_version:
+            return
+        logger.info(f"Model changed ({self.model_version} -> {model_version}), invalidating prediction cache")
+        self.model_version = model_version
+        self.local.clear()
+        if self.collection is not None:
+            try:
+                self.collection.delete_many({'modelVersion': {'$ne': model_version}})
+            except Exception as e:
+                logger.warning(f"Could not purge shared prediction cache: {str(e)}")
+
+    def metrics(self):
+        return [self.hits, self.shared_hits, self.misses, self.entries]
+
+    def stats(self):
+        hits = self.hits.value + self.shared_hits.value
+        lookups = hits + self.misses.value
+        return {
+            'model_version': self.model_version,
+            'entries': len(self.local),
+            'hits': self.hits.value,
+            'shared_hits': self.shared_hits.value,
+            'misses': self.misses.value,
+            'hit_rate': round(hits / lookups, 4) if lookups else None
+        }
@@ -0,0 +1,130 @@
+"""Environment-driven settings shared by the Flask and async entry points"""
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-for-jwt')
+JWT_EXPIRATION_HOURS = 24  # Token valid for 24 hours
+
+ALLOW_START_WITHOUT_DB = os.getenv('ALLOW_START_WITHOUT_DB', 'false').lower() == 'true'
+DISABLE_AUTH = os.getenv('DISABLE_AUTH', 'false').lower() == 'true'
+MONGODB_URI = os.getenv('MONGODB_URI')
+MAX_RETRIES = 3
+RETRY_DELAY = 2
+ENSURE_INDEXES = os.getenv('ENSURE_INDEXES', 'true').lower() == 'true'
+
+UPLOAD_FOLDER = 'uploads'
+# Content-addressed scan images (see image_store.py): sha256-named blobs under
+# IMAGE_STORE_SHARD_DEPTH levels of two-hex-digit directories
+IMAGE_STORE_DIR = os.getenv('IMAGE_STORE_DIR', os.path.join(UPLOAD_FOLDER, 'blobs'))
+IMAGE_STORE_SHARD_DEPTH = int(os.getenv('IMAGE_STORE_SHARD_DEPTH', '2'))
+# fsync each blob before renaming it into place; turn off only where durability does not matter
+IMAGE_STORE_FSYNC = os.getenv('IMAGE_STORE_FSYNC', 'true').lower() == 'true'
+
+# GET /scans/<id>/image: browser cache lifetime (images never change under one URL),
+# and X-Sendfile for a front-end server that sends files itself (Flask app only)
+IMAGE_MAX_AGE_SECONDS = int(os.getenv('IMAGE_MAX_AGE_SECONDS', str(7 * 24 * 3600)))
+IMAGE_X_SENDFILE = os.getenv('IMAGE_X_SENDFILE', 'false').lower() == 'true'
+# Downscaled copies served with ?size=<name>, as name:longest-side-in-pixels pairs,
+# rendered on first request and kept on disk up to THUMBNAIL_CACHE_MAX_BYTES
+THUMBNAIL_SIZES = {
+    name.strip(): int(pixels)
+    for name, pixels in (item.split(':') for item in os.getenv('THUMBNAIL_SIZES', 'thumb:128,preview:512').split(','))
+}
+THUMBNAIL_DIR = os.getenv('THUMBNAIL_DIR', os.path.join(UPLOAD_FOLDER, 'thumbnails'))
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv('THUMBNAIL_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+# eager: connect to MongoDB and load the model before serving (the old behaviour).
+# background: bind immediately and do both in a background thread; /ready answers
+# 503 and data endpoints answer "starting" until they finish
+STARTUP_MODE = os.getenv('STARTUP_MODE', 'eager').lower()
+
+# Cache of authenticated doctors (and optionally verified tokens) used by token_required
+DOCTOR_CACHE_ENABLED = os.getenv('DOCTOR_CACHE', 'true').lower() == 'true'
+DOCTOR_CACHE_SIZE = int(os.getenv('DOCTOR_CACHE_SIZE', '1024'))
+DOCTOR_CACHE_TTL_SECONDS = int(os.getenv('DOCTOR_CACHE_TTL_SECONDS', '300'))
+TOKEN_CACHE_ENABLED = os.getenv('TOKEN_CACHE', 'false').lower() == 'true'
+
+# Password hashing runs on its own bounded pool so login bursts can't starve /predict
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', '32'))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', '5'))
+
+# Inference engine: function (traced tf.function), keras (direct call), predict (legacy model.predict) or tflite
+MODEL_PATH = os.getenv('MODEL_PATH', 'Lung_Model.h5')
+INFERENCE_ENGINE = os.getenv('INFERENCE_ENGINE', 'function').lower()
+TFLITE_MODEL_PATH = os.getenv('TFLITE_MODEL_PATH', 'Lung_Model.tflite')
+TFLITE_NUM_THREADS = int(os.getenv('TFLITE_NUM_THREADS', '0')) or None
+# "module:function" returning an engine to serve instead of the model above (e.g. benchmarks/stub_model.py)
+INFERENCE_ENGINE_FACTORY = os.getenv('INFERENCE_ENGINE_FACTORY')
+
+# Hot model swaps: check the model files every N seconds (0 disables) and, when one changes,
+# load and warm up the new model in the background before switching requests over to it
+MODEL_RELOAD_INTERVAL_SECONDS = float(os.getenv('MODEL_RELOAD_INTERVAL_SECONDS', '0'))
+# How long requests still running on the replaced model may take before it is closed anyway
+MODEL_DRAIN_TIMEOUT_SECONDS = float(os.getenv('MODEL_DRAIN_TIMEOUT_SECONDS', '30'))
+
+# Shadow evaluation: a candidate model (.h5/.tflite file or "module:function" factory) scores a
+# sampled fraction of /predict inputs in the background and is compared with the served model
+SHADOW_MODEL_PATH = os.getenv('SHADOW_MODEL_PATH')
+SHADOW_ENGINE_FACTORY = os.getenv('SHADOW_ENGINE_FACTORY')
+SHADOW_SAMPLE_RATE = float(os.getenv('SHADOW_SAMPLE_RATE', '0.1'))
+SHADOW_MAX_BATCH_SIZE = int(os.getenv('SHADOW_MAX_BATCH_SIZE', '16'))
+SHADOW_MAX_WAIT_MS = float(os.getenv('SHADOW_MAX_WAIT_MS', '200'))
+SHADOW_QUEUE_DEPTH = int(os.getenv('SHADOW_QUEUE_DEPTH', '64'))
+
+# Shared inference pool (inference_pool.py). When set, HTTP workers load no model
+# and send preprocessed tensors to the pool through shared memory
+INFERENCE_POOL_ADDRESS = os.getenv('INFERENCE_POOL_ADDRESS')
+INFERENCE_POOL_AUTHKEY = os.getenv('INFERENCE_POOL_AUTHKEY', SECRET_KEY).encode('utf-8')
+INFERENCE_POOL_TIMEOUT = float(os.getenv('INFERENCE_POOL_TIMEOUT', '30'))
+
+# Dynamic micro-batching of concurrent /predict calls
+INFERENCE_BATCHING = os.getenv('INFERENCE_BATCHING', 'true').lower() == 'true'
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv('INFERENCE_MAX_BATCH_SIZE', '16'))
+INFERENCE_MAX_WAIT_MS = float(os.getenv('INFERENCE_MAX_WAIT_MS', '5'))
+INFERENCE_QUEUE_DEPTH = int(os.getenv('INFERENCE_QUEUE_DEPTH', '256'))
+
+# Prediction cache keyed on upload content hash + model version
+PREDICTION_CACHE_ENABLED = os.getenv('PREDICTION_CACHE', 'true').lower() == 'true'
+PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', '1024'))
+PREDICTION_CACHE_TTL_SECONDS = int(os.getenv('PREDICTION_CACHE_TTL_SECONDS', '3600'))
+PREDICTION_CACHE_SHARED = os.getenv('PREDICTION_CACHE_SHARED', 'false').lower() == 'true'
+
+# Page size cap for /history and /history/<patient_id>
+HISTORY_MAX_LIMIT = int(os.getenv('HISTORY_MAX_LIMIT', '1000'))
+
+# gzip/brotli compression of read responses larger than this
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+
+# Streaming /export cursor batch size bounds
+EXPORT_DEFAULT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '500'))
+EXPORT_MAX_BATCH_SIZE = 5000
+
+# Predict-then-save handoff: /predict stages the upload so /save-record needs no second upload
+SCAN_STAGING_TTL_SECONDS = int(os.getenv('SCAN_STAGING_TTL_SECONDS', '900'))
+SCAN_STAGING_MAX_BYTES = int(os.getenv('SCAN_STAGING_MAX_BYTES', str(256 * 1024 * 1024)))
+
+# Multi-image /predict/batch limits
+BATCH_PREDICT_MAX_FILES = int(os.getenv('BATCH_PREDICT_MAX_FILES', '100'))
+BATCH_PREDICT_MAX_ARCHIVE_BYTES = int(os.getenv('BATCH_PREDICT_MAX_ARCHIVE_BYTES', str(500 * 1024 * 1024)))
+BATCH_DECODE_WORKERS = int(os.getenv('BATCH_DECODE_WORKERS', '4'))
+ALLOWED_IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp'}
+
+# Logging: level, text or json lines, one structured record per request (ACCESS_LOG), and the
+# fraction of requests whose diagnostic details (upload metadata, raw probabilities) are logged
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+ACCESS_LOG = os.getenv('ACCESS_LOG', 'true').lower() == 'true'
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0'))
+
+# Add a Server-Timing header with per-stage durations to every response (debugging aid)
+TIMING_HEADER = os.getenv('TIMING_HEADER', 'false').lower() == 'true'
+
+# Async entry point (async_app.py): decode/inference pool size and how many
+# CPU-bound jobs may be waiting for it before /predict answers 503
+ASYNC_CPU_WORKERS = int(os.getenv('ASYNC_CPU_WORKERS', str(os.cpu_count() or 2)))
+ASYNC_MAX_PENDING_CPU = int(os.getenv('ASYNC_MAX_PENDING_CPU', '64'))
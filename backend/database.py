@@ -0,0 +1,41 @@
+"""MongoDB connection helpers for the app and command-line tools"""
+import os
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, monitoring
+
+DB_NAME = 'lung_cancer_db'
+
+
+def get_database(uri=None):
+    """Connect using MONGODB_URI (or ``uri``) and return the application database"""
+    load_dotenv()
+    client = MongoClient(
+        uri or os.getenv('MONGODB_URI'),
+        serverSelectionTimeoutMS=5000,
+        connectTimeoutMS=5000
+    )
+    # Fail fast with a clear error instead of on the first query
+    client.server_info()
+    return client[DB_NAME]
+
+
+class MongoTimingListener(monitoring.CommandListener):
+    """Records every command as the ``mongo`` stage of the current request (see metrics.RequestMetrics).
+
+    pymongo publishes events on the thread that ran the command, so the time is
+    attributed to the endpoint that issued it; commands issued outside a
+    request are recorded under ``endpoint="none"``.
+    """
+
+    def __init__(self, request_metrics):
+        self.request_metrics = request_metrics
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.request_metrics.observe('mongo', event.duration_micros / 1000)
+
+    def failed(self, event):
+        self.request_metrics.observe('mongo', event.duration_micros / 1000)
@@ -0,0 +1,161 @@
+"""Selectable inference engines for the lung model.
+
+Every engine exposes ``predict(batch) -> np.ndarray`` taking a float32
+(N, 224, 224, 3) batch and returning (N, 3) class probabilities, so callers
+do not care which runtime is behind it.
+"""
+import hashlib
+import logging
+import os
+import threading
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.optimizers import Adam
+
+from inference import INPUT_SHAPE
+
+logger = logging.getLogger(__name__)
+
+ENGINE_NAMES = ('function', 'keras', 'predict', 'tflite')
+
+
+def load_keras_model(model_path):
+    """Load the Keras model for inference only (no optimizer, no compile)"""
+    return tf.keras.models.load_model(
+        model_path,
+        custom_objects={'Adam': Adam},
+        compile=False
+    )
+
+
+class KerasPredictEngine:
+    """Legacy path through ``model.predict()``; highest per-call overhead"""
+    name = 'predict'
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, batch):
+        return self.model.predict(batch, verbose=0)
+
+
+class KerasCallEngine:
+    """Plain eager ``model(x, training=False)`` call"""
+    name = 'keras'
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, batch):
+        return np.asarray(self.model(batch, training=False))
+
+
+class TFFunctionEngine:
+    """Graph-traced call with a fixed input signature so it never retraces"""
+    name = 'function'
+
+    def __init__(self, model):
+        self.model = model
+        self._fn = tf.function(
+            lambda x: model(x, training=False),
+            input_signature=[tf.TensorSpec(shape=[None, *INPUT_SHAPE], dtype=tf.float32)]
+        )
+
+    def predict(self, batch):
+        return np.asarray(self._fn(tf.convert_to_tensor(batch, dtype=tf.float32)))
+
+
+class TFLiteEngine:
+    """TFLite interpreter; handles float, dynamic-range and full int8 models"""
+    name = 'tflite'
+
+    def __init__(self, tflite_path, num_threads=None):
+        self.path = tflite_path
+        self._interpreter = tf.lite.Interpreter(model_path=tflite_path, num_threads=num_threads)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = int(self._input['shape'][0])
+        # The interpreter is not thread-safe
+        self._lock = threading.Lock()
+
+    @property
+    def quantized(self):
+        return self._input['dtype'] in (np.int8, np.uint8)
+
+    def _resize(self, batch_size):
+        index = self._input['index']
+        self._interpreter.resize_tensor_input(index, [batch_size, *INPUT_SHAPE])
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = batch_size
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self._resize(batch.shape[0])
+
+            if self.quantized:
+                scale, zero_point = self._input['quantization']
+                batch = np.clip(np.round(batch / scale + zero_point), *_dtype_range(self._input['dtype']))
+                batch = batch.astype(self._input['dtype'])
+
+            self._interpreter.set_tensor(self._input['index'], batch)
+            self._interpreter.invoke()
+            output = self._interpreter.get_tensor(self._output['index'])
+
+            if self._output['dtype'] in (np.int8, np.uint8):
+                scale, zero_point = self._output['quantization']
+                output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+def _dtype_range(dtype):
+    info = np.iinfo(dtype)
+    return info.min, info.max
+
+
+def model_fingerprint(path):
+    """Short content hash of a model artifact, used as its version"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def load_engine(engine_name, model_path, tflite_path=None, num_threads=None):
+    """Build the configured engine, or None if the model artifact is missing.
+
+    The returned engine carries a ``version`` string derived from the engine
+    name and the artifact contents, so any change to the served model changes it.
+    """
+    if engine_name not in ENGINE_NAMES:
+        raise ValueError(f"Unknown inference engine '{engine_name}'. Choose one of {', '.join(ENGINE_NAMES)}")
+
+    if engine_name == 'tflite':
+        if tflite_path and os.path.exists(tflite_path):
+            engine = TFLiteEngine(tflite_path, num_threads=num_threads)
+            engine.version = f"tflite-{model_fingerprint(tflite_path)}"
+            return engine
+        logger.warning(f"TFLite model not found at {tflite_path}, falling back to the 'function' engine")
+        engine_name = 'function'
+
+    if not os.path.exists(model_path):
+        logger.warning(f"Model file not found at {os.path.abspath(model_path)}")
+        return None
+
+    model = load_keras_model(model_path)
+    if engine_name == 'keras':
+        engine = KerasCallEngine(model)
+    elif engine_name == 'predict':
+        engine = KerasPredictEngine(model)
+    else:
+        engine = TFFunctionEngine(model)
+    # Keras engines share the same numerics, so only the weights define the version
+    engine.version = f"keras-{model_fingerprint(model_path)}"
+    return engine
+
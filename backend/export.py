@@ -0,0 +1,103 @@
+"""Streaming NDJSON/CSV export of scan records straight from a MongoDB cursor"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+
+from inference import CLASS_NAMES
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+CSV_COLUMNS = (
+    ['id', 'patientId', 'timestamp', 'diagnosis', 'confidence']
+    + [f'probability_{name}' for name in CLASS_NAMES]
+    + ['medicalHistory', 'doctorNotes', 'imagePath']
+)
+
+# Flush to the client once roughly this many bytes are buffered
+CHUNK_BYTES = 64 * 1024
+
+
+def export_row(scan):
+    """Flatten one scan document into a JSON-safe export row"""
+    timestamp = scan.get('timestamp')
+    probabilities = scan.get('probabilities') or {}
+    row = {
+        'id': str(scan['_id']),
+        'patientId': scan.get('patientId'),
+        'timestamp': timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp,
+        'diagnosis': scan.get('diagnosis'),
+        'confidence': scan.get('confidence'),
+        'medicalHistory': scan.get('medicalHistory'),
+        'doctorNotes': scan.get('doctorNotes'),
+        'imagePath': scan.get('imagePath')
+    }
+    for name in CLASS_NAMES:
+        row[f'probability_{name}'] = probabilities.get(name)
+    return row
+
+
+def _csv_safe(value):
+    # Keep spreadsheet apps from evaluating free-text fields as formulas
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
+
+def ndjson_chunks(cursor):
+    buffer = []
+    size = 0
+    for scan in cursor:
+        line = json.dumps(export_row(scan), default=str) + '\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_BYTES:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def csv_chunks(cursor, header=True):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    if header:
+        writer.writerow(CSV_COLUMNS)
+    for scan in cursor:
+        row = export_row(scan)
+        writer.writerow([_csv_safe(row[column]) for column in CSV_COLUMNS])
+        if out.tell() >= CHUNK_BYTES:
+            yield out.getvalue().encode('utf-8')
+            out.seek(0)
+            out.truncate()
+    if out.tell():
+        yield out.getvalue().encode('utf-8')
+
+
+def gzip_compressor(level=6):
+    return zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress a byte-chunk stream into a single gzip member on the fly"""
+    compressor = gzip_compressor(level)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_stream(cursor, export_format, compress=False):
+    """Byte chunks for the whole export; closes the cursor when done or abandoned"""
+    chunks = ndjson_chunks(cursor) if export_format == 'ndjson' else csv_chunks(cursor)
+    if compress:
+        chunks = gzip_chunks(chunks)
+    try:
+        yield from chunks
+    finally:
+        cursor.close()
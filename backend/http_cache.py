@@ -0,0 +1,126 @@
+"""Conditional GET and response compression for the read endpoints.
+
+Each doctor has a data version counter in the ``data_versions`` collection,
+bumped whenever their scans or patients change. Read endpoints derive a
+strong ETag from (path, query, doctor, version, day), so a client holding a
+current ETag gets a 304 after one primary-key read, without the endpoint
+touching the scans collection at all.
+"""
+import gzip
+import hashlib
+import logging
+from datetime import date
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/csv', 'text/plain', 'application/x-ndjson'}
+
+# Suffixes that distinguish the encoded representations of one resource
+ENCODING_ETAG_SUFFIXES = {'gzip': '-gz', 'br': '-br'}
+
+
+class DataVersions:
+    """Per-doctor monotonically increasing data version stored in MongoDB"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get(self, doctor_id):
+        doc = self.collection.find_one({'_id': doctor_id}, {'version': 1})
+        return doc['version'] if doc else 0
+
+    def bump(self, doctor_id):
+        try:
+            self.collection.update_one({'_id': doctor_id}, {'$inc': {'version': 1}}, upsert=True)
+        except Exception as e:
+            # A missed bump would serve stale 304s, so make it loud
+            logger.error(f"Failed to bump data version for doctor {doctor_id}: {str(e)}")
+
+
+class AsyncDataVersions(DataVersions):
+    """DataVersions over a motor collection, for the async entry point"""
+
+    async def get(self, doctor_id):
+        doc = await self.collection.find_one({'_id': doctor_id}, {'version': 1})
+        return doc['version'] if doc else 0
+
+    async def bump(self, doctor_id):
+        try:
+            await self.collection.update_one({'_id': doctor_id}, {'$inc': {'version': 1}}, upsert=True)
+        except Exception as e:
+            logger.error(f"Failed to bump data version for doctor {doctor_id}: {str(e)}")
+
+
+def make_etag(path, query_string, doctor_id, version):
+    # The day is included because /stats trend windows move even without new data
+    key = f"{path}?{query_string}|{doctor_id}|{version}|{date.today().isoformat()}"
+    return '"' + hashlib.sha256(key.encode('utf-8')).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header names ``etag`` in any of its encodings"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    base = etag.strip('"')
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        candidate = candidate.strip('"')
+        for suffix in ENCODING_ETAG_SUFFIXES.values():
+            if candidate.endswith(suffix):
+                candidate = candidate[:-len(suffix)]
+                break
+        if candidate == base:
+            return True
+    return False
+
+
+def choose_encoding(accept_encodings):
+    """Best supported content coding from a werkzeug Accept header, or None"""
+    if brotli is not None and accept_encodings.quality('br') > 0:
+        return 'br'
+    if accept_encodings.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+
+def compress_response(response, accept_encodings, min_bytes=1024, gzip_level=6, brotli_quality=5):
+    """Compress a buffered response body in place when the client accepts it"""
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < min_bytes:
+        return response
+
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None:
+        return response
+
+    response.set_data(compress_body(body, encoding, gzip_level, brotli_quality))
+    response.headers['Content-Encoding'] = encoding
+
+    # Strong ETags must differ between the encoded and identity representations
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag + ENCODING_ETAG_SUFFIXES[encoding])
+    return response
+
+
+def compress_body(body, encoding, gzip_level=6, brotli_quality=5):
+    if encoding == 'br':
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level)
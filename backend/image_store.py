@@ -0,0 +1,260 @@
+"""Content-addressed store for scan images.
+
+Blobs are named by the SHA-256 of their bytes and sharded into nested
+directories (``ab/cd/abcd...`` at the default depth of two), so identical
+uploads are stored once and no directory grows past a few hundred entries.
+Uploads are streamed into a temp file inside the store while being hashed,
+flushed, then renamed into place; a reader never sees a partial blob.
+
+Scan records keep the blob's path in ``imagePath`` and its digest in
+``imageHash``. How many records share a blob is counted in the
+``image_blobs`` collection; the upserts come from ``blob_ref_update`` so the
+Flask and async entry points apply the same change. Blobs whose count drops
+to zero are not unlinked on the spot (a concurrent save of the same bytes
+may be about to reference them again); ``gc`` removes them after a grace
+period instead::
+
+    python image_store.py migrate [--keep-originals]   # move legacy uploads/ files into the store
+    python image_store.py gc [--grace-hours 24]        # delete unreferenced blobs
+"""
+import argparse
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+BLOBS_COLLECTION = 'image_blobs'
+CHUNK_SIZE = 64 * 1024
+
+# Blobs have no extension, so the type is read from the formats /save-record accepts
+IMAGE_SIGNATURES = ((b'\x89PNG\r\n\x1a\n', 'image/png'), (b'\xff\xd8\xff', 'image/jpeg'), (b'BM', 'image/bmp'))
+
+
+class StoredImage:
+    __slots__ = ('digest', 'path', 'size', 'created')
+
+    def __init__(self, digest, path, size, created):
+        self.digest = digest
+        self.path = path
+        self.size = size
+        self.created = created  # False when an identical blob was already stored
+
+
+class ImageStore:
+    def __init__(self, root, shard_depth=2, fsync=True):
+        self.root = root
+        self.shard_depth = shard_depth
+        self.fsync = fsync
+        self._tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self._tmp_dir, exist_ok=True)
+
+    def path_for(self, digest):
+        shards = [digest[i * 2:i * 2 + 2] for i in range(self.shard_depth)]
+        return os.path.join(self.root, *shards, digest)
+
+    def put_stream(self, stream):
+        """Copy a binary stream into the store in chunks, hashing as it goes"""
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            return self._commit(tmp_path, digest.hexdigest(), size)
+        except BaseException:
+            _unlink(tmp_path)
+            raise
+
+    def put_bytes(self, data):
+        """Store bytes already in memory (staged scans, batch ingestion)"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            _touch(path)
+            return StoredImage(digest, path, len(data), False)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            return self._commit(tmp_path, digest, len(data))
+        except BaseException:
+            _unlink(tmp_path)
+            raise
+
+    def _commit(self, tmp_path, digest, size):
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            # Same bytes already stored: keep the existing blob and refresh its age for gc
+            _unlink(tmp_path)
+            _touch(path)
+            return StoredImage(digest, path, size, False)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return StoredImage(digest, path, size, True)
+
+    def remove(self, digest):
+        _unlink(self.path_for(digest))
+
+    def purge_temp(self, max_age_seconds=3600):
+        """Delete temp files left behind by writers that crashed mid-upload"""
+        cutoff = time.time() - max_age_seconds
+        removed = 0
+        for name in os.listdir(self._tmp_dir):
+            path = os.path.join(self._tmp_dir, name)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.unlink(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def image_mimetype(path):
+    with open(path, 'rb') as f:
+        head = f.read(8)
+    for signature, mimetype in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mimetype
+    # Legacy files named by upload extension
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+def blob_ref_update(stored, delta=1, now=None):
+    """(filter, update) upsert that adds ``delta`` references to a stored blob"""
+    now = now or datetime.now()
+    return (
+        {'_id': stored.digest},
+        {
+            '$inc': {'refs': delta},
+            '$set': {'updatedAt': now},
+            '$setOnInsert': {'path': stored.path, 'size': stored.size, 'createdAt': now}
+        }
+    )
+
+
+def migrate(db, store, keep_originals=False, batch_size=500):
+    """Move every scan whose imagePath still points outside the store into it.
+
+    Records without ``imageHash`` are the legacy ones, so re-running after an
+    interruption picks up where the last run stopped. Returns
+    ``(migrated, missing)`` where missing counts records whose file is gone.
+    """
+    migrated = missing = 0
+    # Saves in the same second shared one legacy file, so several records can name the same path
+    moved = {}
+    legacy = db.scans.find({'imageHash': {'$exists': False}}, {'imagePath': 1}, batch_size=batch_size)
+
+    scan_updates = []
+    refs = Counter()
+    blobs = {}
+    originals = []
+
+    def flush():
+        if not scan_updates:
+            return
+        # References first: a crash between the two writes over-counts (gc keeps the blob), never under-counts
+        db[BLOBS_COLLECTION].bulk_write(
+            [UpdateOne(*blob_ref_update(blobs[digest], count), upsert=True) for digest, count in refs.items()],
+            ordered=False
+        )
+        db.scans.bulk_write(scan_updates, ordered=False)
+        if not keep_originals:
+            for path in originals:
+                _unlink(path)
+        scan_updates.clear()
+        refs.clear()
+        blobs.clear()
+        originals.clear()
+
+    for scan in legacy:
+        path = scan.get('imagePath')
+        stored = moved.get(path)
+        if stored is None:
+            if not path or not os.path.isfile(path):
+                missing += 1
+                continue
+            with open(path, 'rb') as f:
+                stored = moved[path] = store.put_stream(f)
+            originals.append(path)
+        scan_updates.append(UpdateOne(
+            {'_id': scan['_id']},
+            {'$set': {'imagePath': stored.path, 'imageHash': stored.digest}}
+        ))
+        refs[stored.digest] += 1
+        blobs[stored.digest] = stored
+        migrated += 1
+        if len(scan_updates) >= batch_size:
+            flush()
+            logger.info(f"Migrated {migrated} scan images")
+    flush()
+
+    logger.info(f"Migrated {migrated} scan images into {store.root}; {missing} records had no file on disk")
+    return migrated, missing
+
+
+def collect_garbage(db, store, grace_hours=24):
+    """Delete blobs that have had no references for ``grace_hours``; returns how many were removed"""
+    cutoff = datetime.now() - timedelta(hours=grace_hours)
+    removed = 0
+    for blob in db[BLOBS_COLLECTION].find({'refs': {'$lte': 0}, 'updatedAt': {'$lt': cutoff}}, {'_id': 1}):
+        # Conditional delete: a save that re-referenced the blob meanwhile keeps it
+        if db[BLOBS_COLLECTION].find_one_and_delete({'_id': blob['_id'], 'refs': {'$lte': 0}}) is not None:
+            store.remove(blob['_id'])
+            removed += 1
+    removed_temp = store.purge_temp()
+    logger.info(f"Removed {removed} unreferenced blobs and {removed_temp} stale temp files")
+    return removed
+
+
+if __name__ == '__main__':
+    from config import IMAGE_STORE_DIR, IMAGE_STORE_SHARD_DEPTH
+    from database import get_database
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Maintain the content-addressed scan image store')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subcommands.add_parser('migrate', help='Move legacy upload files into the store')
+    migrate_parser.add_argument('--keep-originals', action='store_true', help='Leave the old files in place')
+    migrate_parser.add_argument('--batch-size', type=int, default=500)
+    gc_parser = subcommands.add_parser('gc', help='Delete blobs no scan record references')
+    gc_parser.add_argument('--grace-hours', type=float, default=24)
+    args = parser.parse_args()
+
+    image_store = ImageStore(IMAGE_STORE_DIR, shard_depth=IMAGE_STORE_SHARD_DEPTH)
+    if args.command == 'migrate':
+        migrate(get_database(), image_store, keep_originals=args.keep_originals, batch_size=args.batch_size)
+    elif args.command == 'gc':
+        collect_garbage(get_database(), image_store, grace_hours=args.grace_hours)
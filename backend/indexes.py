@@ -0,0 +1,149 @@
+"""Declared MongoDB indexes and query-plan verification.
+
+Every hot query in app.py is served by one of the indexes in ``INDEXES``.
+They are created idempotently at startup (unless ENSURE_INDEXES=false) or
+from the command line::
+
+    python indexes.py ensure   # create any missing indexes
+    python indexes.py check    # explain each endpoint's query, exit 1 on COLLSCAN
+"""
+import argparse
+import logging
+import sys
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from queries import PATIENT_SORTS, history_pipeline, scan_filter, scan_summary_pipeline
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    'scans': [
+        # /history, stats backfill and per-doctor scan summaries
+        IndexModel([('doctorId', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)], name='doctor_timestamp'),
+        # /history/<patient_id> and patient scan lookups
+        IndexModel(
+            [('patientId', ASCENDING), ('doctorId', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)],
+            name='patient_doctor_timestamp'
+        ),
+        # ingest.py: one record per manifest row, however often the import is re-run.
+        # Sparse, so scans saved through the API (no ingestKey) stay out of it
+        IndexModel([('ingestKey', ASCENDING)], name='ingest_key_unique', unique=True, sparse=True),
+    ],
+    'patients': [
+        IndexModel([('doctorId', ASCENDING), ('name', ASCENDING)], name='doctor_name'),
+        IndexModel([('doctorId', ASCENDING), ('created_at', DESCENDING)], name='doctor_created'),
+    ],
+    'doctors': [
+        # Login and signup look doctors up by email
+        IndexModel([('email', ASCENDING)], name='email_unique', unique=True),
+    ],
+    'patient_records': [
+        IndexModel([('patientId', ASCENDING), ('doctorId', ASCENDING), ('timestamp', DESCENDING)], name='patient_doctor_timestamp'),
+    ],
+    'stats_daily': [
+        IndexModel([('doctorId', ASCENDING), ('day', ASCENDING)], name='doctor_day'),
+    ],
+    'image_blobs': [
+        # image_store.py gc: unreferenced blobs past the grace period
+        IndexModel([('refs', ASCENDING), ('updatedAt', ASCENDING)], name='refs_updated'),
+    ],
+}
+
+
+def ensure_indexes(db):
+    """Create every declared index; existing identical indexes are left alone.
+
+    Returns a list of (collection, index name, error) for indexes that could
+    not be created, e.g. a unique index over duplicate data.
+    """
+    failures = []
+    for collection_name, models in INDEXES.items():
+        for model in models:
+            name = model.document['name']
+            try:
+                db[collection_name].create_indexes([model])
+            except OperationFailure as e:
+                logger.error(f"Could not create index {collection_name}.{name}: {e}")
+                failures.append((collection_name, name, str(e)))
+    if not failures:
+        logger.info(f"Ensured {sum(len(models) for models in INDEXES.values())} indexes")
+    return failures
+
+
+def query_shapes():
+    """(endpoint, collection, kind, query) for each hot query, using the real query builders"""
+    doctor_id = '__explain_doctor__'
+    patient_id = '__explain_patient__'
+    since = datetime(2000, 1, 1)
+    return [
+        ('/history', 'scans', 'aggregate',
+         history_pipeline(scan_filter(doctor_id), limit=50, with_patient_names=False)),
+        ('/history (date range)', 'scans', 'aggregate',
+         history_pipeline(scan_filter(doctor_id, date_from=since), limit=50, with_patient_names=False)),
+        ('/history/<patient_id>', 'scans', 'aggregate',
+         history_pipeline(scan_filter(doctor_id, patient_id=patient_id), limit=50, with_patient_names=False)),
+        ('/export', 'scans', 'find', (scan_filter(doctor_id), [('timestamp', ASCENDING), ('_id', ASCENDING)])),
+        ('/patients scan summaries', 'scans', 'aggregate', scan_summary_pipeline(doctor_id)),
+        ('/patients', 'patients', 'find', ({'doctorId': doctor_id}, None)),
+        ('/patients?sort=name', 'patients', 'find', ({'doctorId': doctor_id}, PATIENT_SORTS['name'])),
+        ('/login, /signup', 'doctors', 'find', ({'email': 'explain@example.com'}, None)),
+        ('/patients/<patient_id>', 'patient_records', 'find',
+         ({'patientId': patient_id, 'doctorId': doctor_id}, [('timestamp', DESCENDING)])),
+        ('/stats', 'stats_daily', 'find', ({'doctorId': doctor_id, 'day': {'$gte': '2000-01-01'}}, None)),
+    ]
+
+
+def _winning_stages(node):
+    """Yield every plan stage name in an explain document, skipping rejected plans"""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == 'rejectedPlans':
+                continue
+            if key == 'stage' and isinstance(value, str):
+                yield value
+            else:
+                yield from _winning_stages(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _winning_stages(item)
+
+
+def explain(db, collection_name, kind, query):
+    if kind == 'aggregate':
+        return db.command('aggregate', collection_name, pipeline=query, explain=True)
+    query_filter, sort = query
+    cursor = db[collection_name].find(query_filter)
+    if sort:
+        cursor = cursor.sort(sort)
+    return cursor.explain()
+
+
+def check_query_plans(db):
+    """Explain every query shape; returns the endpoints whose plan contains a COLLSCAN"""
+    offenders = []
+    for endpoint, collection_name, kind, query in query_shapes():
+        stages = set(_winning_stages(explain(db, collection_name, kind, query)))
+        if 'COLLSCAN' in stages:
+            logger.error(f"{endpoint}: {collection_name} query falls back to COLLSCAN")
+            offenders.append(endpoint)
+        else:
+            logger.info(f"{endpoint}: {collection_name} uses {', '.join(sorted(stages)) or 'no plan stages'}")
+    return offenders
+
+
+if __name__ == '__main__':
+    from database import get_database
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+    parser = argparse.ArgumentParser(description='Manage the indexes required by the LungVision API')
+    parser.add_argument('command', choices=['ensure', 'check'])
+    args = parser.parse_args()
+
+    database = get_database()
+    if args.command == 'ensure':
+        sys.exit(1 if ensure_indexes(database) else 0)
+    else:
+        sys.exit(1 if check_query_plans(database) else 0)
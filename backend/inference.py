@@ -0,0 +1,247 @@
+"""Model inference helpers: result formatting and dynamic micro-batching"""
+import importlib
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# The model outputs classes in this order: benign, malignant, normal
+CLASS_NAMES = ['benign', 'malignant', 'normal']
+INPUT_SHAPE = (224, 224, 3)
+
+
+def format_prediction(probabilities):
+    """Turn one row of model output into the /predict response shape"""
+    predicted_class_idx = int(np.argmax(probabilities))
+    return {
+        'predicted_class': CLASS_NAMES[predicted_class_idx].capitalize(),
+        'confidence': float(probabilities[predicted_class_idx]),
+        'probabilities': {
+            name: float(probabilities[i]) for i, name in enumerate(CLASS_NAMES)
+        }
+    }
+
+
+def engine_from_factory(spec):
+    """Engine returned by a "module:function" factory, e.g. a stub model for benchmarks"""
+    module_name, _, function_name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), function_name)()
+
+
+def load_configured_engine(factory=None):
+    """The engine the app would serve (or ``factory``'s), built in this process, for command-line jobs"""
+    if factory:
+        return engine_from_factory(factory)
+
+    from config import INFERENCE_ENGINE, MODEL_PATH, TFLITE_MODEL_PATH, TFLITE_NUM_THREADS
+    from engines import load_engine
+
+    return load_engine(INFERENCE_ENGINE, MODEL_PATH, tflite_path=TFLITE_MODEL_PATH, num_threads=TFLITE_NUM_THREADS)
+
+
+def configured_model_files():
+    """Model artifacts load_configured_engine reads, for watching them for changes"""
+    from config import INFERENCE_ENGINE, MODEL_PATH, TFLITE_MODEL_PATH
+
+    # The tflite engine falls back to the Keras model when the .tflite file is missing
+    return [TFLITE_MODEL_PATH, MODEL_PATH] if INFERENCE_ENGINE == 'tflite' else [MODEL_PATH]
+
+
+def warm_up(engine):
+    """Run the first inference, which traces graphs and allocates buffers; returns seconds taken"""
+    sample = np.zeros((1, *INPUT_SHAPE), dtype=np.float32)
+    started = time.perf_counter()
+    engine.predict(sample)
+    return time.perf_counter() - started
+
+
+def measure_latency(engine, iterations=10):
+    """Mean single-image latency in milliseconds of an already warmed-up engine"""
+    sample = np.random.default_rng(0).random((1, *INPUT_SHAPE), dtype=np.float32)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        engine.predict(sample)
+    return (time.perf_counter() - started) * 1000 / iterations
+
+class QueueFullError(Exception):
+    """Raised when the inference queue has reached its configured depth"""
+
+
+class _PendingRequest:
+    __slots__ = ('tensor', 'future', 'enqueued_at')
+
+    def __init__(self, tensor):
+        self.tensor = tensor
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class InferenceBatcher:
+    """Collect concurrent single-image requests into one forward pass.
+
+    A background thread takes the first queued request, then keeps pulling
+    more until either ``max_batch_size`` requests are collected or
+    ``max_wait_ms`` has elapsed since the first one arrived. The stacked batch
+    goes through ``predict_fn`` once and each caller gets its own row back.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=5.0, max_queue_depth=256):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_queue_depth = max(1, int(max_queue_depth))
+
+        self._queue = queue.Queue(maxsize=self.max_queue_depth)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.batch_size_histogram = Histogram(
+            'inference_batch_size',
+            buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+            description='Number of images per forward pass'
+        )
+        self.queue_wait_histogram = Histogram(
+            'inference_queue_wait_ms',
+            buckets=(0.5, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000),
+            description='Time a request waited in the queue before its batch ran'
+        )
+        self.inference_histogram = Histogram(
+            'inference_batch_latency_ms',
+            description='Wall time of one batched forward pass'
+        )
+        self.rejected_counter = Counter(
+            'inference_rejected_total',
+            description='Requests rejected because the queue was full'
+        )
+        self.queue_depth_gauge = Gauge(
+            'inference_queue_depth',
+            description='Requests waiting for a forward pass',
+            fn=lambda: self.queue_depth
+        )
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='inference-batcher', daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Inference batcher started (max_batch_size={self.max_batch_size}, "
+            f"max_wait_ms={self.max_wait * 1000:.1f}, queue_depth={self.max_queue_depth})"
+        )
+
+    def stop(self, timeout=5.0):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def submit(self, tensor, timeout=None):
+        """Queue one preprocessed image and block until its probabilities are ready.
+
+        ``tensor`` may be a single image (224, 224, 3) or a batch of one.
+        Raises QueueFullError if the queue is at capacity.
+        """
+        return self.enqueue(tensor).result(timeout=timeout)
+
+    def enqueue(self, tensor):
+        """Queue one preprocessed image and return a Future of its probabilities without blocking.
+
+        The tensor is read when its batch runs, so it must not be reused
+        before the Future resolves.
+        """
+        tensor = np.asarray(tensor, dtype=np.float32)
+        if tensor.ndim == 4:
+            tensor = tensor[0]
+
+        pending = _PendingRequest(tensor)
+        try:
+            self._queue.put_nowait(pending)
+        except queue.Full:
+            self.rejected_counter.inc()
+            raise QueueFullError(f"Inference queue is full ({self.max_queue_depth} pending requests)")
+        return pending.future
+
+    def _collect_batch(self):
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # Window closed, but take whatever is already waiting
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            batch = self._collect_batch()
+            if batch:
+                self._run_batch(batch)
+
+        # Fail anything still queued so callers are not left hanging
+        while True:
+            try:
+                pending = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            pending.future.set_exception(RuntimeError('Inference batcher stopped'))
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        for pending in batch:
+            self.queue_wait_histogram.observe((started - pending.enqueued_at) * 1000)
+        self.batch_size_histogram.observe(len(batch))
+
+        try:
+            inputs = np.stack([pending.tensor for pending in batch])
+            outputs = np.asarray(self.predict_fn(inputs))
+        except Exception as e:
+            logger.error(f"Batched inference failed for {len(batch)} requests: {str(e)}")
+            for pending in batch:
+                pending.future.set_exception(e)
+            return
+
+        self.inference_histogram.observe((time.perf_counter() - started) * 1000)
+        for i, pending in enumerate(batch):
+            pending.future.set_result(outputs[i])
+
+    def metrics(self):
+        return [
+            self.batch_size_histogram, self.queue_wait_histogram, self.inference_histogram,
+            self.rejected_counter, self.queue_depth_gauge
+        ]
+
+    def stats(self):
+        return {
+            'config': {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'max_queue_depth': self.max_queue_depth
+            },
+            'queue_depth': self.queue_depth,
+            'rejected': self.rejected_counter.value,
+            'batch_size': self.batch_size_histogram.snapshot(),
+            'queue_wait_ms': self.queue_wait_histogram.snapshot(),
+            'batch_latency_ms': self.inference_histogram.snapshot()
+        }
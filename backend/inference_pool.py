@@ -0,0 +1,683 @@
+"""Out-of-process inference pool shared by every HTTP worker.
+
+``python inference_pool.py`` starts a supervisor that owns a fixed number of
+model-holding worker processes and one shared-memory segment split into
+slots. Each slot holds one (224, 224, 3) float32 input and its class
+probabilities. HTTP workers connect with ``InferencePoolClient``, lease a
+few slots, write preprocessed tensors straight into them and send only the
+slot indices over a local socket. Workers gather the slots queued for them
+into one batch, run the model and write the probabilities back in place,
+so arrays are never pickled and only the pool holds TensorFlow and the
+weights. Workers that die are restarted; requests they were running fail
+so callers can retry.
+
+Point the HTTP workers at the pool with INFERENCE_POOL_ADDRESS::
+
+    python inference_pool.py --workers 2
+    INFERENCE_POOL_ADDRESS=/tmp/lungvision-inference.sock gunicorn -w 8 app:app
+"""
+import argparse
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from inference import CLASS_NAMES, INPUT_SHAPE, QueueFullError, engine_from_factory
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = '/tmp/lungvision-inference.sock'
+INPUT_BYTES = int(np.prod(INPUT_SHAPE)) * np.dtype(np.float32).itemsize
+NUM_CLASSES = len(CLASS_NAMES)
+WORKER_START_TIMEOUT = 300
+RESTART_BACKOFF_SECONDS = 5
+
+
+def parse_address(address):
+    """'host:port' means TCP; anything else is a Unix socket path"""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and '/' not in address:
+        return (host or '127.0.0.1', int(port))
+    return address
+
+
+def segment_size(num_slots):
+    return num_slots * (INPUT_BYTES + NUM_CLASSES * np.dtype(np.float32).itemsize)
+
+
+class SlotArrays:
+    """numpy views over the shared segment: all inputs first, then all outputs"""
+
+    def __init__(self, shm, num_slots):
+        self.inputs = np.ndarray((num_slots, *INPUT_SHAPE), dtype=np.float32, buffer=shm.buf)
+        self.outputs = np.ndarray(
+            (num_slots, NUM_CLASSES), dtype=np.float32, buffer=shm.buf, offset=num_slots * INPUT_BYTES
+        )
+
+
+def attach_segment(name, owned_elsewhere=False):
+    shm = shared_memory.SharedMemory(name=name)
+    if owned_elsewhere:
+        # The pool owns the segment; keep this process's resource tracker from unlinking it at exit
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def load_pool_engine(engine_config):
+    """Build a worker's engine; a 'factory' ("module:function") replaces the configured model, e.g. with a stub"""
+    factory = engine_config.get('factory')
+    if factory:
+        return engine_from_factory(factory)
+
+    from engines import load_engine
+
+    return load_engine(
+        engine_config['engine'],
+        engine_config['model_path'],
+        tflite_path=engine_config.get('tflite_path'),
+        num_threads=engine_config.get('threads')
+    )
+
+
+def _worker_main(index, segment, num_slots, tasks, results, engine_config, max_batch_size):
+    """Model-holding worker: runs queued slot batches until it receives None"""
+    logging.basicConfig(level=logging.INFO)
+    threads = engine_config.get('threads')
+    if threads and not engine_config.get('factory') and engine_config['engine'] != 'tflite':
+        import tensorflow as tf
+        # Workers split the cores between them instead of each claiming all of them
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+
+    try:
+        engine = load_pool_engine(engine_config)
+    except Exception as e:
+        results.put(('failed', index, str(e)))
+        return
+    if engine is None:
+        results.put(('failed', index, 'Model file not found'))
+        return
+
+    shm = attach_segment(segment)
+    arrays = SlotArrays(shm, num_slots)
+    results.put(('ready', index, engine.version))
+
+    stopping = False
+    while not stopping:
+        task = tasks.get()
+        if task is None:
+            break
+        batch = [task]
+        size = len(task[1])
+        # Take whatever else is already queued, up to one full batch
+        while size < max_batch_size:
+            try:
+                task = tasks.get_nowait()
+            except queue.Empty:
+                break
+            if task is None:
+                stopping = True
+                break
+            batch.append(task)
+            size += len(task[1])
+
+        slots = [slot for _, task_slots in batch for slot in task_slots]
+        error = None
+        try:
+            arrays.outputs[slots] = engine.predict(arrays.inputs[slots])
+        except Exception as e:
+            error = str(e)
+        results.put(('done', index, [key for key, _ in batch], error))
+
+    del arrays
+    shm.close()
+
+
+class _ClientState:
+    __slots__ = ('conn', 'slots', 'send_lock', 'in_flight', 'closed')
+
+    def __init__(self, conn, slots):
+        self.conn = conn
+        self.slots = frozenset(slots)
+        self.send_lock = threading.Lock()
+        self.in_flight = 0
+        self.closed = False
+
+
+class InferencePoolServer:
+    """Supervisor of the worker processes, the shared slots and the client connections"""
+
+    def __init__(self, address, authkey, workers=2, num_slots=64, slots_per_client=8,
+                 max_batch_size=16, engine_config=None):
+        self.address = address
+        self.authkey = authkey
+        self.num_workers = max(1, int(workers))
+        self.num_slots = max(1, int(num_slots))
+        self.slots_per_client = max(1, int(slots_per_client))
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.engine_config = engine_config or {}
+        self.version = None
+
+        self._ctx = mp.get_context('spawn')
+        self._shm = shared_memory.SharedMemory(create=True, size=segment_size(self.num_slots))
+        self._free_slots = list(range(self.num_slots))
+        self._results = self._ctx.Queue()
+        self._workers = [None] * self.num_workers
+        self._ready = [False] * self.num_workers
+        self._started_at = [0.0] * self.num_workers
+        self._in_flight = [{} for _ in range(self.num_workers)]
+        self._clients = {}
+        self._client_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._any_ready = threading.Event()
+        self._stopping = threading.Event()
+
+        self.restarts = Counter('inference_pool_worker_restarts_total', 'Workers restarted after dying')
+        self.requests = Counter('inference_pool_requests_total', 'Inference requests dispatched to workers')
+
+    def _start_worker(self, index):
+        tasks = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(index, self._shm.name, self.num_slots, tasks, self._results, self.engine_config, self.max_batch_size),
+            name=f'inference-worker-{index}',
+            daemon=True
+        )
+        process.start()
+        self._workers[index] = (process, tasks)
+        self._ready[index] = False
+        self._started_at[index] = time.monotonic()
+        logger.info(f"Started inference worker {index} (pid {process.pid})")
+
+    def serve_forever(self):
+        for index in range(self.num_workers):
+            self._start_worker(index)
+        threading.Thread(target=self._collect_results, name='pool-results', daemon=True).start()
+        threading.Thread(target=self._supervise, name='pool-supervisor', daemon=True).start()
+
+        if not self._any_ready.wait(WORKER_START_TIMEOUT):
+            self.close()
+            raise RuntimeError('No inference worker became ready')
+
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)  # stale socket from a previous run
+        listener = Listener(self.address, authkey=self.authkey)
+        logger.info(
+            f"Inference pool listening on {self.address} "
+            f"({self.num_workers} workers, {self.num_slots} slots, model {self.version})"
+        )
+        try:
+            while not self._stopping.is_set():
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, mp.AuthenticationError) as e:
+                    logger.warning(f"Rejected inference pool connection: {str(e)}")
+                    continue
+                self._register_client(conn)
+        finally:
+            listener.close()
+            self.close()
+
+    def _register_client(self, conn):
+        with self._lock:
+            count = min(self.slots_per_client, len(self._free_slots))
+            slots = [self._free_slots.pop() for _ in range(count)]
+        if not slots:
+            conn.send(('refused', 'No free inference slots'))
+            conn.close()
+            return
+
+        client_id = next(self._client_ids)
+        state = _ClientState(conn, slots)
+        with self._lock:
+            self._clients[client_id] = state
+        conn.send(('welcome', {
+            'segment': self._shm.name,
+            'num_slots': self.num_slots,
+            'slots': slots,
+            'version': self.version
+        }))
+        threading.Thread(target=self._serve_client, args=(client_id, state), name=f'pool-client-{client_id}', daemon=True).start()
+
+    def _serve_client(self, client_id, state):
+        try:
+            while True:
+                kind, request_id, payload = state.conn.recv()
+                if kind == 'infer':
+                    if not payload or not state.slots.issuperset(payload):
+                        self._send(state, ('done', request_id, 'Slots not leased to this client'))
+                    else:
+                        self._dispatch(client_id, state, request_id, payload)
+                elif kind == 'stats':
+                    self._send(state, ('stats', request_id, self.stats()))
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self._lock:
+                state.closed = True
+                self._release_if_idle(client_id, state)
+
+    def _dispatch(self, client_id, state, request_id, slots):
+        with self._lock:
+            candidates = [i for i in range(self.num_workers) if self._ready[i] and self._workers[i][0].is_alive()]
+            if not candidates:
+                error = 'No inference worker available'
+            else:
+                # Least outstanding images first, so batches form on busy workers only under load
+                index = min(candidates, key=lambda i: sum(self._in_flight[i].values()))
+                self._in_flight[index][(client_id, request_id)] = len(slots)
+                state.in_flight += 1
+                tasks = self._workers[index][1]
+                error = None
+        if error:
+            self._send(state, ('done', request_id, error))
+            return
+        self.requests.inc()
+        tasks.put(((client_id, request_id), slots))
+
+    def _finish(self, key, error):
+        """Reply to the client behind ``key``; call with the lock held"""
+        client_id, request_id = key
+        state = self._clients.get(client_id)
+        if state is None:
+            return
+        state.in_flight -= 1
+        if state.closed:
+            self._release_if_idle(client_id, state)
+        else:
+            self._send(state, ('done', request_id, error))
+
+    def _release_if_idle(self, client_id, state):
+        # Slots of a departed client are reused only once no worker can still write to them
+        if state.closed and state.in_flight == 0 and self._clients.pop(client_id, None) is not None:
+            self._free_slots.extend(state.slots)
+
+    def _send(self, state, message):
+        try:
+            with state.send_lock:
+                state.conn.send(message)
+        except (OSError, ValueError):
+            pass
+
+    def _collect_results(self):
+        while not self._stopping.is_set():
+            try:
+                message = self._results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            kind, index = message[0], message[1]
+            if kind == 'ready':
+                version = message[2]
+                if self.version is not None and version != self.version:
+                    logger.warning(f"Inference worker {index} loaded {version}, pool serves {self.version}")
+                self.version = self.version or version
+                with self._lock:
+                    self._ready[index] = True
+                self._any_ready.set()
+                logger.info(f"Inference worker {index} ready ({version})")
+            elif kind == 'failed':
+                logger.error(f"Inference worker {index} failed to start: {message[2]}")
+            elif kind == 'done':
+                _, _, keys, error = message
+                with self._lock:
+                    for key in keys:
+                        if self._in_flight[index].pop(key, None) is not None:
+                            self._finish(key, error)
+
+    def _supervise(self):
+        while not self._stopping.wait(0.5):
+            for index, (process, _) in enumerate(self._workers):
+                if process.is_alive():
+                    continue
+                if time.monotonic() - self._started_at[index] < RESTART_BACKOFF_SECONDS:
+                    continue  # crash-looping; don't spin
+                logger.error(f"Inference worker {index} (pid {process.pid}) exited with code {process.exitcode}, restarting")
+                with self._lock:
+                    self._ready[index] = False
+                    lost, self._in_flight[index] = self._in_flight[index], {}
+                    for key in lost:
+                        self._finish(key, 'Inference worker died, please retry')
+                self.restarts.inc()
+                self._start_worker(index)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.num_workers,
+                'ready_workers': sum(self._ready),
+                'restarts': self.restarts.value,
+                'requests': self.requests.value,
+                'clients': len(self._clients),
+                'slots': self.num_slots,
+                'free_slots': len(self._free_slots),
+                'in_flight_images': sum(sum(in_flight.values()) for in_flight in self._in_flight),
+                'version': self.version
+            }
+
+    def close(self):
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        for process, tasks in filter(None, self._workers):
+            tasks.put(None)
+        for process, _ in filter(None, self._workers):
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self._shm.close()
+        self._shm.unlink()
+
+
+class _Request:
+    __slots__ = ('slots', 'free', 'event', 'payload', 'abandoned')
+
+    def __init__(self, slots, free):
+        self.slots = slots
+        self.free = free
+        self.event = threading.Event()
+        self.payload = None
+        self.abandoned = False
+
+
+class InferencePoolClient:
+    """Engine-compatible handle on a running pool, one per HTTP worker process.
+
+    ``predict(batch)`` behaves like the engines in engines.py, so the client
+    can stand in for a local model. ``slot()`` leases a single slot so the
+    caller can preprocess straight into shared memory. A lost connection is
+    re-established on the next call.
+    """
+    name = 'pool'
+
+    def __init__(self, address, authkey, timeout=30.0):
+        self.address = parse_address(address) if isinstance(address, str) else address
+        self.authkey = authkey
+        self.timeout = timeout
+        # Called with the new version when (re)connecting to a pool serving a different model
+        self.on_version_change = None
+
+        self._version = None
+        self._conn = None
+        self._arrays = None
+        self._shm = None
+        self._free = None
+        self._slot_count = 0
+        self._pending = {}
+        self._request_ids = itertools.count()
+        self._connect_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+
+        self.round_trip_histogram = Histogram(
+            'inference_pool_round_trip_ms',
+            description='Time from sending slots to the pool until their probabilities are back'
+        )
+        self.failures = Counter('inference_pool_failures_total', 'Pool requests that failed or timed out')
+        self.free_slots = Gauge(
+            'inference_pool_free_slots',
+            'Shared-memory slots this client can lease right now',
+            fn=lambda: self._free.qsize() if self._free is not None else 0
+        )
+
+    @property
+    def version(self):
+        self.connect()
+        return self._version
+
+    def connect(self):
+        if self._conn is not None:
+            return
+        with self._connect_lock:
+            if self._conn is not None:
+                return
+            conn = Client(self.address, authkey=self.authkey)
+            kind, info = conn.recv()
+            if kind != 'welcome':
+                conn.close()
+                raise ConnectionError(f"Inference pool refused connection: {info}")
+
+            previous_version = self._version
+            self._shm = attach_segment(info['segment'], owned_elsewhere=True)
+            self._arrays = SlotArrays(self._shm, info['num_slots'])
+            self._version = info['version']
+            free = queue.Queue()
+            for slot in info['slots']:
+                free.put(slot)
+            self._free = free
+            self._slot_count = len(info['slots'])
+            self._conn = conn
+            threading.Thread(target=self._read_replies, args=(conn,), name='pool-replies', daemon=True).start()
+            logger.info(f"Connected to inference pool at {self.address} ({self._slot_count} slots, model {self._version})")
+
+        if previous_version is not None and previous_version != self._version and self.on_version_change:
+            self.on_version_change(self._version)
+
+    def _read_replies(self, conn):
+        try:
+            while True:
+                _, request_id, payload = conn.recv()
+                with self._pending_lock:
+                    request = self._pending.pop(request_id, None)
+                if request is None:
+                    continue
+                if request.abandoned:
+                    # The caller gave up waiting; its slots are only safe to reuse now
+                    for slot in request.slots:
+                        request.free.put(slot)
+                    continue
+                request.payload = payload
+                request.event.set()
+        except (EOFError, OSError):
+            logger.warning("Lost connection to the inference pool")
+        finally:
+            with self._connect_lock:
+                if self._conn is conn:
+                    self._conn = None
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            for request in pending.values():
+                request.payload = 'Lost connection to the inference pool'
+                request.event.set()
+
+    def _call(self, kind, slots=None, free=None):
+        """Send one request and wait for its reply payload"""
+        conn = self._conn
+        if conn is None:
+            raise ConnectionError('Not connected to the inference pool')
+        request_id = next(self._request_ids)
+        request = _Request(slots or [], free)
+        with self._pending_lock:
+            self._pending[request_id] = request
+        try:
+            with self._send_lock:
+                conn.send((kind, request_id, slots))
+        except (OSError, ValueError) as e:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            raise ConnectionError(f"Inference pool unavailable: {str(e)}")
+
+        if not request.event.wait(self.timeout):
+            with self._pending_lock:
+                if self._pending.get(request_id) is request:
+                    request.abandoned = True
+            if request.abandoned:
+                raise TimeoutError(f"Inference pool did not answer within {self.timeout}s")
+        return request.payload
+
+    def _acquire(self, count):
+        free = self._free
+        try:
+            slots = [free.get(timeout=self.timeout)]
+        except queue.Empty:
+            raise QueueFullError('No free inference pool slots')
+        while len(slots) < count:
+            try:
+                slots.append(free.get_nowait())
+            except queue.Empty:
+                break
+        return free, slots
+
+    def _run(self, free, slots):
+        """Run leased slots whose inputs are already written; outputs are in place on return"""
+        started = time.perf_counter()
+        try:
+            error = self._call('infer', slots, free)
+        except Exception:
+            self.failures.inc()
+            raise
+        if error:
+            self.failures.inc()
+            raise RuntimeError(f"Inference failed: {error}")
+        self.round_trip_histogram.observe((time.perf_counter() - started) * 1000)
+
+    @contextmanager
+    def slot(self):
+        """Lease one slot: write the preprocessed image into ``lease.input``, then call ``lease.run()``"""
+        self.connect()
+        free, (index,) = self._acquire(1)
+        lease = _SlotLease(self, free, index)
+        try:
+            yield lease
+        finally:
+            if not lease.abandoned:
+                free.put(index)
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        if batch.ndim == len(INPUT_SHAPE):
+            batch = batch[np.newaxis]
+        self.connect()
+
+        outputs = np.empty((len(batch), NUM_CLASSES), dtype=np.float32)
+        start = 0
+        while start < len(batch):
+            free, slots = self._acquire(len(batch) - start)
+            abandoned = False
+            try:
+                arrays = self._arrays
+                arrays.inputs[slots] = batch[start:start + len(slots)]
+                try:
+                    self._run(free, slots)
+                except TimeoutError:
+                    abandoned = True
+                    raise
+                outputs[start:start + len(slots)] = arrays.outputs[slots]
+            finally:
+                if not abandoned:
+                    for slot in slots:
+                        free.put(slot)
+            start += len(slots)
+        return outputs
+
+    def metrics(self):
+        return [self.round_trip_histogram, self.failures, self.free_slots]
+
+    def stats(self):
+        stats = {
+            'address': str(self.address),
+            'connected': self._conn is not None,
+            'version': self._version,
+            'slots': self._slot_count,
+            'free_slots': self._free.qsize() if self._free is not None else 0,
+            'failures': self.failures.value,
+            'round_trip_ms': self.round_trip_histogram.snapshot(),
+            'pool': None
+        }
+        if self._conn is not None:
+            try:
+                stats['pool'] = self._call('stats')
+            except Exception as e:
+                logger.warning(f"Could not fetch inference pool stats: {str(e)}")
+        return stats
+
+
+def connect_client(address, authkey, timeout=30.0, retries=3, retry_delay=2):
+    """Connected InferencePoolClient, retrying while the pool is still starting"""
+    client = InferencePoolClient(address, authkey, timeout=timeout)
+    for attempt in range(retries):
+        try:
+            client.connect()
+            return client
+        except (OSError, ConnectionError) as e:
+            logger.error(f"Attempt {attempt + 1} failed to connect to the inference pool: {str(e)}")
+            if attempt < retries - 1:
+                time.sleep(retry_delay)
+            else:
+                raise
+
+
+class _SlotLease:
+    __slots__ = ('client', 'free', 'index', 'input', 'abandoned')
+
+    def __init__(self, client, free, index):
+        self.client = client
+        self.free = free
+        self.index = index
+        self.input = client._arrays.inputs[index]
+        self.abandoned = False
+
+    def run(self):
+        """Probabilities for the image written into ``input``"""
+        try:
+            self.client._run(self.free, [self.index])
+        except TimeoutError:
+            self.abandoned = True
+            raise
+        return self.client._arrays.outputs[self.index].copy()
+
+
+if __name__ == '__main__':
+    from config import (
+        INFERENCE_ENGINE, INFERENCE_ENGINE_FACTORY, INFERENCE_MAX_BATCH_SIZE, INFERENCE_POOL_ADDRESS,
+        INFERENCE_POOL_AUTHKEY, MODEL_PATH, TFLITE_MODEL_PATH
+    )
+
+    logging.basicConfig(level=logging.INFO)
+    cpu_count = os.cpu_count() or 2
+    parser = argparse.ArgumentParser(description='Run the shared inference worker pool')
+    parser.add_argument('--address', default=INFERENCE_POOL_ADDRESS or DEFAULT_ADDRESS,
+                        help='Unix socket path or host:port to listen on')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('INFERENCE_POOL_WORKERS', '2')),
+                        help='Model-holding worker processes')
+    parser.add_argument('--slots', type=int, default=int(os.getenv('INFERENCE_POOL_SLOTS', '64')),
+                        help='Shared-memory input slots in total')
+    parser.add_argument('--slots-per-client', type=int, default=int(os.getenv('INFERENCE_POOL_SLOTS_PER_CLIENT', '8')),
+                        help='Slots leased to each connecting HTTP worker')
+    parser.add_argument('--max-batch-size', type=int, default=INFERENCE_MAX_BATCH_SIZE)
+    parser.add_argument('--threads-per-worker', type=int, default=None,
+                        help='TensorFlow/TFLite threads per worker (default: cores / workers)')
+    parser.add_argument('--engine-factory', default=INFERENCE_ENGINE_FACTORY,
+                        help='"module:function" returning an engine to serve instead of the configured model')
+    args = parser.parse_args()
+
+    server = InferencePoolServer(
+        parse_address(args.address),
+        INFERENCE_POOL_AUTHKEY,
+        workers=args.workers,
+        num_slots=args.slots,
+        slots_per_client=args.slots_per_client,
+        max_batch_size=args.max_batch_size,
+        engine_config={
+            'engine': INFERENCE_ENGINE,
+            'model_path': MODEL_PATH,
+            'tflite_path': TFLITE_MODEL_PATH,
+            'threads': args.threads_per_worker or max(1, cpu_count // args.workers),
+            'factory': args.engine_factory
+        }
+    )
+    # Let process managers stop the pool cleanly so the shared segment is unlinked
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Inference pool stopped")
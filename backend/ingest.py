@@ -0,0 +1,373 @@
+"""Bulk import of archived scans for an existing doctor, without the HTTP round trips.
+
+    python ingest.py MANIFEST --doctor DOCTOR_ID [--source DIR_OR_ZIP] [--checkpoint FILE]
+
+The manifest is a CSV file with a header row. ``file`` (a path inside the
+source directory or zip archive) and ``patientId`` (one of the doctor's
+patients) are required; ``timestamp`` (ISO date of the scan), ``medicalHistory``
+and ``doctorNotes`` are optional.
+
+Rows flow through three stages joined by bounded queues, so a slow stage
+holds the ones before it back instead of letting work pile up in memory:
+
+1. ``--readers`` threads read each file, decode it into its own model input
+   array and store it in the image store, where it stays collectable by
+   ``image_store.py gc`` until its record is written
+2. one thread stacks decoded images into batches of ``--batch-size`` and runs
+   the model once per batch
+3. one thread writes scan documents with unordered ``insert_many`` in batches
+   of ``--write-batch-size``, then the image references and stats rollups
+   with ``bulk_write``
+
+After every write the manifest rows it covered are appended to the
+checkpoint file, so an interrupted run resumes where it stopped. Each record
+also carries an ``ingestKey`` under a unique index, so rows written just
+before a crash (and whole manifests imported twice) are not duplicated.
+"""
+import argparse
+import csv
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+import zipfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from http_cache import DataVersions
+from image_store import BLOBS_COLLECTION, blob_ref_update
+from inference import INPUT_SHAPE, format_prediction
+from preprocessing import decode_and_preprocess
+from records import build_scan_record, check_upload_name
+from rollups import rollup_updates
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+_DONE = object()
+
+
+class ManifestError(ValueError):
+    """Raised for a manifest that is missing required columns"""
+
+
+def read_manifest(path):
+    """Rows of the manifest as dicts, each with its 1-based ``row`` number"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        missing = {'file', 'patientId'} - set(reader.fieldnames or ())
+        if missing:
+            raise ManifestError(f"Manifest is missing column(s): {', '.join(sorted(missing))}")
+        return [dict(row, row=number) for number, row in enumerate(reader, start=1)]
+
+
+def load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {int(line) for line in f if line.strip()}
+
+
+def ingest_key(doctor_id, row):
+    """Stable identity of one manifest row, so importing it again is a no-op"""
+    source = f"{doctor_id}|{row['patientId']}|{row['file']}|{row.get('timestamp') or ''}"
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()[:32]
+
+
+class SourceReader:
+    """Reads manifest files from a directory or a zip archive; safe to share between threads"""
+
+    def __init__(self, source):
+        self.source = source
+        self._zip = zipfile.ZipFile(source) if zipfile.is_zipfile(source) else None
+
+    def read(self, name):
+        if self._zip is not None:
+            return self._zip.read(name)
+        root = os.path.abspath(self.source)
+        path = os.path.abspath(os.path.join(root, name))
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError('File is outside the source directory')
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+
+
+class StageTimer:
+    """Busy time per stage, to show which one bounds the throughput"""
+
+    def __init__(self):
+        self.seconds = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage, started):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.seconds[stage] += elapsed
+
+
+class IngestPipeline:
+    def __init__(self, db, image_store, engine, doctor_id, reader, checkpoint_path=None, readers=4,
+                 batch_size=32, write_batch_size=500, queue_depth=256):
+        self.db = db
+        self.image_store = image_store
+        self.engine = engine
+        self.doctor_id = doctor_id
+        self.reader = reader
+        self.checkpoint_path = checkpoint_path
+        self.readers = readers
+        self.batch_size = batch_size
+        self.write_batch_size = write_batch_size
+        self.queue_depth = queue_depth
+        self.timer = StageTimer()
+        self.counts = Counter()
+        self.failures = []
+        self._failures_lock = threading.Lock()
+
+    def _fail(self, row, error):
+        with self._failures_lock:
+            self.failures.append((row['row'], row['file'], error))
+            self.counts['failed'] += 1
+
+    def run(self, rows):
+        """Ingest ``rows`` (from read_manifest); returns the throughput report"""
+        done = load_checkpoint(self.checkpoint_path)
+        patients = {p['_id'] for p in self.db.patients.find({'doctorId': self.doctor_id}, {'_id': 1})}
+        pending = []
+        for row in rows:
+            if row['row'] in done:
+                self.counts['skipped'] += 1
+            elif row['patientId'] not in patients:
+                self._fail(row, f"Unknown patient '{row['patientId']}' for this doctor")
+            else:
+                pending.append(row)
+
+        decoded = queue.Queue(maxsize=self.queue_depth)
+        predicted = queue.Queue(maxsize=self.queue_depth)
+        inference_thread = threading.Thread(target=self._infer, args=(decoded, predicted), name='ingest-infer')
+        writer_thread = threading.Thread(target=self._write, args=(predicted,), name='ingest-write')
+        started = time.perf_counter()
+        inference_thread.start()
+        writer_thread.start()
+
+        # Bounds submitted-but-unread rows; the queues bound everything after the readers
+        in_flight = threading.BoundedSemaphore(self.queue_depth)
+
+        def read_one(row):
+            try:
+                self._read(row, decoded)
+            finally:
+                in_flight.release()
+
+        with ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix='ingest-read') as executor:
+            for row in pending:
+                in_flight.acquire()
+                executor.submit(read_one, row)
+        decoded.put(_DONE)
+        inference_thread.join()
+        writer_thread.join()
+        self.reader.close()
+
+        if self.counts['inserted']:
+            # Let /history, /patients and /stats ETags move on
+            DataVersions(self.db['data_versions']).bump(self.doctor_id)
+        return self.report(time.perf_counter() - started)
+
+    def _read(self, row, decoded):
+        started = time.perf_counter()
+        try:
+            check_upload_name(row['file'])
+            timestamp = datetime.fromisoformat(row['timestamp']) if row.get('timestamp') else None
+            data = self.reader.read(row['file'])
+            tensor = np.empty(INPUT_SHAPE, dtype=np.float32)
+            decode_and_preprocess(data, tensor)
+            stored = self.image_store.put_bytes(data)
+            # Registered without references, so gc reclaims the blob if this row never gets its record
+            self.db[BLOBS_COLLECTION].update_one(*blob_ref_update(stored, 0), upsert=True)
+        except Exception as e:
+            self._fail(row, str(e))
+            return
+        finally:
+            self.timer.add('read_decode', started)
+        decoded.put((row, timestamp, stored, tensor))
+
+    def _infer(self, decoded, predicted):
+        finished = False
+        while not finished:
+            batch = [decoded.get()]
+            # Take whatever else is already decoded, up to a full batch, without waiting for more
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(decoded.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is _DONE:
+                batch.pop()
+                finished = True
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            try:
+                outputs = self.engine.predict(np.stack([item[3] for item in batch]))
+            except Exception as e:
+                logger.error(f"Inference failed for a batch of {len(batch)} images: {str(e)}")
+                for item in batch:
+                    self._fail(item[0], f"Inference failed: {str(e)}")
+                continue
+            finally:
+                self.timer.add('inference', started)
+            self.counts['batches'] += 1
+            for (row, timestamp, stored, _), probabilities in zip(batch, outputs):
+                predicted.put((row, timestamp, stored, format_prediction(probabilities)))
+        predicted.put(_DONE)
+
+    def _write(self, predicted):
+        pending = []
+        while True:
+            item = predicted.get()
+            if item is not _DONE:
+                pending.append(item)
+            if pending and (item is _DONE or len(pending) >= self.write_batch_size):
+                started = time.perf_counter()
+                try:
+                    self._flush(pending)
+                except Exception as e:
+                    logger.error(f"Writing {len(pending)} scan records failed: {str(e)}")
+                    for row, *_ in pending:
+                        self._fail(row, f"Database write failed: {str(e)}")
+                finally:
+                    self.timer.add('write', started)
+                pending = []
+            if item is _DONE:
+                return
+
+    def _flush(self, items):
+        records = []
+        for row, timestamp, stored, prediction in items:
+            prediction['medicalHistory'] = row.get('medicalHistory') or None
+            prediction['doctorNotes'] = row.get('doctorNotes') or None
+            record = build_scan_record(
+                row['patientId'], self.doctor_id, stored, prediction, timestamp=timestamp, model_version=self.engine.version
+            )
+            record['ingestKey'] = ingest_key(self.doctor_id, row)
+            records.append(record)
+
+        # References first: a crash before the insert over-counts (gc keeps the blob), never under-counts
+        refs = Counter(stored.digest for _, _, stored, _ in items)
+        blobs = {stored.digest: stored for _, _, stored, _ in items}
+        self.db[BLOBS_COLLECTION].bulk_write(
+            [UpdateOne(*blob_ref_update(blobs[digest], count), upsert=True) for digest, count in refs.items()],
+            ordered=False
+        )
+
+        duplicates = set()
+        try:
+            self.db.scans.insert_many(records, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details['writeErrors']:
+                if error['code'] != DUPLICATE_KEY:
+                    raise
+                duplicates.add(error['index'])
+        if duplicates:
+            # Already imported by an earlier run; hand back the references taken for them
+            dropped = Counter(items[index][2].digest for index in duplicates)
+            self.db[BLOBS_COLLECTION].bulk_write(
+                [UpdateOne(*blob_ref_update(blobs[digest], -count)) for digest, count in dropped.items()],
+                ordered=False
+            )
+
+        rollups = {}
+        for index, record in enumerate(records):
+            if index in duplicates:
+                continue
+            for collection, query, update in rollup_updates(
+                    self.doctor_id, record['patientId'], record['timestamp'], record['diagnosis'], record['confidence']):
+                rollups.setdefault(collection, []).append(UpdateOne(query, update, upsert=True))
+        for collection, operations in rollups.items():
+            self.db[collection].bulk_write(operations, ordered=False)
+
+        if self.checkpoint_path:
+            with open(self.checkpoint_path, 'a') as f:
+                f.write(''.join(f"{row['row']}\n" for row, *_ in items))
+                f.flush()
+                os.fsync(f.fileno())
+
+        self.counts['inserted'] += len(records) - len(duplicates)
+        self.counts['duplicates'] += len(duplicates)
+        logger.info(f"Wrote {self.counts['inserted']} scans ({self.counts['duplicates']} already imported)")
+
+    def report(self, elapsed):
+        processed = self.counts['inserted'] + self.counts['duplicates']
+        return {
+            'inserted': self.counts['inserted'],
+            'duplicates': self.counts['duplicates'],
+            'skipped': self.counts['skipped'],
+            'failed': self.counts['failed'],
+            'inference_batches': self.counts['batches'],
+            'elapsed_seconds': round(elapsed, 2),
+            'images_per_second': round(processed / elapsed, 1) if elapsed else None,
+            # Summed over threads: read_decode can exceed the wall time with several readers
+            'stage_busy_seconds': {stage: round(seconds, 2) for stage, seconds in self.timer.seconds.items()}
+        }
+
+
+if __name__ == '__main__':
+    from config import IMAGE_STORE_DIR, IMAGE_STORE_FSYNC, IMAGE_STORE_SHARD_DEPTH, INFERENCE_ENGINE_FACTORY
+    from database import get_database
+    from image_store import ImageStore
+    from indexes import ensure_indexes
+    from inference import load_configured_engine
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Import archived scans for a doctor from a manifest')
+    parser.add_argument('manifest', help='CSV with file and patientId columns (optional: timestamp, '
+                                         'medicalHistory, doctorNotes)')
+    parser.add_argument('--doctor', required=True, help='Doctor id the scans belong to')
+    parser.add_argument('--source', help='Directory or zip archive holding the files (default: the manifest directory)')
+    parser.add_argument('--checkpoint', help='Progress file (default: MANIFEST.checkpoint)')
+    parser.add_argument('--readers', type=int, default=os.cpu_count() or 4, help='Read/decode threads')
+    parser.add_argument('--batch-size', type=int, default=32, help='Images per model call')
+    parser.add_argument('--write-batch-size', type=int, default=500, help='Scan records per insert_many')
+    parser.add_argument('--queue-depth', type=int, default=256, help='Images buffered between stages')
+    parser.add_argument('--engine-factory', default=INFERENCE_ENGINE_FACTORY,
+                        help='"module:function" returning the engine instead of the configured model')
+    args = parser.parse_args()
+
+    database = get_database()
+    if not database.doctors.find_one({'_id': args.doctor}, {'_id': 1}):
+        parser.error(f"Unknown doctor '{args.doctor}'")
+    # The unique ingestKey index is what makes re-runs safe
+    ensure_indexes(database)
+
+    pipeline = IngestPipeline(
+        database,
+        ImageStore(IMAGE_STORE_DIR, shard_depth=IMAGE_STORE_SHARD_DEPTH, fsync=IMAGE_STORE_FSYNC),
+        load_configured_engine(args.engine_factory),
+        args.doctor,
+        SourceReader(args.source or os.path.dirname(os.path.abspath(args.manifest))),
+        checkpoint_path=args.checkpoint or f"{args.manifest}.checkpoint",
+        readers=args.readers,
+        batch_size=args.batch_size,
+        write_batch_size=args.write_batch_size,
+        queue_depth=args.queue_depth
+    )
+    summary = pipeline.run(read_manifest(args.manifest))
+    for row, name, error in pipeline.failures[:20]:
+        logger.warning(f"Row {row} ({name}): {error}")
+    logger.info(
+        f"Ingested {summary['inserted']} scans in {summary['elapsed_seconds']}s "
+        f"({summary['images_per_second']} images/sec); {summary['duplicates']} already imported, "
+        f"{summary['skipped']} skipped by checkpoint, {summary['failed']} failed; "
+        f"stage busy seconds {summary['stage_busy_seconds']}"
+    )
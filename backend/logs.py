@@ -0,0 +1,129 @@
+"""Logging setup: non-blocking queue handler, request ids, structured records and sampling.
+
+``configure_logging`` routes every record through a queue, so request
+threads (or the event loop) only enqueue; a background listener thread
+formats and writes them. Records carry the current request id, and
+``extra={'fields': {...}}`` adds structured fields, which the JSON format
+emits as keys and the text format appends as ``key=value``.
+
+Diagnostic detail goes behind ``verbose(logger)``: it is on for every
+request when the logger is at DEBUG, and for a sampled fraction of requests
+otherwise, so building the message is skipped entirely for the rest.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import uuid
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'
+
+# Accept a caller's X-Request-ID only if it is short and harmless to echo into logs
+_REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+request_id = contextvars.ContextVar('request_id', default=None)
+_sampled = contextvars.ContextVar('log_sampled', default=False)
+_fields = contextvars.ContextVar('log_fields', default=None)
+_sample_rate = 0.0
+_listener = None
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps records with the request id; runs on the calling thread, before the record is queued.
+
+    An explicit ``extra={'request_id': ...}`` wins, for records written after the request context is cleared.
+    """
+
+    def filter(self, record):
+        if getattr(record, 'request_id', None) is None:
+            record.request_id = request_id.get() or '-'
+        return True
+
+
+def _render(value):
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, default=str, separators=(',', ':'))
+    return str(value)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={_render(value)}" for key, value in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level='INFO', fmt='text', sample_rate=0.0):
+    """Replace the root handlers with a queue handler drained by a background thread"""
+    global _listener, _sample_rate
+
+    _sample_rate = max(0.0, min(1.0, sample_rate))
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler()
+    stream.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter(TEXT_FORMAT))
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, stream)
+    _listener.start()
+    # Flush what is still queued when the process exits
+    atexit.register(_listener.stop)
+
+
+def start_request(incoming_id=None):
+    """Set the request id (the caller's X-Request-ID when valid) and the sampling decision; returns the id"""
+    if not incoming_id or not _REQUEST_ID_PATTERN.match(incoming_id):
+        incoming_id = uuid.uuid4().hex
+    request_id.set(incoming_id)
+    _sampled.set(_sample_rate > 0 and random.random() < _sample_rate)
+    _fields.set({})
+    return incoming_id
+
+
+def annotate(**fields):
+    """Add fields (result counts, ids) to the current request's structured record"""
+    current = _fields.get()
+    if current is not None:
+        current.update(fields)
+
+
+def end_request():
+    """Clear the request context; returns the fields added with annotate"""
+    fields = _fields.get() or {}
+    request_id.set(None)
+    _sampled.set(False)
+    _fields.set(None)
+    return fields
+
+
+def verbose(logger):
+    """True when diagnostic detail should be logged for the current request"""
+    return _sampled.get() or logger.isEnabledFor(logging.DEBUG)
@@ -0,0 +1,301 @@
+"""Lightweight in-process metrics used to tune the backend.
+
+Components keep their own Counter/Histogram/Gauge objects and list them in a
+``metrics()`` method; a Registry renders those plus the per-request stage
+timings in the Prometheus text format for ``GET /metrics``.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Default bucket bounds, in the unit of whatever is being observed
+DEFAULT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class Histogram:
+    """Thread-safe fixed-bucket histogram"""
+
+    type = 'histogram'
+
+    def __init__(self, name, buckets=DEFAULT_BUCKETS, description='', labels=None):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile by linear interpolation inside the matching bucket"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+        if total == 0:
+            return None
+
+        rank = q * total
+        cumulative = 0
+        lower = 0.0
+        for index, count in enumerate(counts):
+            if cumulative + count >= rank and count > 0:
+                if index == len(self.buckets):
+                    # Overflow bucket has no upper bound, report the last finite one
+                    return float(self.buckets[-1])
+                upper = float(self.buckets[index])
+                return lower + (upper - lower) * ((rank - cumulative) / count)
+            cumulative += count
+            if index < len(self.buckets):
+                lower = float(self.buckets[index])
+        return float(self.buckets[-1])
+
+    def state(self):
+        """(per-bucket counts with +Inf last, sum, count), read consistently"""
+        with self._lock:
+            return list(self._counts), self._sum, self._count
+
+    def snapshot(self):
+        """Return cumulative bucket counts plus summary statistics"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            value_sum = self._sum
+
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        buckets['+Inf'] = total
+
+        return {
+            'count': total,
+            'sum': round(value_sum, 3),
+            'mean': round(value_sum / total, 3) if total else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': buckets
+        }
+
+
+class Counter:
+    """Thread-safe monotonically increasing counter"""
+
+    type = 'counter'
+
+    def __init__(self, name, description='', labels=None):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+
+class Gauge:
+    """Value that goes up and down, either set directly or read from ``fn`` at scrape time"""
+    type = 'gauge'
+
+    def __init__(self, name, description='', labels=None, fn=None):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self._fn = fn
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        return self._fn() if self._fn is not None else self._value
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items()) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in items
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, float) and value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+class Registry:
+    """Metrics rendered on /metrics: labelled ones created here plus those of registered components.
+
+    ``histogram``/``counter``/``gauge`` return the same object for the same
+    name and labels, so hot paths can look metrics up by name.
+    """
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._metrics = {}
+        self._sources = []
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, labels, **kwargs):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = self._metrics[key] = cls(name, labels=labels, **kwargs)
+        return metric
+
+    def histogram(self, name, description='', buckets=DEFAULT_BUCKETS, **labels):
+        return self._get(Histogram, name, labels, description=description, buckets=buckets)
+
+    def counter(self, name, description='', **labels):
+        return self._get(Counter, name, labels, description=description)
+
+    def gauge(self, name, description='', fn=None, **labels):
+        return self._get(Gauge, name, labels, description=description, fn=fn)
+
+    def register(self, source):
+        """Add a component whose ``metrics()`` returns its metric objects; None is ignored"""
+        if source is not None:
+            self._sources.append(source)
+
+    def unregister(self, source):
+        if source in self._sources:
+            self._sources.remove(source)
+
+    def collect(self):
+        metrics = list(self._metrics.values())
+        for source in list(self._sources):
+            metrics.extend(source.metrics())
+        return metrics
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        families = {}
+        for metric in self.collect():
+            families.setdefault(metric.name, []).append(metric)
+
+        lines = []
+        for name, metrics in families.items():
+            full_name = self.prefix + name
+            lines.append(f"# HELP {full_name} {metrics[0].description}")
+            lines.append(f"# TYPE {full_name} {metrics[0].type}")
+            for metric in metrics:
+                if metric.type == 'histogram':
+                    counts, value_sum, total = metric.state()
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets, counts):
+                        cumulative += count
+                        lines.append(f"{full_name}_bucket{_format_labels(metric.labels, {'le': bound})} {cumulative}")
+                    lines.append(f"{full_name}_bucket{_format_labels(metric.labels, {'le': '+Inf'})} {total}")
+                    lines.append(f"{full_name}_sum{_format_labels(metric.labels)} {_format_value(float(value_sum))}")
+                    lines.append(f"{full_name}_count{_format_labels(metric.labels)} {total}")
+                else:
+                    lines.append(f"{full_name}{_format_labels(metric.labels)} {_format_value(metric.value)}")
+        return '\n'.join(lines) + '\n'
+
+
+# Request stages, in milliseconds; the bottom buckets resolve sub-millisecond steps
+STAGE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class RequestTimings:
+    """Stage durations (ms) of the current request, summed when a stage repeats"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, stage, ms):
+        self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self):
+        """Value for a ``Server-Timing`` header, e.g. ``decode;dur=3.1, total;dur=20.4``"""
+        parts = [f"{stage};dur={ms:.2f}" for stage, ms in self.stages.items()]
+        parts.append(f"total;dur={self.elapsed_ms():.2f}")
+        return ', '.join(parts)
+
+
+# Set per request (thread or task), so helpers deep in a call can attribute their time
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+
+class RequestMetrics:
+    """Per-request instrumentation: in-flight gauge, request and per-stage latency histograms"""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.in_flight = registry.gauge('http_requests_in_flight', 'Requests currently being handled')
+
+    def start(self, endpoint):
+        self.in_flight.inc()
+        timings = RequestTimings(endpoint or 'unknown')
+        current_timings.set(timings)
+        return timings
+
+    def finish(self, timings, status):
+        self.in_flight.dec()
+        current_timings.set(None)
+        self.registry.histogram(
+            'http_request_duration_ms', 'End-to-end request latency', buckets=STAGE_BUCKETS,
+            endpoint=timings.endpoint, status=str(status)
+        ).observe(timings.elapsed_ms())
+
+    def observe(self, stage, ms, endpoint=None):
+        """Record ``ms`` spent in ``stage`` for the current request (or ``endpoint`` outside one)"""
+        timings = current_timings.get()
+        if timings is not None:
+            timings.add(stage, ms)
+            endpoint = timings.endpoint
+        self.registry.histogram(
+            'request_stage_duration_ms', 'Time spent in each stage of a request', buckets=STAGE_BUCKETS,
+            stage=stage, endpoint=endpoint or 'none'
+        ).observe(ms)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - started) * 1000)
+
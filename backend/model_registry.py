@@ -0,0 +1,442 @@
+"""Serving model registry: hot swaps without a restart, and shadow evaluation of a candidate.
+
+The registry holds the ``ServedModel`` (engine, its micro-batcher and
+version) that requests use. A replacement is loaded and warmed up on a
+background thread while the current model keeps serving, then published
+with a single reference swap. Requests hold the model they started with
+through ``acquire()`` until they finish, so the old engine and its batcher
+are only stopped once the last of them is done (or after ``drain_timeout``).
+``watch`` polls the model files and reloads when one changes, which is how
+a new model reaches every worker process.
+
+``ShadowEvaluator`` runs a candidate model next to the served one: /predict
+offers it a sampled fraction of the preprocessed inputs together with the
+served prediction, and a background thread scores them in batches and
+counts agreement, confidence and latency differences. Offering never blocks;
+when the shadow queue is full the sample is dropped.
+"""
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+from inference import CLASS_NAMES, INPUT_SHAPE, engine_from_factory, measure_latency, warm_up
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class ServedModel:
+    """One loaded engine with its batcher, counting the requests still using it"""
+
+    def __init__(self, engine, batcher=None):
+        self.engine = engine
+        self.batcher = batcher
+        self.version = engine.version
+        self.loaded_at = datetime.now()
+        self._in_flight = 0
+        self._retired = False
+        self._drained = threading.Event()
+        self._lock = threading.Lock()
+
+    def retain(self):
+        """Count one more request; False once the model has been replaced"""
+        with self._lock:
+            if self._retired:
+                return False
+            self._in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+            if self._retired and self._in_flight == 0:
+                self._drained.set()
+
+    def retire(self):
+        with self._lock:
+            self._retired = True
+            if self._in_flight == 0:
+                self._drained.set()
+
+    def wait_drained(self, timeout=None):
+        return self._drained.wait(timeout)
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def predict_one(self, tensor):
+        """Probabilities for one preprocessed image, sharing a forward pass when batching is on"""
+        if self.batcher is not None:
+            return self.batcher.submit(tensor)
+        return self.engine.predict(tensor)[0]
+
+    def close(self):
+        if self.batcher is not None:
+            self.batcher.stop()
+        close = getattr(self.engine, 'close', None)
+        if close is not None:
+            close()
+
+
+class ModelRegistry:
+    def __init__(self, make_batcher=None, drain_timeout=30.0):
+        # Called with each newly loaded engine; returns its started InferenceBatcher or None
+        self.make_batcher = make_batcher
+        self.drain_timeout = drain_timeout
+        # Called with the new version after every swap, e.g. to invalidate the prediction cache
+        self.listeners = []
+        self.state = 'idle'
+        self.last_error = None
+        self._served = None
+        self._draining = []
+        self._load_lock = threading.Lock()
+        self._watcher = None
+        self.swaps = Counter('model_swaps_total', 'Models swapped in without a restart')
+        self.load_failures = Counter('model_load_failures_total', 'Replacement models that failed to load or warm up')
+        self.draining_gauge = Gauge('model_draining', 'Replaced models still finishing requests',
+                                    fn=lambda: len(self._draining))
+
+    @property
+    def current(self):
+        return self._served
+
+    @contextmanager
+    def acquire(self):
+        """The served model (or None), kept alive until the block exits even if it is replaced meanwhile"""
+        while True:
+            served = self._served
+            if served is None or served.retain():
+                break
+            # Replaced between the read and retain: take the new one
+        try:
+            yield served
+        finally:
+            if served is not None:
+                served.release()
+
+    def publish(self, engine):
+        """Serve an already warmed-up engine from now on; the previous one drains in the background"""
+        served = ServedModel(engine, self.make_batcher(engine) if self.make_batcher else None)
+        previous, self._served = self._served, served
+        if previous is not None:
+            previous.retire()
+            self.swaps.inc()
+            logger.info(f"Now serving model {served.version} (was {previous.version})")
+            self._draining.append(previous)
+            threading.Thread(target=self._drain, args=(previous,), name='model-drain', daemon=True).start()
+            for listener in self.listeners:
+                listener(served.version)
+        return served
+
+    def _drain(self, served):
+        if not served.wait_drained(self.drain_timeout):
+            logger.warning(
+                f"Model {served.version} still had {served.in_flight} requests after {self.drain_timeout:.0f}s, "
+                f"closing it anyway"
+            )
+        try:
+            served.close()
+        except Exception as e:
+            logger.warning(f"Could not close model {served.version}: {str(e)}")
+        self._draining.remove(served)
+
+    def load(self, loader):
+        """Load, warm up and publish the engine ``loader`` returns; False if it failed or nothing changed.
+
+        Runs on the calling thread (the watcher's), while the current model keeps serving.
+        Only one load runs at a time; a concurrent call returns False at once.
+        """
+        if not self._load_lock.acquire(blocking=False):
+            return False
+        try:
+            self.state = 'loading'
+            engine = loader()
+            if engine is None:
+                raise FileNotFoundError('model file not found')
+            current = self._served
+            if current is not None and engine.version == current.version:
+                logger.info(f"Model file changed but the version is still {engine.version}, keeping the loaded model")
+                self.state = 'idle'
+                return False
+            self.state = 'warming'
+            warm_up(engine)
+            latency_ms = measure_latency(engine)
+            logger.info(f"Replacement model {engine.version} warmed up: {latency_ms:.2f} ms per image")
+            self.publish(engine)
+            self.state = 'idle'
+            self.last_error = None
+            return True
+        except Exception as e:
+            self.load_failures.inc()
+            self.state = 'failed'
+            self.last_error = str(e)
+            logger.error(f"Failed to load replacement model, still serving the previous one: {str(e)}")
+            return False
+        finally:
+            self._load_lock.release()
+
+    def watch(self, paths, loader, interval):
+        """Reload with ``loader`` whenever one of ``paths`` changes, checked every ``interval`` seconds.
+
+        A change is acted on once the file has looked the same for two polls in a row,
+        so a model that is still being copied into place is not loaded half-written.
+        """
+        if self._watcher is not None:
+            return
+        self._watcher = threading.Thread(
+            target=self._watch, args=(paths, loader, interval), name='model-watcher', daemon=True
+        )
+        self._watcher.start()
+        logger.info(f"Watching {', '.join(paths)} for model changes every {interval:g}s")
+
+    def _watch(self, paths, loader, interval):
+        loaded = _file_signatures(paths)
+        pending = None
+        while True:
+            time.sleep(interval)
+            signatures = _file_signatures(paths)
+            if signatures == loaded:
+                pending = None
+            elif signatures != pending:
+                pending = signatures
+            else:
+                self.load(loader)
+                loaded, pending = signatures, None
+
+    def metrics(self):
+        served = self._served
+        batcher_metrics = served.batcher.metrics() if served is not None and served.batcher is not None else []
+        return [self.swaps, self.load_failures, self.draining_gauge, *batcher_metrics]
+
+    def stats(self):
+        served = self._served
+        return {
+            'version': served.version if served is not None else None,
+            'loadedAt': served.loaded_at.isoformat() if served is not None else None,
+            'state': self.state,
+            'lastError': self.last_error,
+            'swaps': self.swaps.value,
+            'draining': [{'version': old.version, 'inFlight': old.in_flight} for old in list(self._draining)]
+        }
+
+
+def _file_signatures(paths):
+    signatures = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signatures.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signatures.append(None)
+    return signatures
+
+
+def candidate_loader(model_path=None, factory=None, engine_name='function', num_threads=None):
+    """Zero-argument loader for a shadow candidate: a .h5/.keras or .tflite file, or a "module:function" factory"""
+    if factory:
+        return lambda: engine_from_factory(factory)
+
+    def load():
+        from engines import load_engine
+
+        if model_path.endswith('.tflite'):
+            return load_engine('tflite', model_path, tflite_path=model_path, num_threads=num_threads)
+        return load_engine('function' if engine_name == 'tflite' else engine_name, model_path)
+    return load
+
+
+class _ShadowSample:
+    __slots__ = ('tensor', 'primary', 'primary_ms', 'enqueued_at')
+
+    def __init__(self, tensor, primary, primary_ms):
+        self.tensor = tensor
+        self.primary = primary
+        self.primary_ms = primary_ms
+        self.enqueued_at = time.perf_counter()
+
+
+class ShadowEvaluator:
+    """Score sampled live inputs with a candidate model off the request path and compare with the served one"""
+
+    def __init__(self, loader, sample_rate=0.1, max_batch_size=16, max_wait_ms=200.0, max_queue_depth=64):
+        self.loader = loader
+        self.sample_rate = sample_rate
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.engine = None
+        self.state = 'loading'
+        self.error = None
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue_depth)))
+        self._confusion = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.sampled = Counter('shadow_sampled_total', 'Inputs offered to the shadow model')
+        self.dropped = Counter('shadow_dropped_total', 'Sampled inputs dropped because the shadow queue was full')
+        self.scored = Counter('shadow_scored_total', 'Inputs scored by the shadow model')
+        self.agreements = Counter('shadow_agreements_total', 'Shadow predictions with the same class as the served model')
+        self.failures = Counter('shadow_errors_total', 'Shadow batches that failed')
+        self.candidate_latency = Histogram(
+            'shadow_candidate_latency_ms',
+            buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+            description='Shadow model forward-pass time per image'
+        )
+        self.primary_latency = Histogram(
+            'shadow_primary_latency_ms',
+            buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+            description='Served model inference time of the sampled requests, including batching wait'
+        )
+        self.confidence_delta = Histogram(
+            'shadow_confidence_delta',
+            buckets=(0.01, 0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 1),
+            description="Absolute difference in the probability of the served model's class"
+        )
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='shadow-evaluator', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def version(self):
+        return self.engine.version if self.engine is not None else None
+
+    def offer(self, tensor, primary_probabilities, primary_ms):
+        """Maybe queue one input for shadow scoring; never blocks. Returns True if it was queued.
+
+        The tensor is copied when sampled, so the caller may reuse its buffer right away.
+        """
+        if self.engine is None or random.random() >= self.sample_rate:
+            return False
+        self.sampled.inc()
+        sample = _ShadowSample(
+            np.array(tensor, dtype=np.float32).reshape(INPUT_SHAPE),
+            np.array(primary_probabilities, dtype=np.float32),
+            primary_ms
+        )
+        try:
+            self._queue.put_nowait(sample)
+        except queue.Full:
+            self.dropped.inc()
+            return False
+        return True
+
+    def _load(self):
+        try:
+            engine = self.loader()
+            if engine is None:
+                raise FileNotFoundError('shadow model file not found')
+            warm_up(engine)
+            latency_ms = measure_latency(engine)
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+            logger.warning(f"Shadow model failed to load, shadow evaluation disabled: {str(e)}")
+            return False
+        self.engine = engine
+        self.state = 'ready'
+        logger.info(
+            f"Shadow model {engine.version} ready ({latency_ms:.2f} ms per image), "
+            f"sampling {self.sample_rate:.0%} of predictions"
+        )
+        return True
+
+    def _collect_batch(self):
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        if not self._load():
+            return
+        while not self._stop_event.is_set():
+            batch = self._collect_batch()
+            if batch:
+                self._score(batch)
+
+    def _score(self, batch):
+        started = time.perf_counter()
+        try:
+            outputs = np.asarray(self.engine.predict(np.stack([sample.tensor for sample in batch])))
+        except Exception as e:
+            self.failures.inc()
+            logger.warning(f"Shadow inference failed for {len(batch)} inputs: {str(e)}")
+            return
+        per_image_ms = (time.perf_counter() - started) * 1000 / len(batch)
+
+        for sample, candidate in zip(batch, outputs):
+            primary_index = int(np.argmax(sample.primary))
+            candidate_index = int(np.argmax(candidate))
+            self.scored.inc()
+            if candidate_index == primary_index:
+                self.agreements.inc()
+            self.candidate_latency.observe(per_image_ms)
+            self.primary_latency.observe(sample.primary_ms)
+            self.confidence_delta.observe(abs(float(candidate[primary_index]) - float(sample.primary[primary_index])))
+            pair = (CLASS_NAMES[primary_index], CLASS_NAMES[candidate_index])
+            with self._lock:
+                self._confusion[pair] = self._confusion.get(pair, 0) + 1
+
+    def metrics(self):
+        return [
+            self.sampled, self.dropped, self.scored, self.agreements, self.failures,
+            self.candidate_latency, self.primary_latency, self.confidence_delta
+        ]
+
+    def stats(self):
+        scored = self.scored.value
+        candidate = self.candidate_latency.snapshot()
+        primary = self.primary_latency.snapshot()
+        with self._lock:
+            confusion = dict(self._confusion)
+        return {
+            'state': self.state,
+            'error': self.error,
+            'version': self.version,
+            'sample_rate': self.sample_rate,
+            'sampled': self.sampled.value,
+            'dropped': self.dropped.value,
+            'scored': scored,
+            'agreement': round(self.agreements.value / scored, 4) if scored else None,
+            # Rows are the served model's class, columns the shadow model's
+            'confusion': {
+                served: {shadow: confusion.get((served, shadow), 0) for shadow in CLASS_NAMES}
+                for served in CLASS_NAMES
+            },
+            'latency_delta_ms': (
+                round(candidate['mean'] - primary['mean'], 3) if scored and candidate['mean'] is not None else None
+            ),
+            'candidate_latency_ms': candidate,
+            'primary_latency_ms': primary,
+            'confidence_delta': self.confidence_delta.snapshot()
+        }
@@ -0,0 +1,124 @@
+"""Password hashing on a dedicated, bounded executor.
+
+bcrypt is deliberately slow. Running it inline lets a burst of logins occupy
+every request worker, so hashing and verification run on their own small
+thread pool (bcrypt releases the GIL while hashing). Admission is bounded:
+if a job cannot start within ``queue_timeout`` seconds, callers get
+HasherBusyError and should answer 503 instead of piling up.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class HasherBusyError(Exception):
+    """Raised when password hashing capacity is exhausted"""
+
+
+def hash_cost(hashed):
+    """Cost factor encoded in a bcrypt hash such as ``$2b$12$...``"""
+    try:
+        return int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    def __init__(self, rounds=12, max_workers=2, max_pending=32, queue_timeout=5.0):
+        self.rounds = rounds
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bcrypt')
+        # Running plus queued jobs; beyond this, new work waits for a slot within queue_timeout
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+
+        self.rejected = Counter('password_hash_rejected_total', 'Hash jobs rejected because the pool was saturated')
+        self.queue_wait_histogram = Histogram(
+            'password_hash_queue_wait_ms',
+            buckets=(1, 5, 10, 50, 100, 250, 500, 1000, 2500, 5000),
+            description='Time a hash job waited before a worker picked it up'
+        )
+        self.pending = Gauge('password_hash_pending', 'Hash jobs running or waiting for a worker')
+
+    def _release(self, _future=None):
+        self.pending.dec()
+        self._slots.release()
+
+    def _run(self, fn, *args):
+        # One deadline for getting a slot and then a worker, so a caller waits at most queue_timeout
+        deadline = time.monotonic() + self.queue_timeout
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self.rejected.inc()
+            raise HasherBusyError('Password hashing is saturated')
+        self.pending.inc()
+
+        started = threading.Event()
+        submitted_at = _now_ms()
+
+        def job():
+            started.set()
+            self.queue_wait_histogram.observe(_now_ms() - submitted_at)
+            return fn(*args)
+
+        try:
+            future = self._executor.submit(job)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+
+        # Give up on jobs that never got a worker, but never abandon one that is running
+        if not started.wait(max(0.0, deadline - time.monotonic())) and future.cancel():
+            self.rejected.inc()
+            raise HasherBusyError('Timed out waiting for a password hashing worker')
+        return future.result()
+
+    def hash(self, password):
+        """Hash a password with the configured cost; returns the hash as str"""
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        return self._run(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+    def verify(self, password, hashed):
+        return self._run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed):
+        return hash_cost(hashed) != self.rounds
+
+    def rehash_in_background(self, password, on_hashed):
+        """Hash ``password`` at the current cost off the request path and pass the result to ``on_hashed``.
+
+        Skipped silently when the pool is saturated; it will be retried on the next login.
+        """
+        if not self._slots.acquire(blocking=False):
+            return
+        self.pending.inc()
+
+        def job():
+            try:
+                salt = bcrypt.gensalt(rounds=self.rounds)
+                on_hashed(bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8'))
+            except Exception as e:
+                logger.error(f"Background password rehash failed: {str(e)}")
+
+        future = self._executor.submit(job)
+        future.add_done_callback(self._release)
+
+    def metrics(self):
+        return [self.rejected, self.queue_wait_histogram, self.pending]
+
+    def stats(self):
+        return {
+            'rounds': self.rounds,
+            'rejected': self.rejected.value,
+            'queue_wait_ms': self.queue_wait_histogram.snapshot()
+        }
+
+
+def _now_ms():
+    return time.perf_counter() * 1000
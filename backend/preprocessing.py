@@ -0,0 +1,84 @@
+"""Fast image decode and preprocessing for model input.
+
+Training preprocessing is: full-resolution RGB -> ``cv2.resize`` to 224x224
+(bilinear) -> float32 / 255. This module produces the same tensor with less
+work:
+
+* The upload is decoded exactly once; ``Image.load()`` raises on corrupt or
+  truncated data, so it doubles as validation (no separate ``verify()`` pass).
+* Large JPEGs are decoded with DCT-domain downscaling (``Image.draft``), so the
+  full-resolution pixels never materialise. The draft is never reduced below
+  ``DRAFT_MIN_SIZE`` (twice the model input) on either side, and the final
+  224x224 resize still goes through ``cv2.resize`` as in training.
+* The result is written straight into a preallocated float32 buffer.
+
+Tolerance: for inputs that are not draft-decoded (PNG/BMP, JPEGs already
+smaller than ``DRAFT_MIN_SIZE``) the output is bit-identical to the training
+path. For draft-decoded JPEGs, DCT scaling averages pixels where the legacy
+path point-samples them, so individual values can move by a few grey levels;
+the mean absolute difference stays below ``DRAFT_TOLERANCE`` on the [0, 1]
+scale. ``benchmarks/preprocess_bench.py`` measures both the speedup and the
+difference on synthetic scans.
+"""
+import io
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from inference import INPUT_SHAPE
+
+TARGET_SIZE = (INPUT_SHAPE[1], INPUT_SHAPE[0])  # (width, height) as PIL and cv2 expect
+DRAFT_MIN_SIZE = (TARGET_SIZE[0] * 2, TARGET_SIZE[1] * 2)
+DRAFT_TOLERANCE = 0.02
+
+_buffers = threading.local()
+
+
+def input_buffer():
+    """Reusable (1, 224, 224, 3) float32 buffer owned by the calling thread.
+
+    Its contents are overwritten by the next ``preprocess_image`` call on the
+    same thread, so copy it if it has to outlive the current request.
+    """
+    buffer = getattr(_buffers, 'input', None)
+    if buffer is None:
+        buffer = np.empty((1, *INPUT_SHAPE), dtype=np.float32)
+        _buffers.input = buffer
+    return buffer
+
+
+def decode_image(file_bytes, reduced=True):
+    """Decode upload bytes once into an RGB PIL image, raising on invalid data"""
+    if len(file_bytes) == 0:
+        raise ValueError('Empty file received')
+
+    image = Image.open(io.BytesIO(file_bytes))
+    if reduced and image.format == 'JPEG':
+        # Let libjpeg scale by 1/2, 1/4 or 1/8 while decoding, never below DRAFT_MIN_SIZE
+        image.draft('RGB', DRAFT_MIN_SIZE)
+    image.load()
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+
+def preprocess_image(image, out=None):
+    """Resize and normalise an RGB image into ``out`` (a (224, 224, 3) or (1, 224, 224, 3) float32 array).
+
+    Uses the calling thread's reusable buffer when ``out`` is omitted and
+    returns the array that was written.
+    """
+    if out is None:
+        out = input_buffer()
+    target = out[0] if out.ndim == 4 else out
+
+    resized = cv2.resize(np.asarray(image), TARGET_SIZE)
+    np.divide(resized, np.float32(255.0), out=target, casting='unsafe')
+    return out
+
+
+def decode_and_preprocess(file_bytes, out=None):
+    return preprocess_image(decode_image(file_bytes), out=out)
@@ -0,0 +1,262 @@
+"""MongoDB query builders shared by the read endpoints"""
+import base64
+import json
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+
+class InvalidQueryError(ValueError):
+    """Raised for malformed pagination cursors or filter parameters"""
+
+
+def encode_cursor(record):
+    """Opaque keyset cursor pointing just after ``record`` (timestamp desc, _id desc)"""
+    timestamp = record.get('timestamp')
+    record_id = record['_id']
+    payload = {
+        't': timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp,
+        'i': str(record_id),
+        'o': isinstance(record_id, ObjectId)
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        timestamp = datetime.fromisoformat(payload['t']) if payload['t'] else None
+        record_id = ObjectId(payload['i']) if payload.get('o') else payload['i']
+        return timestamp, record_id
+    except Exception:
+        raise InvalidQueryError('Invalid cursor')
+
+
+def parse_date(value, end_of_day=False):
+    """Parse an ISO date or datetime query parameter"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidQueryError(f"Invalid date '{value}', expected ISO format (YYYY-MM-DD)")
+    if end_of_day and len(value) == 10:
+        # A bare date as upper bound includes that whole day
+        parsed += timedelta(days=1)
+    return parsed
+
+
+def parse_limit(value, default=None, maximum=1000):
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise InvalidQueryError('limit must be an integer')
+    if limit < 1:
+        raise InvalidQueryError('limit must be at least 1')
+    return min(limit, maximum)
+
+
+def scan_filter(doctor_id, patient_id=None, date_from=None, date_to=None, diagnosis=None):
+    """Build the $match document for a doctor's scans"""
+    match = {'doctorId': doctor_id}
+    if patient_id is not None:
+        match['patientId'] = patient_id
+    if date_from is not None or date_to is not None:
+        match['timestamp'] = {}
+        if date_from is not None:
+            match['timestamp']['$gte'] = date_from
+        if date_to is not None:
+            match['timestamp']['$lt'] = date_to
+    if diagnosis:
+        match['diagnosis'] = diagnosis.capitalize()
+    return match
+
+
+def scan_filter_from_args(doctor_id, args, patient_id=None):
+    """Build a scan filter from request query args (from, to, diagnosis, patientId)"""
+    date_from = parse_date(args['from']) if args.get('from') else None
+    date_to = parse_date(args['to'], end_of_day=True) if args.get('to') else None
+    return scan_filter(
+        doctor_id,
+        patient_id=patient_id if patient_id is not None else args.get('patientId'),
+        date_from=date_from,
+        date_to=date_to,
+        diagnosis=args.get('diagnosis')
+    )
+
+
+def history_pipeline(match, limit=None, cursor=None, with_patient_names=True):
+    """Aggregation returning scans newest first, optionally joined to the patient's name.
+
+    Pagination is keyset based on (timestamp, _id), so each page costs the
+    same regardless of how deep it is. One extra document is fetched to know
+    whether another page exists.
+    """
+    match = dict(match)
+    if cursor:
+        timestamp, record_id = decode_cursor(cursor)
+        keyset = {'$or': [
+            {'timestamp': {'$lt': timestamp}},
+            {'timestamp': timestamp, '_id': {'$lt': record_id}}
+        ]}
+        match = {'$and': [match, keyset]}
+
+    pipeline = [
+        {'$match': match},
+        {'$sort': {'timestamp': -1, '_id': -1}}
+    ]
+    if limit is not None:
+        pipeline.append({'$limit': limit + 1})
+    if with_patient_names:
+        pipeline += [
+            {'$lookup': {
+                'from': 'patients',
+                'localField': 'patientId',
+                'foreignField': '_id',
+                'as': 'patient'
+            }},
+            {'$addFields': {
+                'patientName': {'$ifNull': [{'$arrayElemAt': ['$patient.name', 0]}, 'Unknown']}
+            }},
+            {'$project': {'patient': 0}}
+        ]
+    return pipeline
+
+
+def paginate(records, limit):
+    """Split the limit+1 fetch into the page and the cursor for the next one"""
+    if limit is None or len(records) <= limit:
+        return records, None
+    page = records[:limit]
+    return page, encode_cursor(page[-1])
+
+
+def parse_record_id(record_id):
+    """Scan ids are ObjectIds, except for records written with explicit string ids"""
+    return ObjectId(record_id) if ObjectId.is_valid(record_id) else record_id
+
+
+def format_scan(record):
+    """Make a scan document JSON-safe for the history endpoints"""
+    record_id = record.pop('_id', None)
+    if record_id is not None:
+        record['id'] = str(record_id)
+        record['imageUrl'] = f"/scans/{record['id']}/image"
+    if isinstance(record.get('timestamp'), datetime):
+        record['timestamp'] = record['timestamp'].isoformat()
+    return record
+
+
+PATIENT_SORTS = {
+    'name': [('name', 1), ('_id', 1)],
+    'created': [('created_at', -1), ('_id', 1)],
+    # Computed from scans, so it is applied after the summaries are merged in
+    'lastScan': None
+}
+
+
+def scan_summary_pipeline(doctor_id, patient_ids=None):
+    """Group a doctor's scans by patient into count, last scan time and last diagnosis"""
+    match = {'doctorId': doctor_id}
+    if patient_ids is not None:
+        match['patientId'] = {'$in': list(patient_ids)}
+    return [
+        {'$match': match},
+        {'$sort': {'timestamp': -1}},
+        {'$group': {
+            '_id': '$patientId',
+            'scanCount': {'$sum': 1},
+            'lastScan': {'$first': '$timestamp'},
+            'lastDiagnosis': {'$first': '$diagnosis'}
+        }}
+    ]
+
+
+def patients_cursor(patients_collection, doctor_id, sort=None, skip=0, limit=None):
+    """find() cursor over a doctor's patients, paged in the database unless sorting by last scan.
+
+    Works with both pymongo and motor collections.
+    """
+    if sort is not None and sort not in PATIENT_SORTS:
+        raise InvalidQueryError(f"sort must be one of {', '.join(PATIENT_SORTS)}")
+
+    cursor = patients_collection.find({'doctorId': doctor_id}, {'password': 0})
+    if sort != 'lastScan':
+        if sort is not None:
+            cursor = cursor.sort(PATIENT_SORTS[sort])
+        elif skip or limit is not None:
+            # Natural order can change between requests, so pages need a stable one
+            cursor = cursor.sort([('_id', 1)])
+        if skip:
+            cursor = cursor.skip(skip)
+        if limit is not None:
+            cursor = cursor.limit(limit + 1)
+    return cursor
+
+
+def summary_patient_ids(patients, sort=None):
+    """Patient ids to summarise: the fetched page, or None (all) when sorting by last scan"""
+    return None if sort == 'lastScan' else [patient['_id'] for patient in patients]
+
+
+def merge_scan_summaries(patients, summaries, sort=None, skip=0, limit=None):
+    """Attach scan summaries to patients and apply in-memory paging; returns (patients, has_more)"""
+    summaries = {summary['_id']: summary for summary in summaries}
+    for patient in patients:
+        summary = summaries.get(patient['_id'], {})
+        patient['scanCount'] = summary.get('scanCount', 0)
+        patient['lastScan'] = summary.get('lastScan')
+        patient['lastDiagnosis'] = summary.get('lastDiagnosis')
+
+    if sort == 'lastScan':
+        # Most recently scanned first; patients without scans go last
+        patients.sort(key=lambda patient: patient['_id'])
+        patients.sort(key=lambda patient: (patient['lastScan'] is not None, patient['lastScan'] or datetime.min), reverse=True)
+        patients = patients[skip:]
+        if limit is not None:
+            patients = patients[:limit + 1]
+
+    has_more = limit is not None and len(patients) > limit
+    return (patients[:limit] if has_more else patients), has_more
+
+
+def list_patients_with_summaries(patients_collection, scans_collection, doctor_id, sort=None, skip=0, limit=None):
+    """List a doctor's patients with scan summaries in two queries, whatever the panel size.
+
+    Returns (patients, has_more). Sorting by name or creation date is pushed to
+    the patients query so only one page of summaries is computed; sorting by
+    last scan needs every summary, so it groups all of the doctor's scans once.
+    """
+    patients = list(patients_cursor(patients_collection, doctor_id, sort=sort, skip=skip, limit=limit))
+    summaries = scans_collection.aggregate(scan_summary_pipeline(doctor_id, summary_patient_ids(patients, sort)))
+    return merge_scan_summaries(patients, summaries, sort=sort, skip=skip, limit=limit)
+
+
+def format_patient(patient):
+    """Patient list entry as returned by GET /patients"""
+    last_scan = patient.get('lastScan')
+    return {
+        'id': patient['_id'],
+        'name': patient.get('name', 'Unknown'),
+        'age': patient.get('age'),
+        'gender': patient.get('gender'),
+        'bloodGroup': patient.get('bloodGroup'),
+        'medicalHistory': patient.get('medicalHistory', ''),
+        'doctorNotes': patient.get('doctorNotes', ''),
+        'scanCount': patient.get('scanCount', 0),
+        'lastScan': last_scan.isoformat() if isinstance(last_scan, datetime) else last_scan,
+        'lastDiagnosis': patient.get('lastDiagnosis')
+    }
+
+
+def parse_skip(value):
+    if value is None:
+        return 0
+    try:
+        skip = int(value)
+    except ValueError:
+        raise InvalidQueryError('skip must be an integer')
+    if skip < 0:
+        raise InvalidQueryError('skip must not be negative')
+    return skip
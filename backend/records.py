@@ -0,0 +1,54 @@
+"""Upload and scan record helpers shared by the Flask and async entry points"""
+import io
+import os
+import zipfile
+from datetime import datetime
+
+from config import ALLOWED_IMAGE_EXTENSIONS
+
+
+def check_upload_name(upload_name):
+    """Raises ValueError unless the uploaded file name has an allowed image extension"""
+    file_ext = os.path.splitext(upload_name)[1].lower()
+    if file_ext not in ALLOWED_IMAGE_EXTENSIONS:
+        raise ValueError('Invalid file type. Only JPG, PNG, BMP allowed.')
+
+
+def build_scan_record(patient_id, doctor_id, stored_image, prediction, timestamp=None, model_version=None):
+    """``model_version`` is None for results the server did not compute itself (client-supplied predictions)"""
+    return {
+        'patientId': patient_id,
+        'doctorId': doctor_id,  # Associate with the logged-in doctor
+        'timestamp': timestamp or datetime.now(),
+        'imagePath': stored_image.path,
+        'imageHash': stored_image.digest,
+        'diagnosis': prediction['predicted_class'],
+        'confidence': prediction['confidence'],
+        'probabilities': prediction['probabilities'],
+        'modelVersion': model_version,
+        # Optional contextual fields captured at scan-time
+        'medicalHistory': prediction.get('medicalHistory'),
+        'doctorNotes': prediction.get('doctorNotes')
+    }
+
+
+def archive_images(archive_bytes, max_total_bytes):
+    """(name, bytes) for every image in a zip archive, skipping directories and dotfiles.
+
+    Raises zipfile.BadZipFile for corrupt archives and ValueError once the
+    extracted size would exceed ``max_total_bytes``.
+    """
+    images = []
+    with zipfile.ZipFile(io.BytesIO(archive_bytes)) as zf:
+        total_size = 0
+        for info in zf.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith('__MACOSX/') or os.path.basename(name).startswith('.'):
+                continue
+            if os.path.splitext(name)[1].lower() not in ALLOWED_IMAGE_EXTENSIONS:
+                continue
+            total_size += info.file_size
+            if total_size > max_total_bytes:
+                raise ValueError('Archive is too large once extracted')
+            images.append((name, zf.read(info)))
+    return images
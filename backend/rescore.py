@@ -0,0 +1,246 @@
+"""Re-score stored scans with the current model after the model has been replaced.
+
+Every scan record carries the ``modelVersion`` that produced its diagnosis
+(None for records saved with a client-supplied prediction or before versions
+were recorded). This job walks the scans whose version differs from the
+loaded model in ``_id`` order, loads their images from ``imagePath`` on a
+bounded prefetch pool, runs them through the model in batches and writes the
+new results back with one ``bulk_write`` per batch, adjusting the /stats
+rollups for every diagnosis that changed::
+
+    python rescore.py run [--batch-size 32] [--duty-cycle 0.5] [--max-rate 50]
+    python rescore.py status
+
+Progress is checkpointed per target model version in the ``rescore_jobs``
+collection after every batch, so a stopped job (Ctrl-C or SIGTERM finish the
+current batch first) continues after the last written scan. To leave room
+for live ``/predict`` traffic the job keeps itself busy for at most
+``--duty-cycle`` of the time, never exceeds ``--max-rate`` images per second
+and runs at a lower CPU priority (``--nice``).
+"""
+import argparse
+import logging
+import os
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from pymongo import UpdateOne
+
+from http_cache import DataVersions
+from inference import INPUT_SHAPE, format_prediction
+from preprocessing import decode_and_preprocess
+from rollups import rollup_corrections
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = 'rescore_jobs'
+SCAN_PROJECTION = {'imagePath': 1, 'doctorId': 1, 'timestamp': 1, 'diagnosis': 1, 'confidence': 1, 'modelVersion': 1}
+
+
+def load_scan_image(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    tensor = np.empty(INPUT_SHAPE, dtype=np.float32)
+    decode_and_preprocess(data, tensor)
+    return tensor
+
+
+class Throttle:
+    """Sleeps between batches so the job is busy at most ``duty_cycle`` of the time and below ``max_rate``"""
+
+    def __init__(self, duty_cycle=0.5, max_rate=None):
+        if not 0 < duty_cycle <= 1:
+            raise ValueError(f"duty_cycle must be in (0, 1], got {duty_cycle}")
+        if max_rate is not None and max_rate <= 0:
+            raise ValueError(f"max_rate must be positive, got {max_rate}")
+        self.duty_cycle = duty_cycle
+        self.max_rate = max_rate
+
+    def pause(self, busy_seconds, images, stop):
+        delay = busy_seconds * (1 - self.duty_cycle) / self.duty_cycle
+        if self.max_rate:
+            delay = max(delay, images / self.max_rate - busy_seconds)
+        if delay > 0:
+            # Wakes early when the job is asked to stop
+            stop.wait(delay)
+
+
+def duty_cycle_arg(value):
+    value = float(value)
+    if not 0 < value <= 1:
+        raise argparse.ArgumentTypeError(f"must be greater than 0 and at most 1, got {value:g}")
+    return value
+
+
+def positive_float_arg(value):
+    value = float(value)
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"must be positive, got {value:g}")
+    return value
+
+
+class RescoreJob:
+    def __init__(self, db, engine, batch_size=32, prefetch=8, throttle=None):
+        self.db = db
+        self.engine = engine
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self.throttle = throttle or Throttle()
+        self.stop = threading.Event()
+        self.data_versions = DataVersions(db['data_versions'])
+        self.jobs = db[JOBS_COLLECTION]
+
+    def run(self):
+        """Re-score until every scan carries the engine's version (or the job is stopped); returns the job document"""
+        version = self.engine.version
+        job = self.jobs.find_one_and_update(
+            {'_id': version},
+            {
+                '$setOnInsert': {'lastId': None, 'rescored': 0, 'changed': 0, 'failed': 0, 'startedAt': datetime.now()},
+                '$set': {'status': 'running', 'updatedAt': datetime.now()}
+            },
+            upsert=True,
+            return_document=True
+        )
+        query = {'modelVersion': {'$ne': version}}
+        if job['lastId'] is not None:
+            query['_id'] = {'$gt': job['lastId']}
+            logger.info(f"Resuming re-scoring for {version} after {job['lastId']} ({job['rescored']} done)")
+        else:
+            logger.info(f"Re-scoring scans with model {version}")
+
+        cursor = self.db.scans.find(query, SCAN_PROJECTION, batch_size=self.batch_size * 4).sort('_id', 1)
+        started = time.perf_counter()
+        pool = ThreadPoolExecutor(max_workers=self.prefetch, thread_name_prefix='rescore-load')
+        try:
+            for batch in self._batches(cursor, pool):
+                busy_started = time.perf_counter()
+                self._score(batch, version)
+                self.throttle.pause(time.perf_counter() - busy_started, len(batch), self.stop)
+                if self.stop.is_set():
+                    break
+        finally:
+            # Images prefetched past the last written batch are simply loaded again on resume
+            pool.shutdown(wait=True, cancel_futures=True)
+            cursor.close()
+
+        status = 'stopped' if self.stop.is_set() else 'finished'
+        job = self.jobs.find_one_and_update(
+            {'_id': version}, {'$set': {'status': status, 'updatedAt': datetime.now()}}, return_document=True
+        )
+        elapsed = time.perf_counter() - started
+        logger.info(
+            f"Re-scoring {status}: {job['rescored']} scans re-scored ({job['changed']} changed diagnosis, "
+            f"{job['failed']} without a readable image) in {elapsed:.1f}s"
+        )
+        return job
+
+    def _batches(self, cursor, pool):
+        """Lists of (scan, future) in cursor order, with up to ``prefetch`` images loading ahead"""
+        window = deque()
+        batch = []
+        for scan in cursor:
+            window.append((scan, pool.submit(load_scan_image, scan.get('imagePath') or '')))
+            if len(window) >= self.prefetch:
+                batch.append(window.popleft())
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+            if self.stop.is_set():
+                return
+        batch.extend(window)
+        if batch:
+            yield batch
+
+    def _score(self, batch, version):
+        loaded, failed = [], 0
+        for scan, future in batch:
+            try:
+                loaded.append((scan, future.result()))
+            except Exception as e:
+                failed += 1
+                logger.warning(f"Skipping scan {scan['_id']}: cannot load image {scan.get('imagePath')!r}: {str(e)}")
+
+        operations = []
+        rollups = {}
+        doctors = set()
+        changed = 0
+        if loaded:
+            outputs = self.engine.predict(np.stack([tensor for _, tensor in loaded]))
+            now = datetime.now()
+            for (scan, _), probabilities in zip(loaded, outputs):
+                prediction = format_prediction(probabilities)
+                operations.append(UpdateOne({'_id': scan['_id']}, {'$set': {
+                    'diagnosis': prediction['predicted_class'],
+                    'confidence': prediction['confidence'],
+                    'probabilities': prediction['probabilities'],
+                    'modelVersion': version,
+                    'rescoredAt': now
+                }}))
+                if prediction['predicted_class'] != scan.get('diagnosis'):
+                    changed += 1
+                doctors.add(scan['doctorId'])
+                for collection, query, update in rollup_corrections(
+                        scan['doctorId'], scan['timestamp'],
+                        (scan.get('diagnosis'), scan.get('confidence')),
+                        (prediction['predicted_class'], prediction['confidence'])):
+                    rollups.setdefault(collection, []).append(UpdateOne(query, update))
+
+        if operations:
+            self.db.scans.bulk_write(operations, ordered=False)
+        for collection, updates in rollups.items():
+            self.db[collection].bulk_write(updates, ordered=False)
+        for doctor_id in doctors:
+            self.data_versions.bump(doctor_id)
+
+        # Unreadable scans are passed over too; `status` reports how many
+        self.jobs.update_one({'_id': version}, {
+            '$set': {'lastId': batch[-1][0]['_id'], 'updatedAt': datetime.now()},
+            '$inc': {'rescored': len(operations), 'changed': changed, 'failed': failed}
+        })
+
+
+if __name__ == '__main__':
+    from config import INFERENCE_ENGINE_FACTORY
+    from database import get_database
+    from inference import load_configured_engine
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Re-score stored scans with the current model')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    run_parser = subcommands.add_parser('run', help='Re-score scans produced by other model versions')
+    run_parser.add_argument('--batch-size', type=int, default=32, help='Images per model call and bulk write')
+    run_parser.add_argument('--prefetch', type=int, default=8, help='Images loaded ahead of the model')
+    run_parser.add_argument('--duty-cycle', type=duty_cycle_arg, default=0.5,
+                            help='Fraction of the time the job may be busy (1 = no pauses)')
+    run_parser.add_argument('--max-rate', type=positive_float_arg, default=None, help='Images per second at most')
+    run_parser.add_argument('--nice', type=int, default=10, help='CPU priority increment for this process')
+    run_parser.add_argument('--engine-factory', default=INFERENCE_ENGINE_FACTORY,
+                            help='"module:function" returning the engine instead of the configured model')
+    subcommands.add_parser('status', help='Show the progress of every re-scoring job')
+    args = parser.parse_args()
+
+    database = get_database()
+    if args.command == 'status':
+        for job in database[JOBS_COLLECTION].find().sort('startedAt', -1):
+            remaining = database.scans.count_documents({'modelVersion': {'$ne': job['_id']}})
+            print(f"{job['_id']}: {job['status']}, {job['rescored']} re-scored, {job['changed']} changed, "
+                  f"{job['failed']} failed, {remaining} scans on other versions, updated {job['updatedAt']:%Y-%m-%d %H:%M}")
+    elif args.command == 'run':
+        if args.nice and hasattr(os, 'nice'):
+            os.nice(args.nice)
+        rescore_job = RescoreJob(
+            database,
+            load_configured_engine(args.engine_factory),
+            batch_size=args.batch_size,
+            prefetch=args.prefetch,
+            throttle=Throttle(duty_cycle=args.duty_cycle, max_rate=args.max_rate)
+        )
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: rescore_job.stop.set())
+        rescore_job.run()
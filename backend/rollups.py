@@ -0,0 +1,227 @@
+"""Incremental per-doctor daily statistics behind /stats.
+
+Every saved scan bumps two small documents:
+
+* ``stats_daily`` - one per doctor per day: scan, malignant and
+  high-confidence counts plus the set of patients scanned that day
+* ``stats_totals`` - one per doctor with all-time counts
+
+``/stats`` then reads the totals document and at most 60 daily documents
+instead of counting over the scans collection. Rebuild everything from
+existing scans with::
+
+    python rollups.py backfill [--doctor DOCTOR_ID]
+
+Run the backfill while no scans are being saved, or re-run it afterwards.
+"""
+import argparse
+import logging
+from datetime import datetime, timedelta
+
+from pymongo import ReplaceOne
+
+logger = logging.getLogger(__name__)
+
+DAILY_COLLECTION = 'stats_daily'
+TOTALS_COLLECTION = 'stats_totals'
+HIGH_CONFIDENCE = 0.9
+TREND_WINDOW_DAYS = 30
+
+
+def day_key(timestamp):
+    return timestamp.strftime('%Y-%m-%d')
+
+
+def rollup_updates(doctor_id, patient_id, timestamp, diagnosis, confidence):
+    """(collection, filter, update) upserts that fold one saved scan into the rollups"""
+    increments = {
+        'scans': 1,
+        'malignant': 1 if diagnosis == 'Malignant' else 0,
+        'highConfidence': 1 if (confidence or 0) > HIGH_CONFIDENCE else 0
+    }
+    day = day_key(timestamp)
+    return [
+        (DAILY_COLLECTION, {'_id': f"{doctor_id}|{day}"}, {
+            '$inc': increments,
+            '$addToSet': {'patients': patient_id},
+            '$setOnInsert': {'doctorId': doctor_id, 'day': day}
+        }),
+        (TOTALS_COLLECTION, {'_id': doctor_id}, {'$inc': increments})
+    ]
+
+
+def rollup_corrections(doctor_id, timestamp, old, new):
+    """(collection, filter, update) pairs that move a re-scored scan's counts from ``old`` to ``new``.
+
+    ``old`` and ``new`` are (diagnosis, confidence); nothing is returned when the counted flags did not change.
+    """
+    deltas = {
+        'malignant': (new[0] == 'Malignant') - (old[0] == 'Malignant'),
+        'highConfidence': ((new[1] or 0) > HIGH_CONFIDENCE) - ((old[1] or 0) > HIGH_CONFIDENCE)
+    }
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return []
+    return [
+        (DAILY_COLLECTION, {'_id': f"{doctor_id}|{day_key(timestamp)}"}, {'$inc': deltas}),
+        (TOTALS_COLLECTION, {'_id': doctor_id}, {'$inc': deltas})
+    ]
+
+
+def record_scan(db, doctor_id, patient_id, timestamp, diagnosis, confidence):
+    """Fold one newly saved scan into the doctor's rollups"""
+    for collection, query, update in rollup_updates(doctor_id, patient_id, timestamp, diagnosis, confidence):
+        db[collection].update_one(query, update, upsert=True)
+
+
+def calculate_trend(prev_value, current_value):
+    """Calculate percentage change between two values"""
+    if prev_value == 0:
+        return {
+            "value": 0,
+            "isPositive": True
+        }
+    
+    change = ((current_value - prev_value) / prev_value) * 100
+    return {
+        "value": round(abs(change), 1),
+        "isPositive": change >= 0
+    }
+
+
+DAILY_PROJECTION = {'day': 1, 'scans': 1, 'malignant': 1, 'patients': 1}
+
+
+def daily_filter(doctor_id, now):
+    """Daily rollups covering both trend windows"""
+    previous_start = day_key(now - timedelta(days=2 * TREND_WINDOW_DAYS - 1))
+    return {'doctorId': doctor_id, 'day': {'$gte': previous_start}}
+
+
+def build_stats(totals, days, now):
+    """Build the /stats payload from the totals document and the daily documents.
+
+    The current window is the last 30 days including today; the previous
+    window is the 30 days before that.
+    """
+    current_start = day_key(now - timedelta(days=TREND_WINDOW_DAYS - 1))
+
+    windows = {
+        'current': {'scans': 0, 'malignant': 0, 'patients': set()},
+        'previous': {'scans': 0, 'malignant': 0, 'patients': set()}
+    }
+    for doc in days:
+        window = windows['current' if doc['day'] >= current_start else 'previous']
+        window['scans'] += doc.get('scans', 0)
+        window['malignant'] += doc.get('malignant', 0)
+        window['patients'].update(doc.get('patients', []))
+
+    totals = totals or {}
+    total_scans = totals.get('scans', 0)
+    success_rate = (totals.get('highConfidence', 0) / total_scans * 100) if total_scans > 0 else 0
+    current, previous = windows['current'], windows['previous']
+
+    return {
+        "total_scans": {
+            "value": total_scans,
+            "trend": calculate_trend(previous['scans'], current['scans'])
+        },
+        "detected_cases": {
+            "value": totals.get('malignant', 0),
+            "trend": calculate_trend(previous['malignant'], current['malignant'])
+        },
+        "success_rate": {
+            "value": round(success_rate, 1)
+        },
+        "active_patients": {
+            "value": len(current['patients']),
+            "trend": calculate_trend(len(previous['patients']), len(current['patients']))
+        }
+    }
+
+
+def compute_stats(db, doctor_id, now=None):
+    """Build the /stats payload from the rollup documents"""
+    now = now or datetime.now()
+    totals = db[TOTALS_COLLECTION].find_one({'_id': doctor_id})
+    # A copy per query: some drivers (mongomock) modify the projection they are given
+    days = db[DAILY_COLLECTION].find(daily_filter(doctor_id, now), dict(DAILY_PROJECTION))
+    return build_stats(totals, days, now)
+
+
+def backfill(db, doctor_id=None, batch_size=1000):
+    """Rebuild rollups from the scans collection; returns the number of daily documents written"""
+    match = {'timestamp': {'$type': 'date'}}
+    if doctor_id is not None:
+        match['doctorId'] = doctor_id
+
+    pipeline = [
+        {'$match': match},
+        {'$group': {
+            '_id': {
+                'doctorId': '$doctorId',
+                'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$timestamp'}}
+            },
+            'scans': {'$sum': 1},
+            'malignant': {'$sum': {'$cond': [{'$eq': ['$diagnosis', 'Malignant']}, 1, 0]}},
+            'highConfidence': {'$sum': {'$cond': [{'$gt': ['$confidence', HIGH_CONFIDENCE]}, 1, 0]}},
+            'patients': {'$addToSet': '$patientId'}
+        }}
+    ]
+
+    owner = {} if doctor_id is None else {'doctorId': doctor_id}
+    db[DAILY_COLLECTION].delete_many(owner)
+    db[TOTALS_COLLECTION].delete_many({} if doctor_id is None else {'_id': doctor_id})
+
+    totals = {}
+    operations = []
+    written = 0
+    for group in db.scans.aggregate(pipeline, allowDiskUse=True):
+        doctor, day = group['_id']['doctorId'], group['_id']['day']
+        operations.append(ReplaceOne(
+            {'_id': f"{doctor}|{day}"},
+            {
+                '_id': f"{doctor}|{day}",
+                'doctorId': doctor,
+                'day': day,
+                'scans': group['scans'],
+                'malignant': group['malignant'],
+                'highConfidence': group['highConfidence'],
+                'patients': group['patients']
+            },
+            upsert=True
+        ))
+        doctor_totals = totals.setdefault(doctor, {'scans': 0, 'malignant': 0, 'highConfidence': 0})
+        for field in doctor_totals:
+            doctor_totals[field] += group[field]
+
+        if len(operations) >= batch_size:
+            db[DAILY_COLLECTION].bulk_write(operations, ordered=False)
+            written += len(operations)
+            operations = []
+
+    if operations:
+        db[DAILY_COLLECTION].bulk_write(operations, ordered=False)
+        written += len(operations)
+    if totals:
+        db[TOTALS_COLLECTION].bulk_write(
+            [ReplaceOne({'_id': doctor}, {'_id': doctor, **counts}, upsert=True) for doctor, counts in totals.items()],
+            ordered=False
+        )
+
+    logger.info(f"Backfilled {written} daily rollups for {len(totals)} doctors")
+    return written
+
+
+if __name__ == '__main__':
+    from database import get_database
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Maintain the /stats rollup collections')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = subcommands.add_parser('backfill', help='Rebuild rollups from existing scans')
+    backfill_parser.add_argument('--doctor', help='Only rebuild this doctor')
+    args = parser.parse_args()
+
+    if args.command == 'backfill':
+        backfill(get_database(), doctor_id=args.doctor)
@@ -0,0 +1,96 @@
+"""Short-lived staging of uploaded scans between /predict and /save-record"""
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class StagedScan:
+    __slots__ = ('file_bytes', 'filename', 'prediction', 'model_version', 'doctor_id', 'expires_at')
+
+    def __init__(self, file_bytes, filename, prediction, model_version, doctor_id, expires_at):
+        self.file_bytes = file_bytes
+        self.filename = filename
+        self.prediction = prediction
+        self.model_version = model_version
+        self.doctor_id = doctor_id
+        self.expires_at = expires_at
+
+
+class ScanStagingStore:
+    """In-process store of scans that were predicted but not yet saved.
+
+    ``/predict`` stages the bytes it already received together with the
+    server-computed prediction and hands the client an opaque handle. A later
+    ``/save-record`` redeems the handle instead of uploading the image again.
+    Entries expire after ``ttl_seconds`` and the oldest ones are evicted once
+    ``max_bytes`` is exceeded. Handles are per worker process, so a handle
+    that is unknown here simply means the client must fall back to uploading.
+    """
+
+    def __init__(self, ttl_seconds=900, max_bytes=256 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def stage(self, file_bytes, filename, prediction, doctor_id, model_version=None):
+        """Stage a scan and return its handle, or None if it can never fit"""
+        if len(file_bytes) > self.max_bytes:
+            return None
+
+        handle = secrets.token_urlsafe(18)
+        entry = StagedScan(
+            file_bytes, filename, prediction, model_version, str(doctor_id), time.monotonic() + self.ttl_seconds
+        )
+        with self._lock:
+            self._purge_expired()
+            self._entries[handle] = entry
+            self._total_bytes += len(file_bytes)
+            while self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted.file_bytes)
+        return handle
+
+    def get(self, handle, doctor_id):
+        """Return the staged scan if the handle is live and owned by ``doctor_id``"""
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._remove(handle)
+                return None
+            if entry.doctor_id != str(doctor_id):
+                return None
+            return entry
+
+    def discard(self, handle):
+        with self._lock:
+            self._remove(handle)
+
+    def _remove(self, handle):
+        entry = self._entries.pop(handle, None)
+        if entry is not None:
+            self._total_bytes -= len(entry.file_bytes)
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        # Entries are in insertion order and share one TTL, so expired ones are at the front
+        while self._entries:
+            handle, entry = next(iter(self._entries.items()))
+            if entry.expires_at > now:
+                break
+            self._remove(handle)
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self._total_bytes,
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl_seconds
+        }
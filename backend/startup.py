@@ -0,0 +1,72 @@
+"""Startup bookkeeping: per-component readiness and a boot time breakdown"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'failed'
+DISABLED = 'disabled'
+
+
+class StartupTracker:
+    """Tracks the components initialised at boot and how long each step took.
+
+    Components start out pending and are marked ready, failed or disabled
+    (deliberately running without them). Steps are timed separately, so the
+    breakdown shows import, database, model load and first inference even
+    when several of them belong to one component.
+    """
+
+    def __init__(self, components, started_at=None):
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self._components = {name: {'status': PENDING, 'error': None} for name in components}
+        self._steps = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def step(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._steps[name] = round(time.perf_counter() - started, 3)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._steps[name] = round(seconds, 3)
+
+    def mark(self, component, status, error=None):
+        with self._lock:
+            self._components[component] = {'status': status, 'error': error}
+
+    def status(self, component):
+        return self._components[component]['status']
+
+    def pending(self, component):
+        return self._components[component]['status'] == PENDING
+
+    @property
+    def ready(self):
+        """True once nothing is pending or failed; disabled components do not block readiness"""
+        return all(state['status'] in (READY, DISABLED) for state in self._components.values())
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'ready': self.ready,
+                'components': {name: dict(state) for name, state in self._components.items()},
+                'startup_seconds': dict(self._steps),
+                'uptime_seconds': round(time.perf_counter() - self.started_at, 3)
+            }
+
+    def log_breakdown(self):
+        with self._lock:
+            steps = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in self._steps.items())
+            statuses = ', '.join(f"{name}={state['status']}" for name, state in self._components.items())
+        total = time.perf_counter() - self.started_at
+        logger.info(f"Startup finished in {total:.2f}s ({steps}); {statuses}")
@@ -0,0 +1,126 @@
+"""Shared fixtures: an in-memory MongoDB stand-in (mongomock) and the stub model from benchmarks/.
+
+Run from the backend directory with ``python -m pytest tests/``. The API tests
+drive async_app.py through ``init_services`` with mongomock_motor, so neither
+MongoDB nor TensorFlow is needed.
+"""
+import asyncio
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+from itertools import count
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'benchmarks'))
+
+# config.py reads these at import time, so they are set before any backend module is imported
+TEST_DATA_DIR = tempfile.mkdtemp(prefix='lungvision-tests-')
+os.environ.update({
+    'IMAGE_STORE_DIR': os.path.join(TEST_DATA_DIR, 'blobs'),
+    'IMAGE_STORE_FSYNC': 'false',
+    'THUMBNAIL_DIR': os.path.join(TEST_DATA_DIR, 'thumbnails'),
+    'BCRYPT_ROUNDS': '4',
+    'DISABLE_AUTH': 'false',
+    'PREDICTION_CACHE': 'true',
+    'PREDICTION_CACHE_SHARED': 'false',
+    'ACCESS_LOG': 'false',
+    'MODEL_RELOAD_INTERVAL_SECONDS': '0',
+})
+for name in ('MONGODB_URI', 'INFERENCE_POOL_ADDRESS', 'SHADOW_MODEL_PATH', 'SHADOW_ENGINE_FACTORY'):
+    os.environ.pop(name, None)
+
+import mongomock
+import pytest
+from PIL import Image
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(TEST_DATA_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()['lungvision_test']
+
+
+@pytest.fixture
+def stub_engine():
+    from stub_model import StubEngine
+
+    return StubEngine(batch_ms=0, image_ms=0)
+
+
+@pytest.fixture
+def image_store(tmp_path):
+    from image_store import ImageStore
+
+    return ImageStore(str(tmp_path / 'blobs'), fsync=False)
+
+
+@pytest.fixture
+def make_image():
+    """Encoded image bytes; different colours give the stub model different answers"""
+    def make(color=(120, 60, 30), size=(64, 64), image_format='PNG'):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, color).save(buffer, image_format)
+        return buffer.getvalue()
+    return make
+
+
+class ApiResponse:
+    def __init__(self, response, data):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.data = data
+        self.json = json.loads(data) if response.mimetype == 'application/json' and data else None
+
+
+class ApiClient:
+    """Synchronous wrapper around the Quart test client, running every request on one event loop"""
+
+    def __init__(self, loop, app):
+        self.loop = loop
+        self.client = app.test_client()
+        self._emails = count()
+
+    def request(self, method, path, **kwargs):
+        async def call():
+            response = await self.client.open(path, method=method, **kwargs)
+            return ApiResponse(response, await response.get_data())
+        return self.loop.run_until_complete(call())
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def signup(self):
+        """Register a fresh doctor; returns the Authorization headers for their token"""
+        response = self.post('/signup', json={
+            'email': f"doctor{next(self._emails)}@tests.local",
+            'password': 'correct horse',
+            'name': 'Test Doctor'
+        })
+        assert response.status_code == 200, response.json
+        return {'Authorization': f"Bearer {response.json['token']}"}
+
+
+@pytest.fixture(scope='session')
+def api():
+    """async_app.py on mongomock_motor with the stub model, shared by the whole session"""
+    from mongomock_motor import AsyncMongoMockClient
+    from stub_model import StubEngine
+
+    import async_app
+
+    loop = asyncio.new_event_loop()
+    database = AsyncMongoMockClient()['lungvision_test']
+    loop.run_until_complete(async_app.init_services(database=database, model=StubEngine(batch_ms=0, image_ms=0)))
+    yield ApiClient(loop, async_app.app)
+    loop.run_until_complete(async_app.shutdown())
+    loop.close()
@@ -0,0 +1,147 @@
+"""End-to-end checks of the HTTP API, through async_app.py on mongomock_motor with the stub model"""
+import io
+import json
+
+import pytest
+from quart.datastructures import FileStorage
+
+import async_app
+from staging import ScanStagingStore
+
+CLIENT_PREDICTION = json.dumps({
+    'predicted_class': 'Benign',
+    'confidence': 0.95,
+    'probabilities': {'benign': 0.95, 'malignant': 0.03, 'normal': 0.02}
+})
+
+
+@pytest.fixture
+def doctor(api):
+    headers = api.signup()
+    response = api.post('/patients', headers=headers, json={'name': 'Ada', 'age': 61, 'gender': 'F', 'patientId': None})
+    assert response.status_code == 200
+    return headers, response.json['patient']['id']
+
+
+def upload(data, filename='scan.png'):
+    return {'file': FileStorage(io.BytesIO(data), filename)}
+
+
+def save_upload(api, headers, patient_id, data):
+    response = api.post('/save-record', headers=headers, form={'patientId': patient_id, 'prediction': CLIENT_PREDICTION},
+                        files=upload(data))
+    assert response.status_code == 200, response.json
+    return response.json['recordId']
+
+
+def test_requests_need_a_token(api):
+    assert api.get('/history').status_code == 401
+    assert api.get('/history', headers={'Authorization': 'Bearer not-a-token'}).status_code == 401
+
+
+def test_repeat_predictions_come_from_the_cache(api, doctor, make_image):
+    headers, _ = doctor
+    data = make_image(color=(10, 200, 30))
+
+    first = api.post('/predict', headers=headers, files=upload(data))
+    assert first.status_code == 200
+    assert first.json['cached'] is False
+    assert first.json['modelVersion'] == 'stub-v1'
+    assert first.json['predicted_class'] in ('Benign', 'Malignant', 'Normal')
+
+    second = api.post('/predict', headers=headers, files=upload(data))
+    assert second.json['cached'] is True
+    assert second.json['probabilities'] == first.json['probabilities']
+
+
+def test_save_redeems_the_scan_handle_once(api, doctor, make_image):
+    headers, patient_id = doctor
+    predicted = api.post('/predict', headers=headers, files=upload(make_image(color=(7, 7, 200))))
+    handle = predicted.json['scanHandle']
+
+    saved = api.post('/save-record', headers=headers, form={'patientId': patient_id, 'scanHandle': handle})
+    assert saved.status_code == 200, saved.json
+
+    records = api.get(f"/history/{patient_id}", headers=headers).json
+    assert [record['id'] for record in records] == [saved.json['recordId']]
+    assert records[0]['diagnosis'] == predicted.json['predicted_class']
+    assert records[0]['modelVersion'] == 'stub-v1'
+
+    again = api.post('/save-record', headers=headers, form={'patientId': patient_id, 'scanHandle': handle})
+    assert again.status_code == 410
+    assert again.json['handleExpired'] is True
+
+
+def test_expired_scan_handle_answers_410(api, doctor, make_image, monkeypatch):
+    headers, patient_id = doctor
+    monkeypatch.setattr(async_app.services, 'scan_staging', ScanStagingStore(ttl_seconds=0))
+    handle = api.post('/predict', headers=headers, files=upload(make_image())).json['scanHandle']
+
+    response = api.post('/save-record', headers=headers, form={'patientId': patient_id, 'scanHandle': handle})
+    assert response.status_code == 410
+
+
+def test_history_pages_follow_the_next_cursor(api, doctor, make_image):
+    headers, patient_id = doctor
+    for index in range(5):
+        save_upload(api, headers, patient_id, make_image(color=(index, 100, 100)))
+    everything = api.get('/history', headers=headers)
+    assert 'X-Next-Cursor' not in everything.headers
+
+    seen = []
+    path = '/history?limit=2'
+    while path:
+        page = api.get(path, headers=headers)
+        assert page.status_code == 200
+        seen.extend(record['id'] for record in page.json)
+        cursor = page.headers.get('X-Next-Cursor')
+        path = f"/history?limit=2&cursor={cursor}" if cursor else None
+
+    assert seen == [record['id'] for record in everything.json]
+    assert len(seen) == 5
+    assert api.get('/history?cursor=bogus', headers=headers).status_code == 400
+
+
+def test_unchanged_data_answers_304(api, doctor, make_image):
+    headers, patient_id = doctor
+    for path in ('/history', '/patients', '/stats'):
+        first = api.get(path, headers=headers)
+        etag = first.headers['ETag']
+        cached = api.get(path, headers={**headers, 'If-None-Match': etag})
+        assert cached.status_code == 304, path
+        assert cached.data == b''
+
+    etag = api.get('/history', headers=headers).headers['ETag']
+    save_upload(api, headers, patient_id, make_image(color=(50, 50, 50)))
+    changed = api.get('/history', headers={**headers, 'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert len(changed.json) == 1
+
+
+def test_etags_are_per_doctor(api, doctor):
+    headers, _ = doctor
+    other = api.signup()
+    etag = api.get('/history', headers=headers).headers['ETag']
+    assert api.get('/history', headers={**other, 'If-None-Match': etag}).status_code == 200
+
+
+def test_stats_count_saved_scans(api, doctor, make_image):
+    headers, patient_id = doctor
+    for index in range(3):
+        save_upload(api, headers, patient_id, make_image(color=(index, 0, 0)))
+    stats = api.get('/stats', headers=headers).json
+    assert stats['total_scans']['value'] == 3
+    assert stats['success_rate']['value'] == 100.0
+    assert stats['active_patients']['value'] == 1
+
+
+def test_identical_uploads_share_one_blob(api, doctor, make_image):
+    headers, patient_id = doctor
+    data = make_image(color=(33, 66, 99))
+    first = save_upload(api, headers, patient_id, data)
+    second = save_upload(api, headers, patient_id, data)
+
+    images = [api.get(f"/scans/{record_id}/image", headers=headers) for record_id in (first, second)]
+    assert [image.status_code for image in images] == [200, 200]
+    assert images[0].data == images[1].data == data
@@ -0,0 +1,88 @@
+import time
+
+from cache import LRUCache, PredictionCache, content_hash
+from model_registry import ModelRegistry
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+
+
+def test_lru_entries_expire():
+    cache = LRUCache(ttl_seconds=0.05)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl_seconds=60)
+    time.sleep(0.1)
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+
+
+def test_prediction_key_includes_model_version():
+    cache = PredictionCache('v1')
+    data = b'scan bytes'
+    assert cache.key_for(data) == f"v1:{content_hash(data)}"
+    assert cache.key_for(data, 'v2') != cache.key_for(data)
+
+
+def test_prediction_cache_returns_copies():
+    cache = PredictionCache('v1')
+    key = cache.key_for(b'scan')
+    cache.set(key, {'predicted_class': 'Benign', 'probabilities': {'benign': 0.9}})
+    cache.get(key)['probabilities']['benign'] = 0.0
+    assert cache.get(key)['probabilities']['benign'] == 0.9
+    assert cache.stats()['hits'] == 2
+
+
+def test_model_change_invalidates_local_and_shared_entries(db):
+    cache = PredictionCache('v1', collection=db['prediction_cache'])
+    key = cache.key_for(b'scan')
+    cache.set(key, {'predicted_class': 'Benign'})
+
+    cache.set_model_version('v2')
+
+    assert len(cache.local) == 0
+    assert db['prediction_cache'].count_documents({}) == 0
+    assert cache.get(key) is None
+    assert cache.get(cache.key_for(b'scan')) is None
+
+
+def test_shared_entries_fill_the_local_tier(db):
+    writer = PredictionCache('v1', collection=db['prediction_cache'])
+    key = writer.key_for(b'scan')
+    writer.set(key, {'predicted_class': 'Normal'})
+
+    reader = PredictionCache('v1', collection=db['prediction_cache'])
+    assert reader.get(key) == {'predicted_class': 'Normal'}
+    assert reader.stats()['shared_hits'] == 1
+    assert reader.get(key) == {'predicted_class': 'Normal'}
+    assert reader.stats()['hits'] == 1
+
+
+class VersionedEngine:
+    name = 'test'
+
+    def __init__(self, version):
+        self.version = version
+
+    def predict(self, batch):
+        raise AssertionError('not called')
+
+
+def test_model_swap_invalidates_the_cache():
+    registry = ModelRegistry(drain_timeout=1)
+    registry.publish(VersionedEngine('v1'))
+    cache = PredictionCache('v1')
+    registry.listeners.append(cache.set_model_version)
+    cache.set(cache.key_for(b'scan'), {'predicted_class': 'Benign'})
+
+    registry.publish(VersionedEngine('v2'))
+
+    assert cache.model_version == 'v2'
+    assert len(cache.local) == 0
@@ -0,0 +1,58 @@
+import io
+import os
+from datetime import datetime, timedelta
+
+from image_store import BLOBS_COLLECTION, blob_ref_update, collect_garbage, image_mimetype
+
+
+def add_refs(db, stored, delta, now=None):
+    db[BLOBS_COLLECTION].update_one(*blob_ref_update(stored, delta, now=now), upsert=True)
+
+
+def test_identical_bytes_are_stored_once(image_store, make_image):
+    data = make_image()
+    first = image_store.put_bytes(data)
+    second = image_store.put_stream(io.BytesIO(data))
+
+    assert first.created and not second.created
+    assert first.digest == second.digest
+    assert first.path == image_store.path_for(first.digest)
+    assert first.path.endswith(os.path.join(first.digest[:2], first.digest[2:4], first.digest))
+    with open(first.path, 'rb') as f:
+        assert f.read() == data
+    assert os.listdir(os.path.join(image_store.root, 'tmp')) == []
+
+
+def test_blob_mimetype_comes_from_its_bytes(image_store, make_image):
+    stored = image_store.put_bytes(make_image(image_format='JPEG'))
+    assert image_mimetype(stored.path) == 'image/jpeg'
+
+
+def test_reference_counts(db, image_store, make_image):
+    stored = image_store.put_bytes(make_image())
+    add_refs(db, stored, 1)
+    add_refs(db, stored, 1)
+    add_refs(db, stored, -1)
+
+    blob = db[BLOBS_COLLECTION].find_one({'_id': stored.digest})
+    assert blob['refs'] == 1
+    assert blob['path'] == stored.path
+    assert blob['size'] == stored.size
+
+
+def test_gc_removes_only_unreferenced_blobs_past_the_grace_period(db, image_store, make_image):
+    old = datetime.now() - timedelta(hours=48)
+    referenced = image_store.put_bytes(make_image(color=(1, 1, 1)))
+    released = image_store.put_bytes(make_image(color=(2, 2, 2)))
+    recent = image_store.put_bytes(make_image(color=(3, 3, 3)))
+    add_refs(db, referenced, 1, now=old)
+    add_refs(db, released, 1, now=old)
+    add_refs(db, released, -1, now=old)
+    add_refs(db, recent, 0)
+
+    assert collect_garbage(db, image_store, grace_hours=24) == 1
+
+    assert not os.path.exists(released.path)
+    assert os.path.exists(referenced.path) and os.path.exists(recent.path)
+    assert db[BLOBS_COLLECTION].find_one({'_id': released.digest}) is None
+    assert db[BLOBS_COLLECTION].count_documents({}) == 2
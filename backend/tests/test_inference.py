@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from inference import INPUT_SHAPE, InferenceBatcher, QueueFullError, format_prediction
+
+
+def tensor(value):
+    return np.full(INPUT_SHAPE, value, dtype=np.float32)
+
+
+class RecordingModel:
+    """Returns each image's first pixel, so every caller can check it got its own row back"""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, batch):
+        self.batch_sizes.append(len(batch))
+        return batch[:, 0, 0, :]
+
+
+def test_queued_requests_share_forward_passes():
+    model = RecordingModel()
+    batcher = InferenceBatcher(model, max_batch_size=4, max_wait_ms=50)
+    # Queued before the worker starts, so the batches are deterministic
+    futures = [batcher.enqueue(tensor(index)) for index in range(6)]
+    batcher.start()
+    try:
+        results = [future.result(timeout=5) for future in futures]
+    finally:
+        batcher.stop()
+
+    assert model.batch_sizes == [4, 2]
+    for index, result in enumerate(results):
+        assert result.tolist() == [index] * 3
+    assert batcher.stats()['batch_size']['count'] == 2
+
+
+def test_submit_accepts_a_batch_of_one():
+    batcher = InferenceBatcher(RecordingModel(), max_wait_ms=0)
+    batcher.start()
+    try:
+        assert batcher.submit(tensor(7)[np.newaxis], timeout=5).tolist() == [7, 7, 7]
+    finally:
+        batcher.stop()
+
+
+def test_full_queue_rejects():
+    batcher = InferenceBatcher(RecordingModel(), max_queue_depth=2)
+    batcher.enqueue(tensor(0))
+    batcher.enqueue(tensor(1))
+    with pytest.raises(QueueFullError):
+        batcher.enqueue(tensor(2))
+    assert batcher.rejected_counter.value == 1
+
+
+def test_model_errors_reach_every_caller():
+    def broken(batch):
+        raise RuntimeError('out of memory')
+
+    batcher = InferenceBatcher(broken, max_batch_size=4)
+    futures = [batcher.enqueue(tensor(index)) for index in range(3)]
+    batcher.start()
+    try:
+        for future in futures:
+            with pytest.raises(RuntimeError, match='out of memory'):
+                future.result(timeout=5)
+    finally:
+        batcher.stop()
+
+
+def test_format_prediction():
+    prediction = format_prediction(np.array([0.1, 0.7, 0.2]))
+    assert prediction['predicted_class'] == 'Malignant'
+    assert prediction['confidence'] == pytest.approx(0.7)
+    assert set(prediction['probabilities']) == {'benign', 'malignant', 'normal'}
@@ -0,0 +1,66 @@
+import csv
+
+from image_store import BLOBS_COLLECTION, collect_garbage
+from indexes import ensure_indexes
+from ingest import IngestPipeline, SourceReader, read_manifest
+from rollups import TOTALS_COLLECTION
+
+
+def write_manifest(tmp_path, make_image, count):
+    source = tmp_path / 'source'
+    source.mkdir()
+    rows = []
+    for index in range(count):
+        (source / f"{index}.png").write_bytes(make_image(color=(index * 11 % 256, 90, 30)))
+        rows.append({'file': f"{index}.png", 'patientId': 'p1', 'timestamp': f"2024-02-{index % 28 + 1:02d}"})
+    rows.append({'file': 'missing.png', 'patientId': 'p1', 'timestamp': ''})
+    rows.append({'file': '0.png', 'patientId': 'someone-else', 'timestamp': ''})
+    manifest = tmp_path / 'manifest.csv'
+    with open(manifest, 'w', newline='') as f:
+        writer = csv.DictWriter(f, ['file', 'patientId', 'timestamp'])
+        writer.writeheader()
+        writer.writerows(rows)
+    return str(manifest), str(source)
+
+
+def run_pipeline(db, image_store, engine, manifest, source, checkpoint=None):
+    pipeline = IngestPipeline(
+        db, image_store, engine, 'd1', SourceReader(source), checkpoint_path=checkpoint,
+        readers=2, batch_size=4, write_batch_size=5, queue_depth=8
+    )
+    return pipeline.run(read_manifest(manifest))
+
+
+def test_reimport_adds_nothing(db, image_store, stub_engine, make_image, tmp_path):
+    ensure_indexes(db)
+    db.patients.insert_one({'_id': 'p1', 'doctorId': 'd1'})
+    manifest, source = write_manifest(tmp_path, make_image, 12)
+
+    report = run_pipeline(db, image_store, stub_engine, manifest, source, checkpoint=str(tmp_path / 'checkpoint'))
+    assert (report['inserted'], report['failed']) == (12, 2)
+    assert db.scans.count_documents({'doctorId': 'd1', 'modelVersion': stub_engine.version}) == 12
+
+    # Without the checkpoint every row is recognised by its ingestKey
+    report = run_pipeline(db, image_store, stub_engine, manifest, source)
+    assert (report['inserted'], report['duplicates']) == (0, 12)
+    assert db.scans.count_documents({}) == 12
+    assert sum(blob['refs'] for blob in db[BLOBS_COLLECTION].find()) == 12
+    assert db[TOTALS_COLLECTION].find_one({'_id': 'd1'})['scans'] == 12
+
+
+class BrokenModel:
+    version = 'broken'
+
+    def predict(self, batch):
+        raise RuntimeError('model crashed')
+
+
+def test_blobs_of_failed_rows_are_collectable(db, image_store, make_image, tmp_path):
+    db.patients.insert_one({'_id': 'p1', 'doctorId': 'd1'})
+    manifest, source = write_manifest(tmp_path, make_image, 3)
+
+    report = run_pipeline(db, image_store, BrokenModel(), manifest, source)
+    assert (report['inserted'], report['failed']) == (0, 5)
+    assert db[BLOBS_COLLECTION].count_documents({'refs': 0}) == 3
+
+    assert collect_garbage(db, image_store, grace_hours=-1) == 3
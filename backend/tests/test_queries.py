@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from queries import (
+    InvalidQueryError, decode_cursor, encode_cursor, history_pipeline, paginate, parse_limit, patients_cursor,
+    scan_filter
+)
+
+
+def test_cursor_round_trip():
+    timestamp = datetime(2024, 3, 1, 12, 30)
+    record_id = ObjectId()
+    assert decode_cursor(encode_cursor({'timestamp': timestamp, '_id': record_id})) == (timestamp, record_id)
+    assert decode_cursor(encode_cursor({'timestamp': timestamp, '_id': 'legacy-id'})) == (timestamp, 'legacy-id')
+
+
+@pytest.mark.parametrize('cursor', ['not-a-cursor', '', 'e30'])
+def test_invalid_cursor(cursor):
+    with pytest.raises(InvalidQueryError):
+        decode_cursor(cursor)
+
+
+def test_parse_limit():
+    assert parse_limit(None, default=50) == 50
+    assert parse_limit('5000', maximum=1000) == 1000
+    for value in ('0', 'ten'):
+        with pytest.raises(InvalidQueryError):
+            parse_limit(value)
+
+
+def test_keyset_pages_cover_every_scan_once(db):
+    base = datetime(2024, 1, 1)
+    # Several scans share a timestamp, so paging has to break ties on _id
+    db.scans.insert_many([
+        {'doctorId': 'd1', 'patientId': 'p1', 'timestamp': base + timedelta(hours=index // 3)}
+        for index in range(25)
+    ])
+    db.scans.insert_one({'doctorId': 'd2', 'patientId': 'p2', 'timestamp': base})
+
+    seen = []
+    cursor = None
+    while True:
+        pipeline = history_pipeline(scan_filter('d1'), limit=10, cursor=cursor, with_patient_names=False)
+        page, cursor = paginate(list(db.scans.aggregate(pipeline)), 10)
+        seen.extend(page)
+        if cursor is None:
+            break
+        assert len(page) == 10
+
+    expected = list(db.scans.find({'doctorId': 'd1'}).sort([('timestamp', -1), ('_id', -1)]))
+    assert [scan['_id'] for scan in seen] == [scan['_id'] for scan in expected]
+
+
+def test_history_joins_patient_names(db):
+    db.patients.insert_one({'_id': 'p1', 'name': 'Ada'})
+    db.scans.insert_many([
+        {'doctorId': 'd1', 'patientId': 'p1', 'timestamp': datetime(2024, 1, 2)},
+        {'doctorId': 'd1', 'patientId': 'gone', 'timestamp': datetime(2024, 1, 1)},
+    ])
+    records = list(db.scans.aggregate(history_pipeline(scan_filter('d1'))))
+    assert [record['patientName'] for record in records] == ['Ada', 'Unknown']
+
+
+def test_unsorted_patient_pages_are_stable(db):
+    db.patients.insert_many([{'_id': f"p{index}", 'doctorId': 'd1'} for index in (5, 1, 9, 3, 7)])
+    first = list(patients_cursor(db.patients, 'd1', skip=0, limit=2))
+    second = list(patients_cursor(db.patients, 'd1', skip=2, limit=2))
+    # limit + 1 documents are fetched to detect a further page
+    assert [patient['_id'] for patient in first] == ['p1', 'p3', 'p5']
+    assert [patient['_id'] for patient in second] == ['p5', 'p7', 'p9']
+
+
+def test_unknown_patient_sort(db):
+    with pytest.raises(InvalidQueryError):
+        patients_cursor(db.patients, 'd1', sort='age')
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from rescore import JOBS_COLLECTION, RescoreJob, Throttle
+from rollups import TOTALS_COLLECTION, backfill, record_scan
+from stub_model import StubEngine
+
+
+class RecordingStop:
+    def __init__(self):
+        self.waits = []
+
+    def wait(self, seconds):
+        self.waits.append(seconds)
+
+
+@pytest.mark.parametrize('settings', [{'duty_cycle': 0}, {'duty_cycle': 1.5}, {'max_rate': 0}, {'max_rate': -1}])
+def test_throttle_rejects_out_of_range_settings(settings):
+    with pytest.raises(ValueError):
+        Throttle(**settings)
+
+
+def test_throttle_keeps_to_the_duty_cycle():
+    stop = RecordingStop()
+    Throttle(duty_cycle=0.25).pause(1.0, 10, stop)
+    Throttle(duty_cycle=1).pause(1.0, 10, stop)
+    assert stop.waits == [pytest.approx(3.0)]
+
+
+def test_throttle_keeps_under_the_max_rate():
+    stop = RecordingStop()
+    Throttle(duty_cycle=1, max_rate=10).pause(0.5, 20, stop)
+    assert stop.waits == [pytest.approx(1.5)]
+
+
+class NewModel(StubEngine):
+    version = 'stub-v2'
+
+
+class StopAfterFirstBatch(Throttle):
+    def pause(self, busy_seconds, images, stop):
+        stop.set()
+
+
+def seed_scans(db, image_store, make_image, count):
+    base = datetime(2024, 1, 1)
+    for index in range(count):
+        stored = image_store.put_bytes(make_image(color=(index * 9 % 256, index * 31 % 256, 40)))
+        timestamp = base + timedelta(days=index % 5)
+        # Every old diagnosis is Benign, so the stub model changes some of them
+        db.scans.insert_one({
+            'doctorId': 'd1', 'patientId': 'p1', 'timestamp': timestamp, 'imagePath': stored.path,
+            'diagnosis': 'Benign', 'confidence': 0.5, 'modelVersion': 'stub-v1'
+        })
+        record_scan(db, 'd1', 'p1', timestamp, 'Benign', 0.5)
+
+
+def test_rescore_resumes_and_keeps_rollups_consistent(db, image_store, make_image):
+    seed_scans(db, image_store, make_image, 20)
+    db.scans.update_one({}, {'$set': {'imagePath': '/nonexistent/scan.png'}})
+
+    first = RescoreJob(db, NewModel(0, 0), batch_size=8, prefetch=2, throttle=StopAfterFirstBatch()).run()
+    assert first['status'] == 'stopped'
+    assert first['rescored'] + first['failed'] == 8
+
+    job = RescoreJob(db, NewModel(0, 0), batch_size=8, prefetch=2, throttle=Throttle(duty_cycle=1)).run()
+    assert job['status'] == 'finished'
+    assert job['rescored'] == 19 and job['failed'] == 1
+    assert job['changed'] > 0
+    assert db.scans.count_documents({'modelVersion': {'$ne': 'stub-v2'}}) == 1
+    assert db[JOBS_COLLECTION].find_one({'_id': 'stub-v2'})['lastId'] is not None
+    assert db.data_versions.find_one({'_id': 'd1'})['version'] >= 1
+
+    totals = db[TOTALS_COLLECTION].find_one({'_id': 'd1'})
+    backfill(db)
+    assert db[TOTALS_COLLECTION].find_one({'_id': 'd1'}) == totals
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+from rollups import (
+    DAILY_COLLECTION, TOTALS_COLLECTION, backfill, compute_stats, record_scan, rollup_corrections
+)
+
+NOW = datetime(2024, 6, 30, 12)
+
+SCANS = [
+    # (doctor, patient, days ago, diagnosis, confidence)
+    ('d1', 'p1', 0, 'Malignant', 0.95),
+    ('d1', 'p1', 1, 'Benign', 0.7),
+    ('d1', 'p2', 5, 'Normal', 0.99),
+    ('d1', 'p3', 40, 'Malignant', 0.6),
+    ('d1', 'p2', 45, 'Normal', 0.92),
+    ('d2', 'p9', 2, 'Malignant', 0.99),
+]
+
+
+def save_scans(db):
+    for doctor, patient, days_ago, diagnosis, confidence in SCANS:
+        timestamp = NOW - timedelta(days=days_ago)
+        db.scans.insert_one({
+            'doctorId': doctor, 'patientId': patient, 'timestamp': timestamp,
+            'diagnosis': diagnosis, 'confidence': confidence
+        })
+        record_scan(db, doctor, patient, timestamp, diagnosis, confidence)
+
+
+def test_incremental_rollups_match_backfill(db):
+    save_scans(db)
+    incremental = compute_stats(db, 'd1', now=NOW)
+
+    backfill(db)
+    assert compute_stats(db, 'd1', now=NOW) == incremental
+
+
+def test_stats_windows(db):
+    save_scans(db)
+    stats = compute_stats(db, 'd1', now=NOW)
+
+    assert stats['total_scans']['value'] == 5
+    assert stats['detected_cases']['value'] == 2
+    assert stats['success_rate']['value'] == 60.0
+    assert stats['active_patients']['value'] == 2
+    # 3 scans in the last 30 days against 2 in the 30 before
+    assert stats['total_scans']['trend'] == {'value': 50.0, 'isPositive': True}
+
+
+def test_stats_for_a_doctor_without_scans(db):
+    stats = compute_stats(db, 'nobody', now=NOW)
+    assert stats['total_scans'] == {'value': 0, 'trend': {'value': 0, 'isPositive': True}}
+    assert stats['success_rate']['value'] == 0
+
+
+def test_backfill_one_doctor_leaves_the_others(db):
+    save_scans(db)
+    db[TOTALS_COLLECTION].update_one({'_id': 'd2'}, {'$set': {'scans': 99}})
+
+    backfill(db, doctor_id='d1')
+
+    assert db[TOTALS_COLLECTION].find_one({'_id': 'd1'})['scans'] == 5
+    assert db[TOTALS_COLLECTION].find_one({'_id': 'd2'})['scans'] == 99
+
+
+def test_corrections_move_counts(db):
+    save_scans(db)
+    timestamp = NOW - timedelta(days=1)
+    for collection, query, update in rollup_corrections('d1', timestamp, ('Benign', 0.7), ('Malignant', 0.97)):
+        db[collection].update_one(query, update)
+    db.scans.update_one({'doctorId': 'd1', 'timestamp': timestamp}, {'$set': {'diagnosis': 'Malignant', 'confidence': 0.97}})
+
+    corrected = compute_stats(db, 'd1', now=NOW)
+    assert corrected['detected_cases']['value'] == 3
+    assert db[DAILY_COLLECTION].find_one({'_id': 'd1|2024-06-29'})['highConfidence'] == 1
+
+    backfill(db)
+    assert compute_stats(db, 'd1', now=NOW) == corrected
+
+
+def test_no_correction_when_counted_flags_are_unchanged():
+    assert rollup_corrections('d1', NOW, ('Benign', 0.5), ('Normal', 0.6)) == []
@@ -0,0 +1,40 @@
+from staging import ScanStagingStore
+
+PREDICTION = {'predicted_class': 'Benign', 'confidence': 0.8}
+
+
+def test_handle_is_redeemed_by_its_doctor_only():
+    store = ScanStagingStore()
+    handle = store.stage(b'scan', 'scan.png', PREDICTION, 'd1', model_version='v1')
+
+    staged = store.get(handle, 'd1')
+    assert staged.file_bytes == b'scan'
+    assert staged.model_version == 'v1'
+    assert store.get(handle, 'd2') is None
+    assert store.get('unknown', 'd1') is None
+
+
+def test_handles_expire():
+    store = ScanStagingStore(ttl_seconds=0)
+    handle = store.stage(b'scan', 'scan.png', PREDICTION, 'd1')
+    assert store.get(handle, 'd1') is None
+    assert store.stats()['entries'] == 0
+
+
+def test_oldest_scans_are_evicted_beyond_max_bytes():
+    store = ScanStagingStore(max_bytes=10)
+    first = store.stage(b'x' * 6, 'a.png', PREDICTION, 'd1')
+    second = store.stage(b'y' * 6, 'b.png', PREDICTION, 'd1')
+
+    assert store.get(first, 'd1') is None
+    assert store.get(second, 'd1') is not None
+    assert store.stats()['bytes'] == 6
+    assert store.stage(b'z' * 11, 'c.png', PREDICTION, 'd1') is None
+
+
+def test_discard():
+    store = ScanStagingStore()
+    handle = store.stage(b'scan', 'scan.png', PREDICTION, 'd1')
+    store.discard(handle)
+    assert store.get(handle, 'd1') is None
+    assert store.stats()['bytes'] == 0
@@ -0,0 +1,142 @@
+"""Scaled-down scan images for the history and report screens, cached on disk.
+
+A thumbnail is rendered the first time a (scan image, size) pair is asked
+for, written atomically under the cache directory and served from there on
+every later request. Because scan images are content-addressed, the image
+digest plus the size name is a key that never goes stale. The cache tracks
+the files it has seen in least-recently-served order and deletes the oldest
+ones once they add up to more than ``max_bytes``; every worker process keeps
+its own view, rebuilt from the directory (oldest mtime first) at startup.
+"""
+import io
+import logging
+import os
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+
+from PIL import Image
+
+from metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Concurrent misses for one key render once; other keys are not held up
+LOCK_STRIPES = 64
+
+
+def render_thumbnail(source_path, max_side, quality=85):
+    """JPEG bytes of the image scaled to fit in ``max_side`` x ``max_side``"""
+    with Image.open(source_path) as image:
+        # Lets the JPEG decoder downscale while decoding instead of after
+        image.draft('RGB', (max_side, max_side))
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.thumbnail((max_side, max_side))
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=quality)
+        return buffer.getvalue()
+
+
+class ThumbnailCache:
+    def __init__(self, root, max_bytes=256 * 1024 * 1024, quality=85):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.hits = Counter('thumbnail_cache_hits_total', 'Thumbnails served from the disk cache')
+        self.misses = Counter('thumbnail_cache_misses_total', 'Thumbnails rendered on request')
+        self.size_bytes = Gauge('thumbnail_cache_bytes', 'Bytes of cached thumbnails this worker knows of',
+                                fn=lambda: self._total_bytes)
+        self._entries = OrderedDict()  # relative path -> size, least recently served first
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._render_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        found = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                if name.endswith('.part'):
+                    continue
+                stat = os.stat(path)
+                found.append((stat.st_mtime, os.path.relpath(path, self.root), stat.st_size))
+        for _, relative, size in sorted(found):
+            self._entries[relative] = size
+            self._total_bytes += size
+        self._evict()
+
+    @staticmethod
+    def _relative_path(key, size_name):
+        return os.path.join(size_name, key[:2], f"{key}.jpg")
+
+    def get(self, source_path, key, size_name, max_side):
+        """Path of the cached thumbnail, rendering it from ``source_path`` on a miss"""
+        relative = self._relative_path(key, size_name)
+        path = os.path.join(self.root, relative)
+        if self._touch(relative, path):
+            return path
+
+        with self._render_locks[zlib.crc32(relative.encode()) % LOCK_STRIPES]:
+            # Another thread may have rendered it while this one waited
+            if self._touch(relative, path):
+                return path
+            data = render_thumbnail(source_path, max_side, self.quality)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+        self.misses.inc()
+        with self._lock:
+            self._add(relative, len(data))
+            self._evict()
+        return path
+
+    def _touch(self, relative, path):
+        """Count a hit and mark the entry recently served, if the file is on disk"""
+        with self._lock:
+            known = relative in self._entries
+            if known:
+                self._entries.move_to_end(relative)
+        if not known:
+            # Rendered by another worker process, or not at all
+            try:
+                size = os.stat(path).st_size
+            except FileNotFoundError:
+                return False
+            with self._lock:
+                self._add(relative, size)
+                self._evict()
+        elif not os.path.exists(path):
+            # Evicted by another worker process
+            with self._lock:
+                self._total_bytes -= self._entries.pop(relative, 0)
+            return False
+        self.hits.inc()
+        return True
+
+    def _add(self, relative, size):
+        self._total_bytes += size - self._entries.pop(relative, 0)
+        self._entries[relative] = size
+
+    def _evict(self):
+        # Keep at least the newest entry: it is about to be served
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            relative, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.unlink(os.path.join(self.root, relative))
+            except FileNotFoundError:
+                pass
+
+    def metrics(self):
+        return [self.hits, self.misses, self.size_bytes]
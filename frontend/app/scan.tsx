@@ -79,6 +79,8 @@ export default function ScanScreen() {
       benign: number;
     };
   } | null>(null);
+  // Server-side handle for the image already uploaded to /predict, so saving needs no re-upload
+  const [scanHandle, setScanHandle] = useState<string | null>(null);
   const [showSuccessPopup, setShowSuccessPopup] = useState(false);
   const router = useRouter();
   const { isAuthenticated } = useContext(AuthContext);
@@ -331,6 +333,7 @@ export default function ScanScreen() {
 
       if (response.data) {
         setPrediction(response.data);
+        setScanHandle(response.data.scanHandle || null);
       } else {
         throw new Error('No data received from server');
       }
@@ -355,6 +358,7 @@ export default function ScanScreen() {
       
       Alert.alert("Error", errorMessage);
       setPrediction(null);
+      setScanHandle(null);
     } finally {
       setIsLoading(false);
     }
@@ -381,25 +385,31 @@ export default function ScanScreen() {
     try {
       setIsSaving(true);
       
-      // Create form data
-      const formData = new FormData();
-      
-      // Append the file with proper filename
-      const filename = `${patientId}_${Date.now()}.${selectedFile.fileType}`;
-      formData.append('file', selectedFile.blob, filename);
-      
-      // Append patient ID
-      formData.append('patientId', patientId);
-      
-      // Append prediction data along with patient notes
-      formData.append('prediction', JSON.stringify({
-        ...prediction,
-        medicalHistory: patientMedicalHistory,
-        doctorNotes: patientDoctorNotes,
-      }));
+      const buildFormData = (includeFile: boolean) => {
+        const formData = new FormData();
+        
+        if (includeFile) {
+          // Append the file with proper filename
+          const filename = `${patientId}_${Date.now()}.${selectedFile.fileType}`;
+          formData.append('file', selectedFile.blob, filename);
+        } else if (scanHandle) {
+          // The server still holds the image from /predict
+          formData.append('scanHandle', scanHandle);
+        }
+        
+        // Append patient ID
+        formData.append('patientId', patientId);
+        
+        // Append prediction data along with patient notes
+        formData.append('prediction', JSON.stringify({
+          ...prediction,
+          medicalHistory: patientMedicalHistory,
+          doctorNotes: patientDoctorNotes,
+        }));
+        return formData;
+      };
       
-      // Send to server
-      const response = await axios.post(`${API_URL}/save-record`, formData, {
+      const postRecord = (formData: FormData) => axios.post(`${API_URL}/save-record`, formData, {
         headers: {
           'Content-Type': 'multipart/form-data',
           'Accept': 'application/json',
@@ -410,6 +420,19 @@ export default function ScanScreen() {
         },
         timeout: 30000,
       });
+      
+      // Send to server, re-uploading the image only if the scan handle has expired
+      let response;
+      try {
+        response = await postRecord(buildFormData(!scanHandle));
+      } catch (error: any) {
+        if (scanHandle && error.response?.status === 410) {
+          setScanHandle(null);
+          response = await postRecord(buildFormData(true));
+        } else {
+          throw error;
+        }
+      }
 
       console.log('Save response:', response.data);
 
@@ -450,6 +473,7 @@ export default function ScanScreen() {
     } else if (action === 'new') {
       setImage(null);
       setPrediction(null);
+      setScanHandle(null);
       setSelectedFile(null);
       setPatientId(null);
     } else if (action === 'report') {
@@ -598,6 +622,7 @@ export default function ScanScreen() {
                         onPress={() => {
                           setImage(null);
                           setPrediction(null);
+                          setScanHandle(null);
                           setSelectedFile(null);
                         }}
                       >
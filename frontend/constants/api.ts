@@ -8,6 +8,7 @@ export const API_ROUTES = {
   LOGIN: '/login',
   SIGNUP: '/signup',
   PREDICT: '/predict',
+  PREDICT_BATCH: '/predict/batch',
   HISTORY: '/history',
   STATS: '/stats',
 }; 
\ No newline at end of file